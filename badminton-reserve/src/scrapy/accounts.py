@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+複数アカウントの同時予約
+
+クラブの登録メンバー（.env の ACCOUNTS）ごとに別プロセス・別ブラウザコンテキストで
+book_days を同時に走らせる。どの日・どの週を誰が押さえたかはファイルの台帳（Ledger）で
+共有し、2つのアカウントが同じ日・同じ週を取り合わないようにする。
+全体の上限は MAX_DAYS 日（1週1日）のまま。
+
+.env:
+    ACCOUNTS=ID1:PASS1,ID2:PASS2,ID3:PASS3
+
+Usage:
+    python auto_reserve.py --accounts
+    python auto_reserve.py --accounts --prewarm-until 09:00:00
+"""
+
+import fcntl
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import auto_reserve as ar
+from auto_reserve import WEEKDAY_JA, debug
+
+# 子プロセスへ引き継ぐ設定値（main() や --targets で書き換わるもの）
+SHARED_SETTINGS = [
+    "BASE_URL", "FACILITY_NAME", "CATEGORY_ID", "ROOM_LABEL", "WANTED_SLOTS",
+    "WEEKDAY_PRIORITY", "WEEK_PRIORITY", "MAX_DAYS", "DRY_RUN", "DIAG_LEVEL", "DIAG_RING_SIZE",
+    "ENGINE", "RESTORE_MODE", "BATCH", "NINZU", "MOKUTEKI", "HISTORY_DB", "BLOCKING",
+    "ASSET_CACHE", "ASSET_CACHE_DIR", "ATTACH", "BROWSER_ENDPOINT", "SPECULATE",
+    "SELECTOR_CACHE_PATH",
+]
+# 申込中のまま更新されない押さえ（プロセスが落ちた等）を無効とみなすまでの秒数
+CLAIM_TTL = 120
+
+
+def parse_accounts(spec: str) -> list[tuple[str, str]]:
+    """"ID1:PASS1,ID2:PASS2" を [(ID, PASS)] にする"""
+    accounts = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        login_id, sep, password = item.partition(":")
+        if not sep or not login_id or not password:
+            raise ValueError(f"ACCOUNTS の書式が不正です: {login_id or item!r}（ID:PASS をカンマ区切り）")
+        accounts.append((login_id, password))
+    return accounts
+
+
+# ====== 共有台帳 ======
+class Ledger:
+    """
+    アカウント間で共有する「押さえた日」の台帳（JSON ファイル + flock）。
+    claim で日と週を押さえてから申込み、settle で確定（booked）か取り消しにする。
+    """
+
+    def __init__(self, path: Path, owner: str, limit: int):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(self.path.suffix + ".lock")
+        self.owner = owner
+        self.limit = limit
+
+    def _transact(self, fn):
+        """ロックを取って台帳を読み、fn(entries) を実行して書き戻す"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    entries = json.loads(self.path.read_text(encoding="utf-8"))
+                except (FileNotFoundError, ValueError):
+                    entries = {}
+                now = time.time()
+                entries = {
+                    ymd: e for ymd, e in entries.items()
+                    if e["state"] == "booked" or now - e["at"] < CLAIM_TTL
+                }
+                result = fn(entries)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+                os.replace(tmp, self.path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def claim(self, ymd: str, week: int) -> bool:
+        """ymd（とその週）を押さえる。他のアカウントが同じ日・週を押さえ済み、
+        または全体で limit 日に達している場合は False。"""
+        def fn(entries):
+            if ymd in entries:
+                return entries[ymd]["owner"] == self.owner and entries[ymd]["state"] == "claimed"
+            if any(e["week"] == week for e in entries.values()):
+                return False
+            if len(entries) >= self.limit:
+                return False
+            entries[ymd] = {"owner": self.owner, "week": week, "state": "claimed", "at": time.time()}
+            return True
+        return self._transact(fn)
+
+    def settle(self, ymd: str, ok: bool):
+        """申込結果を記録する（成功=booked、失敗=押さえを外す）"""
+        def fn(entries):
+            e = entries.get(ymd)
+            if not e or e["owner"] != self.owner:
+                return
+            if ok:
+                e.update(state="booked", at=time.time())
+            else:
+                del entries[ymd]
+        self._transact(fn)
+
+    def weeks_taken(self) -> set[int]:
+        """他のアカウントが押さえている・予約済みの週"""
+        return self._transact(lambda entries: {e["week"] for e in entries.values() if e["owner"] != self.owner})
+
+    def snapshot(self) -> dict:
+        return self._transact(lambda entries: dict(entries))
+
+
+# ====== ワーカー（子プロセス） ======
+def _account_worker(login_id: str, password: str, target_month: datetime, settings: dict,
+                    ledger_path: str, headless: bool, deadline: datetime | None, clock_sync: bool) -> dict:
+    """1アカウント分: 自分専用のブラウザコンテキストで（必要なら事前待機してから）book_days を実行"""
+    from playwright.sync_api import sync_playwright
+
+    for name, value in settings.items():
+        setattr(ar, name, value)
+    ar.LOGIN_ID, ar.LOGIN_PASSWORD = login_id, password
+    ar.USER_DATA_DIR = Path(settings.get("USER_DATA_DIR", ar.USER_DATA_DIR)).with_name(f"udata_{login_id}")
+    ar.LEDGER = Ledger(Path(ledger_path), login_id, ar.MAX_DAYS)
+
+    t0 = time.perf_counter()
+    error = None
+    booked: list[datetime] = []
+    with sync_playwright() as p:
+        ctx = ar.launch_context(p, headless)
+        page = ctx.new_page()
+        page.set_default_navigation_timeout(30000)
+        try:
+            if deadline is not None:
+                ar.prewarm(ctx, page, target_month, deadline, clock_sync=clock_sync)
+                t0 = time.perf_counter()
+                booked = ar.book_days(page, target_month, prepared=True)
+            else:
+                booked = ar.book_days(page, target_month)
+        except Exception as exc:
+            error = str(exc)
+            ar.save_diag(page, f"error_{login_id}", level=1)
+        finally:
+            ar.write_timeline(f"timeline_{login_id}")
+            ar.flush_history()
+            ar.flush_selector_cache()
+            if ar.ASSET_CACHE:
+                import asset_cache
+
+                asset_cache.flush()
+            ar.stop_tracing(ctx, f"trace_{login_id}")
+            ar.flush_diag()
+            ctx.close()
+    return {
+        "account": login_id,
+        "booked": [d.strftime("%Y-%m-%d") for d in booked],
+        "sec": time.perf_counter() - t0,
+        "error": error,
+    }
+
+
+def run_accounts(accounts: list[tuple[str, str]], target_month: datetime, headless: bool = True,
+                 deadline: datetime | None = None, clock_sync: bool = True,
+                 ledger_path: Path | None = None) -> dict:
+    """
+    アカウントごとにプロセスを起こして同時に予約し、結果を1つにまとめる。
+    戻り値: {"booked": [日付], "accounts": [各ワーカーの結果], "ledger": 台帳, "wall_sec": 秒}
+    """
+    if ledger_path is None:
+        ledger_path = ar.LOG_DIR / f"ledger_{target_month.strftime('%Y%m')}.json"
+    Path(ledger_path).unlink(missing_ok=True)
+    settings = {name: getattr(ar, name) for name in SHARED_SETTINGS}
+    settings["USER_DATA_DIR"] = str(ar.USER_DATA_DIR)
+    debug(f"[accounts] {len(accounts)}アカウントで同時に予約: {', '.join(a for a, _ in accounts)}")
+
+    t0 = time.perf_counter()
+    results = []
+    # Playwright はプロセスごとに初期化し直すので fork ではなく spawn で起こす
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(accounts), mp_context=ctx) as pool:
+        futures = [
+            pool.submit(_account_worker, login_id, password, target_month, settings,
+                        str(ledger_path), headless, deadline, clock_sync)
+            for login_id, password in accounts
+        ]
+        for (login_id, _), fut in zip(accounts, futures):
+            try:
+                results.append(fut.result())
+            except Exception as exc:
+                results.append({"account": login_id, "booked": [], "sec": 0.0, "error": str(exc)})
+    wall = time.perf_counter() - t0
+
+    ledger = Ledger(Path(ledger_path), "", ar.MAX_DAYS).snapshot()
+    booked = sorted({d for r in results for d in r["booked"]})
+    report = {"booked": booked, "accounts": results, "ledger": ledger, "wall_sec": wall}
+    report_accounts(report)
+    return report
+
+
+def report_accounts(report: dict):
+    """アカウント別の結果と全体の件数・所要時間を出力し、diag/ に JSON で残す"""
+    debug(f"[accounts] 合計 {len(report['booked'])}日 / {report['wall_sec']:.2f}s")
+    for r in report["accounts"]:
+        days = ", ".join(
+            f"{d}({WEEKDAY_JA[datetime.strptime(d, '%Y-%m-%d').weekday()]})" for d in r["booked"]
+        ) or "なし"
+        status = f" ERROR: {r['error']}" if r["error"] else ""
+        debug(f"[accounts]   {r['account']}: {len(r['booked'])}日 {r['sec']:.2f}s [{days}]{status}")
+    if ar.DIAG_LEVEL < 1:
+        return
+    try:
+        ar.LOG_DIR.mkdir(parents=True, exist_ok=True)
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        (ar.LOG_DIR / f"accounts_{ts}.json").write_text(
+            json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    except Exception as exc:
+        debug(f"[accounts] 結果の保存に失敗: {exc}")
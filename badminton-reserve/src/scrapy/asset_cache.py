@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+静的ファイル（JS）のディスクキャッシュ
+
+毎回の画面遷移で読み直される jQuery・サイトの共通スクリプト（__doPostBack 等）を
+ASSET_CACHE_DIR に保存しておき、2回目以降はルートの fulfill でディスクから返す。
+9:00 の混雑時にサーバーへ取りに行くのは文書（ページ・ポストバック）だけになる。
+
+- キーは URL（?LastUpdDate= 等のクエリ込み）。サイト側が更新すればキーが変わる。
+- ETag / Last-Modified を保存し、ASSET_CACHE_TTL を過ぎた項目は条件付きリクエストで
+  確認し直す（304 ならそのまま、200 なら差し替え）。prewarm の待機前にまとめて確認する。
+- 本文の sha256 を索引に持ち、返す前に照合する。一致しなければ捨ててネットワークへ。
+- 合計が ASSET_CACHE_MAX_BYTES を超えたら、最後に使ったのが古いものから消す（LRU）。
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import auto_reserve as ar
+from auto_reserve import debug
+
+# キャッシュ対象（スクリプトだけ。文書・ポストバックは常にネットワーク）
+ASSET_RE = re.compile(r"\.js(?:[?#]|$)", re.IGNORECASE)
+# fulfill で返すときに残すレスポンスヘッダー
+KEPT_HEADERS = ("content-type", "etag", "last-modified", "cache-control")
+# 確認し直さずに使う期間（秒）
+ASSET_CACHE_TTL = 12 * 3600
+ASSET_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class AssetCache:
+    """URL → 本文ファイル + 索引（index.json）のディスクキャッシュ"""
+
+    def __init__(self, root: Path, max_bytes: int = ASSET_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.index_path = self.root / "index.json"
+        try:
+            self.index: dict[str, dict] = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0, "replaced": 0, "corrupt": 0}
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key: str) -> Path:
+        return self.root / f"{key}.body"
+
+    def save_index(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.index, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def lookup(self, url: str) -> tuple[dict, bytes] | None:
+        """保存済みの (索引エントリ, 本文)。本文の sha256 が合わなければ捨てて None"""
+        key = self._key(url)
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        try:
+            body = self._body_path(key).read_bytes()
+        except FileNotFoundError:
+            body = None
+        if body is None or hashlib.sha256(body).hexdigest() != entry["sha256"]:
+            self.stats["corrupt"] += 1
+            debug(f"[asset] 本文が索引と一致しません → 破棄: {url}")
+            self.evict(key)
+            return None
+        entry["used_at"] = time.time()
+        return entry, body
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["validated_at"] < ASSET_CACHE_TTL
+
+    def validators(self, entry: dict) -> dict[str, str]:
+        """条件付きリクエストのヘッダー"""
+        headers = {}
+        if entry["headers"].get("etag"):
+            headers["if-none-match"] = entry["headers"]["etag"]
+        if entry["headers"].get("last-modified"):
+            headers["if-modified-since"] = entry["headers"]["last-modified"]
+        return headers
+
+    def mark_validated(self, url: str):
+        """304 を受けた: 本文はそのまま、確認時刻だけ更新"""
+        entry = self.index.get(self._key(url))
+        if entry:
+            entry["validated_at"] = time.time()
+            self.stats["revalidated"] += 1
+            self.save_index()
+
+    def store(self, url: str, status: int, headers: dict[str, str], body: bytes):
+        """200 のレスポンスを保存する（no-store は保存しない）"""
+        headers = {k.lower(): v for k, v in headers.items()}
+        if status != 200 or "no-store" in headers.get("cache-control", ""):
+            return
+        key = self._key(url)
+        if key in self.index:
+            self.stats["replaced"] += 1
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._body_path(key).write_bytes(body)
+        now = time.time()
+        self.index[key] = {
+            "url": url,
+            "headers": {k: headers[k] for k in KEPT_HEADERS if k in headers},
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "size": len(body),
+            "stored_at": now,
+            "validated_at": now,
+            "used_at": now,
+        }
+        self._evict_over_budget()
+        self.save_index()
+
+    def evict(self, key: str):
+        self.index.pop(key, None)
+        self._body_path(key).unlink(missing_ok=True)
+
+    def _evict_over_budget(self):
+        total = sum(e["size"] for e in self.index.values())
+        for key, entry in sorted(self.index.items(), key=lambda kv: kv[1]["used_at"]):
+            if total <= self.max_bytes:
+                break
+            debug(f"[asset] 容量超過 → 削除: {entry['url']}")
+            total -= entry["size"]
+            self.evict(key)
+
+    def stale_urls(self) -> list[str]:
+        return [e["url"] for e in self.index.values() if not self.is_fresh(e)]
+
+
+# ====== Playwright への組み込み ======
+# 実行中のキャッシュ（install で作る）
+CACHE: AssetCache | None = None
+
+
+def _handled(route) -> bool:
+    """キャッシュで扱うリクエストか（遮断対象は他のハンドラー・ブラウザに任せる）"""
+    return route.request.method == "GET" and not ar.blocked_url_regex().search(route.request.url)
+
+
+def _fetch_headers(route, cached) -> dict[str, str]:
+    """ブラウザ自身の条件付きヘッダーは外し、キャッシュの検証子だけを付ける"""
+    headers = {k: v for k, v in route.request.headers.items()
+               if k.lower() not in ("if-none-match", "if-modified-since")}
+    return {**headers, **(CACHE.validators(cached[0]) if cached else {})}
+
+
+def handle_asset(route):
+    """スクリプトのリクエストをキャッシュから返す（新しければそのまま、古ければ条件付きで確認）"""
+    if not _handled(route):
+        route.fallback()
+        return
+    url = route.request.url
+    cached = CACHE.lookup(url)
+    if cached and CACHE.is_fresh(cached[0]):
+        CACHE.stats["hit"] += 1
+        route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        return
+    try:
+        response = route.fetch(headers=_fetch_headers(route, cached))
+    except Exception as e:
+        debug(f"[asset] 取得失敗 ({e}): {url}")
+        if cached:
+            route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        else:
+            route.fallback()
+        return
+    if response.status == 304 and cached:
+        CACHE.mark_validated(url)
+        route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        return
+    CACHE.stats["miss"] += 1
+    body = response.body()
+    CACHE.store(url, response.status, response.headers, body)
+    route.fulfill(response=response, body=body)
+
+
+async def handle_asset_async(route):
+    """handle_asset の playwright.async_api 版"""
+    if not _handled(route):
+        await route.fallback()
+        return
+    url = route.request.url
+    cached = CACHE.lookup(url)
+    if cached and CACHE.is_fresh(cached[0]):
+        CACHE.stats["hit"] += 1
+        await route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        return
+    try:
+        response = await route.fetch(headers=_fetch_headers(route, cached))
+    except Exception as e:
+        debug(f"[asset] 取得失敗 ({e}): {url}")
+        if cached:
+            await route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        else:
+            await route.fallback()
+        return
+    if response.status == 304 and cached:
+        CACHE.mark_validated(url)
+        await route.fulfill(status=200, headers=cached[0]["headers"], body=cached[1])
+        return
+    CACHE.stats["miss"] += 1
+    body = await response.body()
+    CACHE.store(url, response.status, response.headers, body)
+    await route.fulfill(response=response, body=body)
+
+
+def _open(root: Path | None):
+    global CACHE
+    root = Path(root or ar.ASSET_CACHE_DIR)
+    if CACHE is None or CACHE.root != root:
+        CACHE = AssetCache(root)
+
+
+def install(ctx, root: Path | None = None):
+    """コンテキストにスクリプトのキャッシュを設定する"""
+    _open(root)
+    ctx.route(ASSET_RE, handle_asset)
+
+
+async def install_async(ctx, root: Path | None = None):
+    _open(root)
+    await ctx.route(ASSET_RE, handle_asset_async)
+
+
+def revalidate(ctx):
+    """TTL を過ぎた項目を条件付きリクエストで確認し直す（prewarm の待機前に呼ぶ）"""
+    if CACHE is None:
+        return
+    for url in CACHE.stale_urls():
+        cached = CACHE.lookup(url)
+        if not cached:
+            continue
+        try:
+            response = ctx.request.get(url, headers=CACHE.validators(cached[0]))
+        except Exception as e:
+            debug(f"[asset] 確認失敗 ({e}): {url}")
+            continue
+        if response.status == 304:
+            CACHE.mark_validated(url)
+        else:
+            CACHE.store(url, response.status, response.headers, response.body())
+    debug(f"[asset] {len(CACHE.index)}件 / {sum(e['size'] for e in CACHE.index.values()) // 1024}KB 確認済み")
+
+
+def flush():
+    """ヒット数等を出力し、最終使用時刻を索引に書き戻す"""
+    if CACHE is None:
+        return
+    if any(CACHE.stats.values()):
+        debug("[asset] " + " ".join(f"{k}={v}" for k, v in CACHE.stats.items()))
+    try:
+        CACHE.save_index()
+    except Exception as e:
+        debug(f"[asset] 索引の保存に失敗: {e}")
@@ -10,46 +10,168 @@ AUTO_SUBMIT=False の場合は確定ボタンを押す前で停止する。
 Usage:
     python auto_reserve.py                    # 来月分を最大5日予約
     python auto_reserve.py --test             # テストモード（4月分、ふるさと千川の部屋）
+    python auto_reserve.py --parallel 3       # 3タブで候補日を同時に予約
+    python auto_reserve.py --engine async     # playwright.async_api 版エンジンで実行
+    python auto_reserve.py --engine http      # カレンダー以降を HTTP で直接ポスト（失敗時はブラウザ）
+    python auto_reserve.py --prewarm-until 09:00:00  # 事前にカレンダーで待機し 9:00 ちょうどに開始
+    python auto_reserve.py --targets targets.toml  # 設定ファイルの複数施設・部屋を同時にスキャンして予約
+    python auto_reserve.py --accounts         # .env の ACCOUNTS の全アカウントで同時に予約
+    python auto_reserve.py --batch            # 候補日をまとめて1回で申込（失敗した日だけ外して再申込）
+    python auto_reserve.py --restore full     # 予約後の復帰を毎回施設選択から（従来の経路）
+    python auto_reserve.py --blocking route   # 不要リソースの判定を従来どおり全リクエスト Python で行う
+    python auto_reserve.py --no-asset-cache   # jQuery 等のスクリプトを asset_cache/ から返さない
+    python auto_reserve.py --attach           # 常駐ブラウザ（python browser_server.py）に接続して実行
+    python auto_reserve.py --watch            # 常駐して今月・来月のキャンセルで空いた希望日を予約
+    python auto_reserve.py --no-history       # 空き状況を history.sqlite3 に記録せず、履歴の競合度も使わない
 """
 
 import argparse
+import copy
+import csv
+import functools
+import http.client
+import json
 import os
+import queue
 import re
+import statistics
 import sys
+import threading
+import time
+import tomllib
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
 
 import holidays
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
 
 JP_HOLIDAYS = holidays.Japan()
+# 予約サイトは日本時間で動く（GitHub Actions のランナーは UTC）
+JST = ZoneInfo("Asia/Tokyo")
 
 # ====== 設定 ======
 BASE_URL = "https://www2.pf489.com/toshima/WebR/Home/WgR_ModeSelect"
 FACILITY_NAME = "ふるさと千川館"
+# ModeSelect のカテゴリボタン（#category_<ID>）。18=ふるさと千川館
+CATEGORY_ID = 18
 ROOM_LABEL = "多目的ホール"
 WANTED_SLOTS = ["18:30~19:30", "19:30~20:30", "20:30~21:30"]
 MAX_DAYS = 5
 # 曜日優先順位: 月(0)→火(1)→水(2)→木(3)
 WEEKDAY_PRIORITY = [0, 1, 2, 3]
+# 週の優先順位: 第3週→第4週→第5週→第2週→第1週（後半週が競合少ない傾向）
+# 試す順番は履歴（HISTORY_DB）が十分に溜まっていればそちらの競合度を優先する
+WEEK_PRIORITY = [3, 4, 5, 2, 1]
 DRY_RUN = False
 USER_DATA_DIR = Path(__file__).parent / "udata"
 LOG_DIR = Path(__file__).parent / "diag"
-# 診断レベル: 0=なし, 1=エラー時のみ, 2=全ステップ
+# 空き状況の履歴（history.py の SQLite）。None なら記録も参照もしない
+HISTORY_DB: Path | None = Path(__file__).parent / "history.sqlite3"
+# 診断レベル: 0=なし, 1=エラー時のみ, 2=全ステップ（+ Playwright のトレース）
 DIAG_LEVEL = 1
+# エラー時に一緒に書き出す直前のステップ数（リングバッファに HTML だけ持っておく）。
+# 書き出さないステップでも page.content を1回取る。0 なら持たない（page.content も呼ばない）
+DIAG_RING_SIZE = 3
+# バックグラウンドで書き出し待ちにできるファイル数（超えた分は捨てる）
+DIAG_QUEUE_SIZE = 200
+# 並列予約のタブ数: 0=逐次（従来）, N=最大Nタブで同時に予約
+PARALLEL_TABS = 0
+# 予約エンジン: sync=Playwright(同期), async=Playwright(非同期), http=カレンダー以降を HTTP で直接ポスト
+ENGINE = "sync"
+# 一括申込: 週ごとに1日ずつ選んだ候補日を1回の申込にまとめる
+BATCH = False
+# 複数アカウントで同時に動かすときの共有台帳（accounts.Ledger）。None なら単独実行
+LEDGER = None
+# 投機的な先読み: 予約中に2枚目のタブで次の候補日の時間帯画面まで進めておく（--speculate）。逐次モードのみ
+SPECULATE = False
+# 予約後のカレンダー復帰: quick=カレンダーの URL を直接開く（失敗時のみ施設選択から）, full=毎回施設選択から
+RESTORE_MODE = "quick"
+# 事前待機中のセッション維持間隔（秒）。カレンダーを再表示してタイムアウトを防ぐ
+KEEPALIVE_INTERVAL = 240
+# サーバー時計同期: 計測回数と、締切の何秒前に計測するか
+CLOCK_SYNC_SAMPLES = 12
+CLOCK_SYNC_LEAD = 20
+
+# 不要リソースをブロック — 最小限のUIで高速遷移
+BLOCKED_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_URLS = [
+    "google-analytics", "googletagmanager", "gtag",
+    "facebook", "twitter", "jquery-ui.min.css",
+    "remodal", "favicon",
+]
+# BLOCKED_TYPES を URL だけで判定するための拡張子（cdp / glob 方式用）
+BLOCKED_EXTENSIONS = [
+    "png", "jpg", "jpeg", "gif", "svg", "ico", "webp",
+    "woff", "woff2", "ttf", "otf", "eot", "css", "mp3", "mp4", "webm",
+]
+# 遮断の方式: cdp=ブラウザ側で URL を遮断（Network.setBlockedURLs。Python を経由しない）,
+# glob=遮断対象に一致するリクエストだけをルートで中断, route=全リクエストを Python で判定（従来）
+BLOCKING = "cdp"
+# Python のルートハンドラーが呼ばれた回数（--blocking の比較用）
+ROUTE_CALLS = 0
+# 静的スクリプトのディスクキャッシュ（asset_cache.py）。False なら毎回ネットワークから
+ASSET_CACHE = True
+ASSET_CACHE_DIR = Path(__file__).parent / "asset_cache"
+# 画面の種類ごとに当たったセレクターの記録（次の実行で先に試す）。None なら記録しない（実行中だけ覚える）
+SELECTOR_CACHE_PATH: Path | None = Path(__file__).parent / "selector_cache.json"
+# 常駐ブラウザ（browser_server.py）に CDP で接続する（--attach）。False なら毎回 udata で起動
+ATTACH = False
+# ログイン後の cookie・storage を USER_DATA_DIR/session_state.json に保存して次の起動で戻す。
+# サーバー側のセッションは放置すると切れるので、これより古い保存は使わない（秒）
+SESSION_STATE_MAX_AGE = 20 * 60
+# 画面遷移の待ち合わせ（ミリ秒）: ポストバックのリクエストが出るまで / レスポンスの目印が DOM に現れるまで
+NAV_START_TIMEOUT = 2000
+NAV_TIMEOUT = 10000
+# ステップ版の遷移待ち（wait_transition_steps）で、レスポンスが届いたかを見に行く間隔（ミリ秒）
+STEP_POLL_MS = 20
 
 # ====== .env ======
 load_dotenv(Path(__file__).parent / ".env")
+# ローカルのサイトシミュレーター（pf489_sim.py）等に向けるときだけ上書きする
+BASE_URL = os.getenv("RESERVE_BASE_URL", BASE_URL)
 LOGIN_ID = os.getenv("LOGIN_ID", "")
 LOGIN_PASSWORD = os.getenv("LOGIN_PASSWORD", "")
+# 複数アカウント（--accounts）: "ID1:PASS1,ID2:PASS2"
+ACCOUNTS = os.getenv("ACCOUNTS", "")
 NINZU = os.getenv("NINZU", "20")
 MOKUTEKI = os.getenv("MOKUTEKI", "バドミントン")
+# --attach の接続先（browser_server.py の既定ポート）
+BROWSER_ENDPOINT = os.getenv("BROWSER_ENDPOINT", "http://127.0.0.1:9222")
 
 OK_MARKS = {"○", "△"}
 MONTH_RE = re.compile(r"(\d{4})年\s*(\d{1,2})月")
+SLOT_RE = re.compile(r"(\d{1,2})\s*[:：]\s*(\d{2})\s*[~～〜\-－–]\s*(\d{1,2})\s*[:：]\s*(\d{2})")
 WEEKDAY_JA = ["月", "火", "水", "木", "金", "土", "日"]
 
+# 実行中の節目の時刻（time.time()）。最初の記録だけを残す
+RUN_MARKS: dict[str, float] = {}
+# ステップごとの計測区間（span）。start_ms / end_ms は SPAN_ORIGIN からの単調時計ミリ秒
+SPANS: list[dict] = []
+_SPAN_STACK: list[int] = []
+SPAN_ORIGIN = time.perf_counter()
+# 書き出していないステップの HTML: (ラベル, 時刻, HTML)
+# （DIAG_RING_SIZE は実行時に変わるので maxlen は付けず、積むときに切り詰める）
+DIAG_RING: deque[tuple[str, str, str]] = deque()
+# 診断ファイルの書き出し待ち (パス, 内容)。最初の save_diag で書き出しスレッドと一緒に作る
+_DIAG_QUEUE: queue.Queue | None = None
+# 対象月カレンダーの URL（setup_calendar / 復帰時に記録し、quick 復帰で直接開く）
+CALENDAR_URL = ""
+# カレンダー復帰の所要時間: [(quick/full, 秒)]
+RESTORE_TIMINGS: list[tuple[str, float]] = []
+# 画面遷移の待ち時間: [(遷移名, 着いた画面の種類, 秒)]
+NAV_TIMINGS: list[tuple[str, str, float]] = []
+# 先読みの結果の回数と、1日ごとの所要時間（前の日の終わりから）: [(hit/cold, 日付, 秒)]
+SPECULATION = {"hit": 0, "discarded": 0, "failed": 0}
+SPECULATION_TIMINGS: list[tuple[str, datetime, float]] = []
+
 
 # ====== ユーティリティ ======
 def debug(msg: str):
@@ -57,18 +179,238 @@ def debug(msg: str):
 
 
 def save_diag(page, label: str, level: int = 2):
-    """診断情報を保存。level <= DIAG_LEVEL の場合のみ実行。"""
+    """
+    診断情報を保存。予約の流れを止めないよう、その場では HTML（page.content）だけを取り、
+    ファイルへの書き出しはバックグラウンドのスレッドに任せる。
+    level > DIAG_LEVEL のステップは何もしない。DIAG_RING_SIZE > 0 のときだけリングバッファへ積み、
+    level=1（エラー）のときにフルページのスクリーンショットと一緒に直前のステップとして書き出す。
+    DIAG_LEVEL 2 の画面の見た目は Playwright のトレース（start_tracing）に残る。
+    """
+    if DIAG_LEVEL < 1 or (level > DIAG_LEVEL and DIAG_RING_SIZE <= 0):
+        return
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    try:
+        html = page.content()
+    except Exception as exc:
+        debug(f"[diag] failed: {exc}")
+        return
     if level > DIAG_LEVEL:
+        DIAG_RING.append((label, ts, html))
+        while len(DIAG_RING) > DIAG_RING_SIZE:
+            DIAG_RING.popleft()
+        return
+    name = f"{label}_{ts}"
+    enqueue_diag(LOG_DIR / f"{name}.html", html)
+    if level > 1:
+        debug(f"[diag] saved {name}")
+        return
+    try:
+        enqueue_diag(LOG_DIR / f"{name}.png", page.screenshot(full_page=True))
+    except Exception as exc:
+        debug(f"[diag] screenshot failed: {exc}")
+    for i, (prev_label, prev_ts, prev_html) in enumerate(DIAG_RING):
+        enqueue_diag(LOG_DIR / f"{name}_before" / f"{i:02d}_{prev_label}_{prev_ts}.html", prev_html)
+    debug(f"[diag] saved {name}（直前 {len(DIAG_RING)}ステップ付き）")
+    DIAG_RING.clear()
+
+
+def _diag_writer():
+    while True:
+        path, data = _DIAG_QUEUE.get()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(data, str):
+                path.write_text(data, encoding="utf-8")
+            else:
+                path.write_bytes(data)
+        except Exception as exc:
+            debug(f"[diag] write failed: {path.name}: {exc}")
+        finally:
+            _DIAG_QUEUE.task_done()
+
+
+def enqueue_diag(path: Path, data: str | bytes):
+    global _DIAG_QUEUE
+    if _DIAG_QUEUE is None:
+        _DIAG_QUEUE = queue.Queue(maxsize=DIAG_QUEUE_SIZE)
+        threading.Thread(target=_diag_writer, name="diag-writer", daemon=True).start()
+    try:
+        _DIAG_QUEUE.put_nowait((path, data))
+    except queue.Full:
+        debug(f"[diag] 書き出し待ちが一杯のため破棄: {path.name}")
+
+
+def flush_diag(timeout: float = 30.0):
+    """書き出し待ちの診断ファイルを書き終えるまで待つ（終了前に呼ぶ）"""
+    if _DIAG_QUEUE is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _DIAG_QUEUE.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def start_tracing(ctx):
+    """DIAG_LEVEL 2 のとき、画面のスクリーンショットと DOM スナップショットをトレースに記録する"""
+    if DIAG_LEVEL < 2:
+        return
+    try:
+        ctx.tracing.start(screenshots=True, snapshots=True)
+    except Exception as exc:
+        debug(f"[diag] トレースを開始できません: {exc}")
+
+
+def stop_tracing(ctx, label: str = "trace"):
+    """トレースを diag/<label>_<時刻>.zip に保存する（npx playwright show-trace で見る）"""
+    if DIAG_LEVEL < 2:
+        return
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        path = LOG_DIR / f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        ctx.tracing.stop(path=str(path))
+        debug(f"[diag] saved {path.name}")
+    except Exception as exc:
+        debug(f"[diag] トレースの保存に失敗: {exc}")
+
+
+def mark_once(name: str):
+    """RUN_MARKS に節目の時刻を記録（2回目以降は無視）"""
+    RUN_MARKS.setdefault(name, time.time())
+
+
+def handle_route(route):
+    """BLOCKED_TYPES / BLOCKED_URLS に該当するリクエストを中断する"""
+    global ROUTE_CALLS
+    ROUTE_CALLS += 1
+    if route.request.resource_type in BLOCKED_TYPES:
+        route.abort()
+        return
+    url = route.request.url.lower()
+    if any(b in url for b in BLOCKED_URLS):
+        route.abort()
+        return
+    route.continue_()
+
+
+def blocked_url_patterns() -> list[str]:
+    """Network.setBlockedURLs 用のワイルドカード（BLOCKED_URLS と BLOCKED_EXTENSIONS から作る）"""
+    return (
+        [f"*{b}*" for b in BLOCKED_URLS]
+        + [f"*.{ext}" for ext in BLOCKED_EXTENSIONS]
+        + [f"*.{ext}?*" for ext in BLOCKED_EXTENSIONS]
+    )
+
+
+def blocked_url_regex() -> re.Pattern:
+    """遮断対象の URL だけに一致する正規表現（ルートの照合はブラウザ側で行われる）"""
+    words = "|".join(re.escape(b) for b in BLOCKED_URLS)
+    exts = "|".join(BLOCKED_EXTENSIONS)
+    return re.compile(rf"(?:{words})|\.(?:{exts})(?:[?#]|$)", re.IGNORECASE)
+
+
+def _abort_route(route):
+    global ROUTE_CALLS
+    ROUTE_CALLS += 1
+    route.abort()
+
+
+def _block_urls_cdp(ctx, page):
+    """ページに CDP セッションを開いてブラウザ側の URL 遮断を設定する（失敗したら glob に切り替え）"""
+    try:
+        cdp = ctx.new_cdp_session(page)
+        cdp.send("Network.enable")
+        cdp.send("Network.setBlockedURLs", {"urls": blocked_url_patterns()})
+    except Exception as e:
+        debug(f"[block] CDP で遮断できません ({e}) → glob ルートで代替")
+        page.route(blocked_url_regex(), _abort_route)
+
+
+def install_blocking(ctx):
+    """BLOCKING の方式で不要リソースの遮断をコンテキストに設定する（後から開くタブにも効く）"""
+    if BLOCKING == "cdp":
+        for page in ctx.pages:
+            _block_urls_cdp(ctx, page)
+        ctx.on("page", lambda page: _block_urls_cdp(ctx, page))
+    elif BLOCKING == "glob":
+        ctx.route(blocked_url_regex(), _abort_route)
+    else:
+        ctx.route("**/*", handle_route)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """ブロックの所要時間を SPANS に記録する。入れ子のスパンは parent / depth で親子関係を持つ。
+    例外で抜けた場合は ok=False。"""
+    rec = {
+        "id": len(SPANS),
+        "parent": _SPAN_STACK[-1] if _SPAN_STACK else None,
+        "depth": len(_SPAN_STACK),
+        "name": name,
+        "start_ms": (time.perf_counter() - SPAN_ORIGIN) * 1000,
+        "end_ms": None,
+        "ms": None,
+        "ok": True,
+        **attrs,
+    }
+    SPANS.append(rec)
+    _SPAN_STACK.append(rec["id"])
+    try:
+        yield rec
+    except BaseException:
+        rec["ok"] = False
+        raise
+    finally:
+        rec["end_ms"] = (time.perf_counter() - SPAN_ORIGIN) * 1000
+        rec["ms"] = rec["end_ms"] - rec["start_ms"]
+        _SPAN_STACK.pop()
+
+
+def traced(fn):
+    """関数全体を関数名のスパンで囲む。False を返したら ok=False として記録する。"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(fn.__name__) as rec:
+            result = fn(*args, **kwargs)
+            rec["ok"] = result is not False
+            return result
+    return wrapper
+
+
+def write_timeline(label: str = "timeline"):
+    """SPANS を diag/ に JSON と CSV で書き出し、ステップ別の合計をログに出す"""
+    if not SPANS or DIAG_LEVEL < 1:
         return
     try:
         LOG_DIR.mkdir(parents=True, exist_ok=True)
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        page.screenshot(path=str(LOG_DIR / f"{label}_{ts}.png"), full_page=True)
-        if DIAG_LEVEL >= 2:
-            (LOG_DIR / f"{label}_{ts}.html").write_text(page.content(), encoding="utf-8")
-        debug(f"[diag] saved {label}_{ts}")
+        origin_epoch = time.time() - (time.perf_counter() - SPAN_ORIGIN)
+        (LOG_DIR / f"{label}_{ts}.json").write_text(
+            json.dumps({"origin_epoch": origin_epoch, "marks": RUN_MARKS, "spans": SPANS},
+                       ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        fields = ["id", "parent", "depth", "name", "start_ms", "end_ms", "ms", "ok", "day"]
+        with open(LOG_DIR / f"{label}_{ts}.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for rec in SPANS:
+                writer.writerow({k: round(v, 1) if isinstance(v, float) else v for k, v in rec.items()})
+        debug(f"[span] saved {label}_{ts}.json / .csv ({len(SPANS)} spans)")
     except Exception as exc:
-        debug(f"[diag] failed: {exc}")
+        debug(f"[span] failed: {exc}")
+    totals: dict[str, list[float]] = {}
+    for rec in SPANS:
+        if rec["ms"] is not None:
+            totals.setdefault(rec["name"], []).append(rec["ms"])
+    for name, v in sorted(totals.items(), key=lambda kv: -sum(kv[1])):
+        debug(f"[span] {name:<34} n={len(v):>3} total={sum(v):>8.0f}ms max={max(v):>7.0f}ms")
+
+
+def report_day_timings(mode: str, timings: list[tuple[datetime, float, bool]], total: float):
+    """1日ごとの所要時間（壁時計）を出力。逐次/並列で同じ書式にして比較できるようにする。"""
+    debug(f"[timing] mode={mode} days={len(timings)} total={total:.2f}s")
+    for d, sec, ok in timings:
+        status = "OK" if ok else "NG"
+        debug(f"[timing]   {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) {sec:.2f}s {status}")
 
 
 def norm_wave(s: str) -> str:
@@ -106,41 +448,373 @@ def get_week_number(d: datetime) -> int:
     return (d.day - 1) // 7 + 1
 
 
-def build_candidate_days(year: int, month: int, booked_weeks: set[int]) -> list[datetime]:
+def build_candidate_days(year: int, month: int, booked_weeks: set[int],
+                         weekdays: list[int] | None = None, weeks: list[int] | None = None) -> list[datetime]:
     """
     曜日優先順位(月→火→水→木)×週分散で候補日リストを生成。
     週の優先順位: 第3週→第4週→第5週→第2週→第1週（後半週が競合少ない傾向）。
     祝日は除外。既に予約済みの週はスキップ。
+    weekdays / weeks を省略すると WEEKDAY_PRIORITY / WEEK_PRIORITY。
     """
-    week_priority = [3, 4, 5, 2, 1]
+    weeks = WEEK_PRIORITY if weeks is None else weeks
     candidates = []
-    for weekday in WEEKDAY_PRIORITY:
+    for weekday in (WEEKDAY_PRIORITY if weekdays is None else weekdays):
         days = get_weekdays_in_month(year, month, weekday)
         # 祝日を除外
         days = [d for d in days if d.date() not in JP_HOLIDAYS]
         days_by_week = {get_week_number(d): d for d in days}
-        for wn in week_priority:
+        for wn in weeks:
             if wn in booked_weeks or wn not in days_by_week:
                 continue
             candidates.append(days_by_week[wn])
     return candidates
 
 
+# ====== 予約対象（施設・部屋・時間帯・優先順位） ======
+@dataclass
+class Target:
+    """予約対象1件分のプロファイル。bind_target でページに結び付けて使う（page_target で引く）。"""
+    name: str
+    facility: str = "ふるさと千川館"
+    category: int = 18
+    room: str = "多目的ホール"
+    slots: list[str] = field(default_factory=lambda: ["18:30~19:30", "19:30~20:30", "20:30~21:30"])
+    weekdays: list[int] = field(default_factory=lambda: [0, 1, 2, 3])
+    weeks: list[int] = field(default_factory=lambda: [3, 4, 5, 2, 1])
+    max_days: int = 5
+
+
+def apply_target(t: Target, max_days: int | None = None):
+    """t をモジュールの設定値（FACILITY_NAME / ROOM_LABEL 等）に反映する。起動時（main）に1回だけ使い、
+    単独の予約対象・async / http エンジン・別プロセスのアカウントはこの値で動く。
+    複数の対象を同時に扱うときは設定値を切り替えず、ページごとに bind_target する。"""
+    global FACILITY_NAME, CATEGORY_ID, ROOM_LABEL, WANTED_SLOTS, WEEKDAY_PRIORITY, WEEK_PRIORITY, MAX_DAYS
+    FACILITY_NAME, CATEGORY_ID, ROOM_LABEL = t.facility, t.category, t.room
+    WANTED_SLOTS, WEEKDAY_PRIORITY, WEEK_PRIORITY = list(t.slots), list(t.weekdays), list(t.weeks)
+    MAX_DAYS = t.max_days if max_days is None else min(t.max_days, max_days)
+
+
+def current_target() -> Target:
+    """モジュールの設定値を Target にしたもの（bind_target していないページの予約対象）"""
+    return Target(name=ROOM_LABEL, facility=FACILITY_NAME, category=CATEGORY_ID, room=ROOM_LABEL,
+                  slots=list(WANTED_SLOTS), weekdays=list(WEEKDAY_PRIORITY), weeks=list(WEEK_PRIORITY),
+                  max_days=MAX_DAYS)
+
+
+# ページ → そのページで予約する対象。施設選択・部屋行・時間帯・候補日はページの対象で決める
+_PAGE_TARGET: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def bind_target(page, t: Target):
+    _PAGE_TARGET[page] = t
+
+
+def page_target(page) -> Target:
+    return _PAGE_TARGET.get(page) or current_target()
+
+
+def load_targets(path: Path) -> tuple[list[Target], int]:
+    """
+    TOML の予約対象設定を読む。上から順に優先（1つ目で取れなかった週を2つ目で取る）。
+    戻り値: (Target のリスト, 全体の最大予約日数)
+
+        max_days = 5
+        [[target]]
+        name = "千川館 多目的ホール"
+        facility = "ふるさと千川館"
+        category = 18
+        room = "多目的ホール"
+    """
+    with open(path, "rb") as f:
+        conf = tomllib.load(f)
+    known = set(Target.__dataclass_fields__)
+    targets = []
+    for i, raw in enumerate(conf.get("target", [])):
+        unknown = set(raw) - known
+        if unknown:
+            raise ValueError(f"{path}: target[{i}] に不明なキー: {', '.join(sorted(unknown))}")
+        targets.append(Target(**{"name": raw.get("room", f"target{i}"), **raw}))
+    if not targets:
+        raise ValueError(f"{path}: [[target]] がありません")
+    return targets, int(conf.get("max_days", MAX_DAYS))
+
+
+# ====== 複数アカウント: 共有台帳 ======
+def claim_day(d: datetime) -> bool:
+    """申込む前に台帳でその日（と週）を押さえる。単独実行なら常に True"""
+    if LEDGER is None:
+        return True
+    if LEDGER.claim(d.strftime("%Y%m%d"), get_week_number(d)):
+        return True
+    debug(f"[ledger] {d.strftime('%Y-%m-%d')} は他のアカウントが押さえ済み（または全体の上限）→ スキップ")
+    return False
+
+
+def settle_day(d: datetime, ok: bool):
+    if LEDGER is not None:
+        LEDGER.settle(d.strftime("%Y%m%d"), ok)
+
+
+# 申込ポストバックを送った後で結果が判別できなかった（サーバーが受け付けた可能性がある）。
+# やり直すと二重申込になりうるので、その日は打ち切り、週も台帳の押さえもそのままにする
+APPLY_UNCLEAR = "apply_unclear"
+
+
+def weeks_taken_elsewhere() -> set[int]:
+    """他のアカウントが押さえている・予約済みの週"""
+    return LEDGER.weeks_taken() if LEDGER is not None else set()
+
+
+# ====== 画面遷移の待ち合わせ ======
+# レスポンス本文の目印 → 画面の種類（上から順に判定。時間帯別画面にも calendar の表があるので先に見る）
+PAGE_MARKERS = [
+    ("form", re.compile(r"""name=["']spinnerNinzu""")),
+    ("timeslot", re.compile(r"""name=["']checktime""")),
+    ("calendar", re.compile(r"""class=["'][^"']*\bcalendar\b[^"']*\bhorizon\b""")),
+    ("facility", re.compile(r"""id=["']shisetsutbl""")),
+    ("login", re.compile(r"""id=["']userID""")),
+]
+# 着いたことを DOM で確かめるセレクター（レスポンスが届いてから描画されるまでの待ち）
+PAGE_SELECTORS = {
+    "form": "input[name='spinnerNinzu']",
+    "timeslot": "input[name='checktime']",
+    "calendar": "table.calendar.horizon.toggle",
+    "facility": "#shisetsutbl",
+    "login": "#userID",
+}
+# 待たずに失敗とする結果（timeout=セッション切れの画面, error=4xx/5xx, no_response=ポストバックが出ない・ステップ版で期限までに届かない）
+NAV_FAILURES = {"timeout", "error", "no_response"}
+
+
+def classify_page(html: str, status: int = 200) -> str:
+    """
+    レスポンス本文から画面の種類を判定する（PAGE_MARKERS の名前 / timeout / error / other）。
+    セッション切れは is_session_timeout と同じく、ログアウトリンクも施設テーブルもない
+    「セッションタイムアウト」のメッセージだけのページ。
+    """
+    if status >= 400:
+        return "error"
+    if "セッションタイムアウト" in html and "ログアウト" not in html and "shisetsutbl" not in html:
+        return "timeout"
+    for kind, marker in PAGE_MARKERS:
+        if marker.search(html):
+            return kind
+    return "other"
+
+
+def _is_page_request(page, request) -> bool:
+    """画面遷移（メインフレームのドキュメント）のリクエストか"""
+    return request.is_navigation_request() and request.frame == page.main_frame
+
+
+def _final_response(request):
+    """リダイレクトを辿った最後のリクエストのレスポンス（失敗したら None）"""
+    response = request.response()
+    while response is not None and 300 <= response.status < 400:
+        nxt = request.redirected_to
+        if nxt is None:
+            break
+        request, response = nxt, nxt.response()
+    return response
+
+
+def wait_transition(page, action, name: str, expect: str | None = None) -> str:
+    """
+    action（クリック・__doPostBack 等）で起きる画面遷移を、そのレスポンスで待つ。
+    load イベントや固定のセレクター待ちの代わりに、届いた本文から着いた画面を判定し、
+    expect の画面ならその目印が DOM に現れた時点で戻る。セッション切れ・エラーのページは
+    タイムアウトを待たずにその場で返す。待ち時間は NAV_TIMINGS と wait_<name> のスパンに残す。
+    戻り値: 着いた画面の種類（classify_page）または no_response
+    """
+    t0 = time.perf_counter()
+    with span(f"wait_{name}") as rec:
+        try:
+            with page.expect_request(lambda r: _is_page_request(page, r), timeout=NAV_START_TIMEOUT) as req:
+                action()
+        except PlaywrightTimeoutError:
+            req = None
+        kind = _settle_transition(page, req, expect, rec)
+    _record_transition(page, name, expect, kind, time.perf_counter() - t0)
+    return kind
+
+
+def wait_transition_steps(page, action, name: str, expect: str | None = None, timeout: float | None = None):
+    """
+    wait_transition のステップ版（run_lockstep 用）。action の発火直後に yield し、レスポンスが届くまで
+    STEP_POLL_MS ずつイベントを回しては yield する（待ちの間も他のタブが進む）。戻り値（yield from の値）は
+    wait_transition と同じ。timeout（ミリ秒）を過ぎても届かなければ待たずに "no_response" を返す
+    （None なら届くか失敗するまで待つ）。スパンは入れ子が崩れないよう、届いた後の判定だけを囲む。
+    """
+    t0 = time.perf_counter()
+    done = set()
+    on_done = done.add
+    page.on("requestfinished", on_done)
+    page.on("requestfailed", on_done)
+    try:
+        try:
+            with page.expect_request(lambda r: _is_page_request(page, r), timeout=NAV_START_TIMEOUT) as req:
+                action()
+                yield
+        except PlaywrightTimeoutError:
+            req = None
+        if req is not None:
+            request = req.value
+            while True:
+                while request.redirected_to is not None:
+                    request = request.redirected_to
+                if request in done:
+                    break
+                if timeout is not None and time.perf_counter() - t0 >= timeout / 1000:
+                    _record_transition(page, name, expect, "no_response", time.perf_counter() - t0)
+                    return "no_response"
+                page.wait_for_timeout(STEP_POLL_MS)
+                yield
+    finally:
+        page.remove_listener("requestfinished", on_done)
+        page.remove_listener("requestfailed", on_done)
+    with span(f"wait_{name}") as rec:
+        kind = _settle_transition(page, req, expect, rec)
+    _record_transition(page, name, expect, kind, time.perf_counter() - t0)
+    return kind
+
+
+def _settle_transition(page, req, expect: str | None, rec: dict) -> str:
+    """捕まえた遷移のリクエスト（None=発火しなかった）から着いた画面を判定し、expect の画面なら目印を待つ"""
+    if req is None:
+        kind = "no_response"
+    elif (response := _final_response(req.value)) is None:
+        kind = "error"
+    else:
+        try:
+            kind = classify_page(response.text(), response.status)
+        except Exception:
+            # 本文が取れない（続けて別の遷移が始まった等）ときは DOM で判定する
+            page.wait_for_load_state("domcontentloaded", timeout=NAV_TIMEOUT)
+            kind = classify_page(page.content())
+    if kind == expect and kind in PAGE_SELECTORS:
+        page.wait_for_selector(PAGE_SELECTORS[kind], state="attached", timeout=NAV_TIMEOUT)
+    elif kind not in NAV_FAILURES:
+        page.wait_for_load_state("domcontentloaded", timeout=NAV_TIMEOUT)
+    rec["outcome"] = kind
+    rec["ok"] = kind == expect if expect else kind not in NAV_FAILURES
+    return kind
+
+
+def _record_transition(page, name: str, expect: str | None, kind: str, sec: float):
+    NAV_TIMINGS.append((name, kind, sec))
+    _PAGE_KIND[page] = kind
+    ok = kind == expect if expect else kind not in NAV_FAILURES
+    if not ok:
+        debug(f"[nav] {name}: {kind}" + (f"（{expect} を期待）" if expect else "") + f" {sec:.2f}s")
+
+
+def report_nav_timings():
+    """画面遷移ごとの待ち時間 回数 / 平均 / 最大 と、着いた画面の内訳"""
+    for name in dict.fromkeys(n for n, _, _ in NAV_TIMINGS):
+        rows = [(kind, sec) for n, kind, sec in NAV_TIMINGS if n == name]
+        v = [sec for _, sec in rows]
+        kinds = ", ".join(f"{k}={c}" for k, c in Counter(kind for kind, _ in rows).items())
+        debug(f"[nav] {name}: n={len(v)} mean={statistics.mean(v):.2f}s max={max(v):.2f}s ({kinds})")
+
+
+# ====== セレクターの当たり記録 ======
+# 候補のセレクターを順に試す箇所（次へ・戻る・表示ボタン等）は、外れるたびに locator.count() の
+# 往復が1回かかる。画面の種類（wait_transition で着いた画面）ごとに当たったセレクターを
+# SELECTOR_CACHE_PATH に残し、次からはそれを最初に試す。外れたら残りを元の順で試して記録し直す。
+# ページ → 最後に wait_transition で着いた画面の種類
+_PAGE_KIND: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# "<用途>@<画面の種類>" → 当たったセレクター（最初の find_first で読み込む）
+_SELECTOR_CACHE: dict[str, str] | None = None
+_SELECTOR_CACHE_DIRTY = False
+# "<用途>@<画面の種類>" → {hit: 記録どおり当たった, miss: 記録が外れた, cold: 記録なし, probes: count() の回数}
+SELECTOR_STATS: dict[str, dict[str, int]] = {}
+
+
+def _selector_cache() -> dict[str, str]:
+    global _SELECTOR_CACHE
+    if _SELECTOR_CACHE is None:
+        _SELECTOR_CACHE = {}
+        if SELECTOR_CACHE_PATH is not None:
+            try:
+                _SELECTOR_CACHE = json.loads(SELECTOR_CACHE_PATH.read_text(encoding="utf-8"))
+            except (FileNotFoundError, ValueError):
+                pass
+    return _SELECTOR_CACHE
+
+
+def find_first(page, purpose: str, selectors: list[str], has_text: str | None = None):
+    """
+    selectors（has_text を含むものに絞る）のうち最初に見つかった要素のロケーター。なければ None。
+    この画面で前に当たったセレクターがあれば先に試し、外れたら残りを元の順で試して記録し直す。
+    """
+    global _SELECTOR_CACHE_DIRTY
+    key = f"{purpose}@{_PAGE_KIND.get(page, 'unknown')}"
+    cache = _selector_cache()
+    cached = cache.get(key)
+    order = ([cached] if cached in selectors else []) + [sel for sel in selectors if sel != cached]
+    stats = SELECTOR_STATS.setdefault(key, {"hit": 0, "miss": 0, "cold": 0, "probes": 0})
+    stats["hit" if cached in selectors else "cold"] += 1
+    for sel in order:
+        loc = page.locator(sel)
+        if has_text is not None:
+            loc = loc.filter(has_text=has_text)
+        stats["probes"] += 1
+        if loc.count():
+            break
+        if sel == cached:
+            stats["hit"] -= 1
+            stats["miss"] += 1
+            debug(f"[selector] {key}: 記録していた {sel} が外れました → 探し直し")
+    else:
+        if cached is not None:
+            del cache[key]
+            _SELECTOR_CACHE_DIRTY = True
+        return None
+    if sel != cached:
+        cache[key] = sel
+        _SELECTOR_CACHE_DIRTY = True
+    return loc.first
+
+
+def flush_selector_cache():
+    """当たったセレクターを保存し、用途・画面ごとのヒット数を出力する（DIAG_LEVEL 1 以上なら diag/ にも）"""
+    global _SELECTOR_CACHE_DIRTY
+    if _SELECTOR_CACHE_DIRTY and SELECTOR_CACHE_PATH is not None:
+        try:
+            tmp = SELECTOR_CACHE_PATH.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(_SELECTOR_CACHE, ensure_ascii=False, indent=1), encoding="utf-8")
+            os.replace(tmp, SELECTOR_CACHE_PATH)
+            _SELECTOR_CACHE_DIRTY = False
+        except Exception as e:
+            debug(f"[selector] 記録の保存に失敗: {e}")
+    if not SELECTOR_STATS:
+        return
+    for key, st in sorted(SELECTOR_STATS.items()):
+        debug(f"[selector] {key:<24} " + " ".join(f"{k}={v}" for k, v in st.items()))
+    if DIAG_LEVEL >= 1:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        enqueue_diag(LOG_DIR / f"selector_stats_{ts}.json",
+                      json.dumps({"stats": SELECTOR_STATS, "cache": _selector_cache()}, ensure_ascii=False, indent=2))
+
+
 # ====== Step 1: ログイン ======
+@traced
 def login(page):
     debug("[login] ModeSelect へ移動")
     page.goto(BASE_URL, wait_until="domcontentloaded")
 
-    # 既にログイン済みかチェック
+    # 既にログイン済みかチェック（保存したセッションを戻した場合もここで確かめる）
     if page.locator("a:has-text('ログアウト')").count():
         debug("[login] 既にログイン済み")
+        save_session_state(page.context)
         return
 
     # __doPostBack('login','') でログインページへ遷移
     debug("[login] ログインページへ遷移")
-    page.evaluate("__doPostBack('login','')")
-    page.wait_for_load_state("domcontentloaded")
-    page.wait_for_selector("#userID", timeout=5000)
+    kind = wait_transition(page, lambda: page.evaluate("__doPostBack('login','')"), "login_page", expect="login")
+    if kind != "login":
+        save_diag(page, "login_page_fail", level=1)
+        raise RuntimeError(f"ログインページが表示されません（{kind}）")
     save_diag(page, "step1_login_page")
 
     # ID/PW 入力（実サイトのセレクター）
@@ -149,12 +823,52 @@ def login(page):
     debug("[login] ID/PW 入力完了")
 
     # ログインボタンクリック
-    page.locator("a.btnBlue:has-text('ログイン')").click()
-    page.wait_for_load_state("domcontentloaded")
-    page.wait_for_selector("a:has-text('ログアウト')", timeout=10000)
+    kind = wait_transition(page, page.locator("a.btnBlue:has-text('ログイン')").click, "login_submit")
+    # ログインページが返ってきた（ID/PW 違い等）ならタイムアウトを待たずに失敗
+    if kind in NAV_FAILURES or kind == "login":
+        save_diag(page, "login_fail", level=1)
+        raise RuntimeError(f"ログインに失敗しました（{kind}）")
+    page.wait_for_selector("a:has-text('ログアウト')", state="attached", timeout=NAV_TIMEOUT)
 
     debug("[login] ログイン成功")
     save_diag(page, "step2_logged_in")
+    save_session_state(page.context)
+
+
+def session_state_path() -> Path:
+    return USER_DATA_DIR / "session_state.json"
+
+
+def save_session_state(ctx):
+    """ログイン済みの cookie・storage を保存する（次の起動で load_session_state から戻す）。
+    別セッションのタブ（new_session_page）のコンテキストは保存しない"""
+    if ctx in _SESSION_CONTEXTS:
+        return
+    path = session_state_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        ctx.storage_state(path=str(path))
+        os.chmod(path, 0o600)
+    except Exception as e:
+        debug(f"[session] 保存に失敗: {e}")
+
+
+def load_session_state() -> dict | None:
+    """SESSION_STATE_MAX_AGE 以内に保存したセッションがあれば返す"""
+    path = session_state_path()
+    try:
+        age = time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if age > SESSION_STATE_MAX_AGE:
+        debug(f"[session] 保存済みセッションは {age / 60:.0f}分前のもの → 使わずにログイン")
+        return None
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+    debug(f"[session] {age / 60:.1f}分前のセッションを復元")
+    return state
 
 
 def is_logged_in(page) -> bool:
@@ -192,111 +906,131 @@ def recover_session(page):
 
 
 # ====== Step 2: 施設選択（ふるさと千川館 → 多目的ホール） ======
-def dismiss_overlays(page):
-    """セッションタイムアウト警告やお知らせ等のオーバーレイを閉じる"""
-    try:
-        page.evaluate("""() => {
-            // remodal系オーバーレイ
-            document.querySelectorAll('.remodal-overlay, .remodal').forEach(el => {
-                el.style.display = 'none';
-            });
-            // メッセージダイアログの「閉じる」ボタン
-            document.querySelectorAll('a[href*="close"], button').forEach(el => {
-                if ((el.textContent || '').includes('閉じる') || (el.textContent || '').includes('×')) {
-                    el.click();
-                }
-            });
-        }""")
-    except Exception:
-        pass  # ナビゲーション中の場合は無視
+# セッションタイムアウト警告・お知らせ等のオーバーレイを、現れた時点でページ自身に隠させる。
+# コンテキストの init script なので全タブ・全ページで最初から動き、Python からの往復は要らない。
+# 隠すのは以前 dismiss_overlays が消していた remodal（とその全面を覆う wrapper）だけで、
+# サイトの確認・エラーのダイアログ（.ui-dialog 等）は残す。
+# 「閉じる」ボタンは押さない（ポストバックになりうる）。隠した数と最後の文言、セッション警告が
+# 出たかを window.__overlayGuard に残し、既存の evaluate の戻り値に含めて読む。
+OVERLAY_GUARD_JS = """
+(() => {
+    if (window.__overlayGuard) return;
+    const status = window.__overlayGuard = {hidden: 0, sessionWarning: false, last: ''};
+    const OVERLAYS = '.remodal-overlay, .remodal-wrapper, .remodal';
+    const hide = (el) => {
+        if (el.style.getPropertyValue('display') === 'none') return;
+        el.style.setProperty('display', 'none', 'important');
+        status.hidden += 1;
+        const text = (el.textContent || '').trim();
+        if (text) status.last = text.slice(0, 80);
+        if (text.includes('セッション') && text.includes('タイムアウト')) status.sessionWarning = true;
+    };
+    const sweep = () => {
+        document.querySelectorAll(OVERLAYS).forEach(hide);
+        // remodal が付けるスクロール固定を外す（付いているときだけ。外すこと自体が変更通知になる）
+        for (const root of [document.documentElement, document.body]) {
+            if (root && root.classList.contains('remodal-is-locked')) root.classList.remove('remodal-is-locked');
+        }
+    };
+    new MutationObserver(sweep).observe(document, {
+        childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style'],
+    });
+    document.addEventListener('DOMContentLoaded', sweep);
+})();
+"""
+
+
+def install_overlay_guard(ctx):
+    """OVERLAY_GUARD_JS をコンテキストの init script に設定する（後から開くタブにも効く）"""
+    ctx.add_init_script(OVERLAY_GUARD_JS)
+
+
+def log_overlay_guard(status: dict | None, where: str):
+    """evaluate で一緒に読んだ window.__overlayGuard を出力する（隠したものがあるときだけ）"""
+    if status and status.get("hidden"):
+        warn = " / セッション警告あり" if status.get("sessionWarning") else ""
+        debug(f"[overlay] {where}: {status['hidden']}件を非表示{warn} ({status.get('last', '')[:40]})")
 
 
+@traced
 def select_facility(page, _retry: int = 0):
     if _retry > 1:
         raise RuntimeError("施設選択のリトライ上限に達しました")
+    t = page_target(page)
     # ModeSelect に戻る（ログイン後のページから）
-    if not page.locator("#category_18").count():
+    if not page.locator(f"#category_{t.category}").count():
         page.goto(BASE_URL, wait_until="domcontentloaded")
 
-    dismiss_overlays(page)
-
     # カテゴリ「ふるさと千川館」(#category_18) をクリック
-    debug("[facility] ふるさと千川館 を選択")
-    cat_btn = page.locator("#category_18")
+    debug(f"[facility] {t.facility} を選択")
+    cat_btn = page.locator(f"#category_{t.category}")
     if not cat_btn.count():
         save_diag(page, "category_not_found", level=1)
-        raise RuntimeError("カテゴリ『ふるさと千川館』が見つかりません")
-    cat_btn.click()
-    page.wait_for_load_state("domcontentloaded")
+        raise RuntimeError(f"カテゴリ『{t.facility}』(#category_{t.category}) が見つかりません")
+    kind = wait_transition(page, cat_btn.click, "category", expect="facility")
 
     # カテゴリクリック後もセッションタイムアウトの可能性あり
-    if is_session_timeout(page):
+    if kind == "timeout":
         debug("[facility] カテゴリ選択後にセッションタイムアウト検知")
         page.goto(BASE_URL, wait_until="domcontentloaded")
         login(page)
         return select_facility(page, _retry=_retry + 1)
+    if kind == "calendar":
+        debug("[facility] 直接カレンダー画面に遷移")
+        return
+    if kind != "facility":
+        save_diag(page, "facility_list_fail", level=1)
+        raise RuntimeError(f"施設一覧が表示されません（{kind}）")
 
-    page.wait_for_selector("#shisetsutbl", timeout=5000)
-    dismiss_overlays(page)
     save_diag(page, "step3_facility_list")
 
     # Step 2a: 施設一覧から施設 or 部屋を選択
     tbl = page.locator("#shisetsutbl")
-    if not tbl.count():
-        debug("[facility] 直接カレンダー画面に遷移")
-        return
 
-    # ROOM_LABEL（多目的ホール等）が直接見つかればそれを選択
-    room_labels = tbl.locator("td.shisetsu.toggle label").filter(has_text=ROOM_LABEL)
+    # 対象の部屋（多目的ホール等）が直接見つかればそれを選択
+    room_labels = tbl.locator("td.shisetsu.toggle label").filter(has_text=t.room)
     if room_labels.count():
         room_labels.first.click()
-        debug(f"[facility] {ROOM_LABEL} チェック済み")
+        debug(f"[facility] {t.room} チェック済み")
         click_next_button(page)
         save_diag(page, "step4_calendar")
         return
 
     # 施設名のみ表示 → 施設を選択して「次へ進む」→ 部屋選択画面へ
-    facility_labels = tbl.locator("td.shisetsu label").filter(has_text=FACILITY_NAME)
+    facility_labels = tbl.locator("td.shisetsu label").filter(has_text=t.facility)
     if facility_labels.count():
         facility_labels.first.click()
-        debug(f"[facility] {FACILITY_NAME} チェック済み")
+        debug(f"[facility] {t.facility} チェック済み")
     else:
         debug("[facility] 施設は既に選択済みの可能性あり")
 
-    if not click_next_button(page):
+    kind = click_next_button(page)
+    if not kind:
         save_diag(page, "next_button_not_found", level=1)
         raise RuntimeError("「次へ進む」ボタンが見つかりません")
 
     # セッションタイムアウト検知 → 再ログインしてリトライ
-    if is_session_timeout(page):
+    if kind == "timeout":
         debug("[facility] セッションタイムアウト検知、再ログインします")
         page.goto(BASE_URL, wait_until="domcontentloaded")
         login(page)
         return select_facility(page, _retry=_retry + 1)
 
-    dismiss_overlays(page)
-
     # 次へ進む後: カレンダーページ or 部屋選択ページ
     # カレンダーページなら施設選択完了
-    if page.locator("#shisetsutbl").count():
-        # 部屋選択ページ: ROOM_LABEL を選択して次へ
+    if kind == "facility":
+        # 部屋選択ページ: 対象の部屋を選択して次へ
         save_diag(page, "step3b_room_list")
-        tbl2 = page.locator("#shisetsutbl")
-        room_labels2 = tbl2.locator("td.shisetsu.toggle label").filter(has_text=ROOM_LABEL)
-        if room_labels2.count():
-            room_labels2.first.click()
-            debug(f"[facility] {ROOM_LABEL} チェック済み（2段階目）")
-        else:
-            all_labels = tbl2.locator("label")
-            for i in range(all_labels.count()):
-                txt = (all_labels.nth(i).text_content() or "").strip()
-                if ROOM_LABEL in txt:
-                    all_labels.nth(i).click()
-                    debug(f"[facility] {ROOM_LABEL} チェック済み（テキスト検索）")
-                    break
-            else:
-                save_diag(page, "room_not_found", level=1)
-                raise RuntimeError(f"'{ROOM_LABEL}' が見つかりません")
+        # 部屋のラベル → なければ表の全ラベルからテキストで探す
+        room_label = find_first(page, "room", [
+            "#shisetsutbl td.shisetsu.toggle label",
+            "#shisetsutbl label",
+        ], has_text=t.room)
+        if room_label is None:
+            save_diag(page, "room_not_found", level=1)
+            raise RuntimeError(f"'{t.room}' が見つかりません")
+        room_label.click()
+        debug(f"[facility] {t.room} チェック済み（2段階目）")
         click_next_button(page)
         save_diag(page, "step4_calendar")
     else:
@@ -305,26 +1039,28 @@ def select_facility(page, _retry: int = 0):
         save_diag(page, "step4_calendar")
 
 
-def click_next_button(page):
-    """共通: 「次へ進む」系のボタンをクリック"""
-    for sel in [
-        "a.btnBlue:has-text('次へ進む')",
-        "button:has-text('次へ進む')",
-        "input[type='submit'][value*='次']",
-        "a:has-text('次へ')",
-    ]:
-        btn = page.locator(sel)
-        if btn.count():
-            btn.first.click()
-            page.wait_for_load_state("domcontentloaded")
-            return True
+NEXT_BUTTON_SELECTORS = [
+    "a.btnBlue:has-text('次へ進む')",
+    "button:has-text('次へ進む')",
+    "input[type='submit'][value*='次']",
+    "a:has-text('次へ')",
+]
+
+
+@traced
+def click_next_button(page, expect: str | None = None) -> str | bool:
+    """共通: 「次へ進む」系のボタンをクリックし、遷移を wait_transition で待つ。
+    戻り値: 着いた画面の種類（expect を渡すとその目印が現れるまで待つ）。ボタンがなければ False"""
+    btn = find_first(page, "next", NEXT_BUTTON_SELECTORS)
+    if btn is not None:
+        return wait_transition(page, btn.click, "next", expect=expect)
     debug("[next] 次へボタンが見つかりません")
     return False
 
 
 # ====== Step 3: カレンダー操作 ======
-def set_display_period_one_month(page, start_date: datetime):
-    """表示期間を「1ヶ月」に設定して表示ボタンを押す"""
+def _set_display_period_fields(page, start_date: datetime) -> str:
+    """表示開始日と期間「1ヶ月」を入力欄に設定する（ボタンは押さない）"""
     y, m, d = start_date.year, start_date.month, start_date.day
     val = f"{y}/{m}/{d}"
 
@@ -352,21 +1088,28 @@ def set_display_period_one_month(page, start_date: datetime):
         }""",
         {"val": val},
     )
+    return val
+
+
+@traced
+def set_display_period_one_month(page, start_date: datetime):
+    """表示期間を「1ヶ月」に設定して表示ボタンを押す"""
+    val = _set_display_period_fields(page, start_date)
 
     # 「表示」ボタンクリック
-    for sel in [
+    btn = find_first(page, "display", [
         "#btnHyoji",
         "button:has-text('表示')",
         "input[type='submit'][value*='表示']",
-    ]:
-        btn = page.locator(sel)
-        if btn.count():
-            btn.first.click()
-            page.wait_for_load_state("domcontentloaded")
-            page.wait_for_selector("table.calendar.horizon.toggle", timeout=5000)
-            debug(f"[calendar] 表示期間を1ヶ月に設定: {val}")
-            return
-    debug("[calendar] 表示ボタンが見つかりません")
+    ])
+    if btn is None:
+        debug("[calendar] 表示ボタンが見つかりません")
+        return
+    kind = wait_transition(page, btn.click, "display", expect="calendar")
+    if kind != "calendar":
+        save_diag(page, "display_fail", level=1)
+        raise RuntimeError(f"1ヶ月表示に失敗しました（{kind}）")
+    debug(f"[calendar] 表示期間を1ヶ月に設定: {val}")
 
 
 def get_calendar_header_year_month(page) -> tuple:
@@ -383,46 +1126,128 @@ def get_calendar_header_year_month(page) -> tuple:
     return None, None
 
 
+@traced
 def navigate_to_month(page, target: datetime, max_hops: int = 6):
     """カレンダーを目標の月まで移動"""
     want = (target.year, target.month)
     have = get_calendar_header_year_month(page)
     hops = 0
     while have != want and hops < max_hops and all(have):
-        if have < want:
-            page.evaluate("__doPostBack('period','next')")
-        else:
-            page.evaluate("__doPostBack('period','prev')")
-        page.wait_for_load_state("domcontentloaded")
-        page.wait_for_selector("table.calendar.horizon.toggle", timeout=5000)
+        direction = "next" if have < want else "prev"
+        kind = wait_transition(page, lambda: page.evaluate(f"__doPostBack('period','{direction}')"),
+                               "period", expect="calendar")
+        if kind != "calendar":
+            break
         have = get_calendar_header_year_month(page)
         hops += 1
     debug(f"[calendar] target={want} now={have} hops={hops}")
     return have == want
 
 
+# 部屋行の見出し（td.shisetsu / th.shisetsu）が対象の部屋か。ROOM_LABEL がそのまま含まれる行のほか、
+# 「多目的」の部屋は表記ゆれ（多目的ホール / 多目的室 等）を同じ部屋とみなす。
+# 同期・非同期・HTTP の各エンジンと JS 側（ROOM_MATCH_JS）で同じ規則を使う
+def room_matches(room: str, room_label: str) -> bool:
+    return room_label in room or ("多目的" in room_label and "多目的" in room)
+
+
+ROOM_MATCH_JS = (
+    "(room, roomLabel) => room.includes(roomLabel)"
+    " || (roomLabel.includes('多目的') && room.includes('多目的'))"
+)
+
+
+# カレンダーの checkdate を1回で走査する。マークは _read_mark と同じ順
+# （innerText → title → aria-label → img alt）で読み、日付ごとの索引の元にする。
+# 走査のたびに window.__calIndexToken を振り直し、クリック時に同じ DOM かを確かめる。
+_SCAN_CALENDAR_JS = """
+(roomLabel) => {
+    const roomMatches = ROOM_MATCH_JS;
+    const MARKS = ['○', '△', '×', '―'];
+    const readMark = (label) => {
+        const t = (label.innerText || '').trim();
+        if (MARKS.includes(t)) return t;
+        for (const attr of ['title', 'aria-label']) {
+            const v = (label.getAttribute(attr) || '').trim();
+            if (MARKS.includes(v)) return v;
+        }
+        const img = label.querySelector('img');
+        const alt = img ? (img.getAttribute('alt') || '').trim() : '';
+        return MARKS.includes(alt) ? alt : t;
+    };
+    const token = Math.random().toString(36).slice(2);
+    window.__calIndexToken = token;
+    const entries = [];
+    document.querySelectorAll('input[name="checkdate"]').forEach(inp => {
+        const ymd = (inp.value || '').substring(0, 8);
+        const id = inp.id;
+        const label = id ? document.querySelector('label[for="' + id + '"]') : null;
+        if (!label) return;
+        const row = inp.closest('tr');
+        if (!row) return;
+        const roomCell = row.querySelector('td.shisetsu, th.shisetsu');
+        const room = roomCell ? roomCell.textContent.trim() : '';
+        if (!roomMatches(room, roomLabel)) return;
+        entries.push({ymd, room, input: id, label: label.id || null, mark: readMark(label)});
+    });
+    return {token, entries, overlay: window.__overlayGuard || null};
+}
+""".replace("ROOM_MATCH_JS", ROOM_MATCH_JS)
+
+# 索引のエントリー1件をクリックする。別ページに遷移済み（トークン不一致）なら 'stale'
+_CLICK_INDEXED_DATE_JS = """
+({token, input, label}) => {
+    if (window.__calIndexToken !== token) return 'stale';
+    const lab = (label && document.getElementById(label))
+        || document.querySelector('label[for="' + input + '"]');
+    if (!lab) return 'missing';
+    lab.click();
+    return 'ok';
+}
+"""
+
+# page → {"token": str, "days": {YYYYMMDD: {ymd, room, input, label, mark}}}
+# read_all_availability で作り、ページ遷移（framenavigated）で捨てる
+CALENDAR_INDEX: dict = {}
+_INDEX_WATCHED: set = set()
+
+
+def _watch_calendar_index(page):
+    """メインフレームが遷移したらそのページの索引を捨てる（ページごとに1回だけ登録）"""
+    if page in _INDEX_WATCHED:
+        return
+    _INDEX_WATCHED.add(page)
+
+    def on_navigated(frame):
+        if frame == page.main_frame:
+            CALENDAR_INDEX.pop(page, None)
+
+    page.on("framenavigated", on_navigated)
+    page.on("close", lambda _: (CALENDAR_INDEX.pop(page, None), _INDEX_WATCHED.discard(page)))
+
+
+@traced
 def read_all_availability(page, room_label: str) -> dict[str, str]:
     """カレンダーから全日程の空きマークをJS一括読み取りで取得。
+    同時に 日付 → (部屋, input ID, label ID, マーク) の索引を作り、click_date_on_calendar で使う。
     戻り値: {YYYYMMDD: マーク(○/△/×等)}
     """
-    return page.evaluate("""(roomLabel) => {
-        const result = {};
-        document.querySelectorAll('input[name="checkdate"]').forEach(inp => {
-            const val = inp.value || '';
-            const ymd = val.substring(0, 8);
-            const id = inp.id;
-            const label = document.querySelector('label[for="' + id + '"]');
-            if (!label) return;
-            const row = inp.closest('tr');
-            if (!row) return;
-            const roomCell = row.querySelector('td.shisetsu, th.shisetsu');
-            const room = roomCell ? roomCell.textContent.trim() : '';
-            if (!room.includes(roomLabel) && !room.includes('多目的')) return;
-            const mark = (label.innerText || '').trim();
-            if (mark) result[ymd] = mark;
-        });
-        return result;
-    }""", room_label)
+    _watch_calendar_index(page)
+    scan = page.evaluate(_SCAN_CALENDAR_JS, room_label)
+    days: dict[str, dict] = {}
+    for entry in scan["entries"]:
+        # 同じ日に複数行ある場合は空きのある方を優先
+        prev = days.get(entry["ymd"])
+        if prev is None or (prev["mark"] not in OK_MARKS and entry["mark"] in OK_MARKS):
+            days[entry["ymd"]] = entry
+    CALENDAR_INDEX[page] = {"token": scan["token"], "days": days}
+    if (scan.get("overlay") or {}).get("sessionWarning"):
+        log_overlay_guard(scan["overlay"], "calendar")
+    availability = {ymd: e["mark"] for ymd, e in days.items() if e["mark"]}
+    # 履歴はメモリに溜めるだけ（書き込みは flush_history で予約が終わってから）
+    if availability:
+        HISTORY_BUFFER.append((time.time(), room_label, availability))
+    return availability
 
 
 def scan_available_days(availability: dict[str, str], candidates: list[datetime]) -> list[datetime]:
@@ -439,18 +1264,39 @@ def scan_available_days(availability: dict[str, str], candidates: list[datetime]
     return available
 
 
+@traced
 def click_date_on_calendar(page, d: datetime) -> bool:
-    """カレンダーの指定日をクリック"""
+    """カレンダーの指定日をクリック。
+    read_all_availability の索引があれば1回の evaluate でクリックし、なければ DOM を探す。"""
+    ymd = d.strftime("%Y%m%d")
+    index = CALENDAR_INDEX.get(page)
+    entry = index["days"].get(ymd) if index else None
+    if entry:
+        if entry["mark"] not in OK_MARKS:
+            debug(f"[calendar] {d.strftime('%Y-%m-%d')} は空きなし (mark={entry['mark']})")
+            return False
+        result = page.evaluate(_CLICK_INDEXED_DATE_JS, {"token": index["token"], **entry})
+        if result == "ok":
+            mark_once("first_click")
+            debug(f"[calendar] {d.strftime('%Y-%m-%d')} をクリック (mark={entry['mark']})")
+            return True
+        debug(f"[calendar] 索引が使えない ({result}) → DOM を探索")
+        CALENDAR_INDEX.pop(page, None)
+    return _click_date_by_probe(page, d)
+
+
+def _click_date_by_probe(page, d: datetime) -> bool:
+    """索引なしで checkdate を1つずつ調べてクリックする"""
     ymd = d.strftime("%Y%m%d")
     inputs = page.locator(f'input[name="checkdate"][value^="{ymd}"]')
     for i in range(inputs.count()):
         el = inputs.nth(i)
         try:
-            row = el.locator("xpath=ancestor::tr[1]")
-            row_txt = (row.first.text_content() or "") if row.count() else ""
+            head = el.locator("xpath=ancestor::tr[1]").locator("td.shisetsu, th.shisetsu")
+            room = (head.first.text_content() or "").strip() if head.count() else ""
         except Exception:
-            row_txt = ""
-        if ROOM_LABEL not in row_txt and "多目的" not in row_txt:
+            room = ""
+        if not room_matches(room, page_target(page).room):
             continue
         cid = el.get_attribute("id") or ""
         lab = page.locator(f'label[for="{cid}"]')
@@ -459,6 +1305,7 @@ def click_date_on_calendar(page, d: datetime) -> bool:
         mark = _read_mark(lab.first)
         if mark in OK_MARKS:
             lab.first.click()
+            mark_once("first_click")
             debug(f"[calendar] {d.strftime('%Y-%m-%d')} をクリック (mark={mark})")
             return True
     debug(f"[calendar] {d.strftime('%Y-%m-%d')} は空きなし")
@@ -492,83 +1339,91 @@ def _read_mark(lab) -> str:
 
 
 # ====== Step 4: 時間帯選択 ======
+@traced
 def go_to_timeslot_grid(page) -> bool:
     """カレンダー画面から時間帯別画面へ遷移"""
-    if click_next_button(page):
+    kind = click_next_button(page, expect="timeslot")
+    if kind == "timeslot":
+        debug("[timeslot] 時間帯別画面へ遷移成功")
+        save_diag(page, "step5_timeslot")
+        return True
+
+    # フォールバック: __doPostBack（ボタンがない・押しても遷移しなかったときだけ。
+    # 別の画面が返ってきた場合はサーバーに断られているので、同じポストバックを繰り返さない）
+    if kind in (False, "no_response"):
         try:
-            page.wait_for_selector("input[name='checktime']", timeout=5000)
-            debug("[timeslot] 時間帯別画面へ遷移成功")
-            save_diag(page, "step5_timeslot")
+            kind = wait_transition(page, lambda: page.evaluate("__doPostBack('next','')"),
+                                   "next_postback", expect="timeslot")
+        except Exception as e:
+            kind = f"exception: {e}"
+        if kind == "timeslot":
+            debug("[timeslot] 時間帯別画面へ遷移成功 (postback)")
             return True
-        except Exception:
-            pass
+    save_diag(page, "timeslot_fail", level=1)
+    debug(f"[timeslot] 時間帯別画面への遷移失敗（{kind}）")
+    return False
 
-    # フォールバック: __doPostBack
-    try:
-        page.evaluate("__doPostBack('next','')")
-        page.wait_for_selector("input[name='checktime']", timeout=5000)
-        debug("[timeslot] 時間帯別画面へ遷移成功 (postback)")
-        return True
-    except Exception:
-        save_diag(page, "timeslot_fail", level=1)
-        debug("[timeslot] 時間帯別画面への遷移失敗")
-        return False
 
+# 時間帯グリッド全体（部屋行・見出し・マーク・checktime の ID と value）を1回で読む
+_READ_TIMESLOT_GRID_JS = """
+() => [...document.querySelectorAll('table.calendar.horizon.toggle')].map((t, ti) => ({
+    index: ti,
+    headers: [...t.querySelectorAll('thead th')].map(th => th.textContent || ''),
+    rows: [...t.querySelectorAll('tbody tr')].map((tr, ri) => {
+        const head = tr.querySelector('td.shisetsu, th.shisetsu');
+        return {
+            index: ri,
+            room: head ? (head.textContent || '').trim() : null,
+            cells: [...tr.querySelectorAll('td')].map(td => {
+                const box = td.querySelector("input[name='checktime']");
+                return {text: td.textContent || '', box: box ? (box.id || '') : null, value: box ? box.value : ''};
+            }),
+        };
+    }),
+}))
+"""
 
-def pick_time_slots(page) -> bool:
-    """18:30~19:30, 19:30~20:30, 20:30~21:30 の3枠を選択"""
-    table, row = _find_room_row(page)
-    if not table or not row:
-        debug("[timeslot] 多目的ホール行が見つかりません")
-        return False
+# 指定セルの checktime をオンにする。click はトグルなので未チェックのときだけ押す
+# （input の click → label のクリック → 直接セット の順で試す。チェック済みの枠は外さない）
+_CHECK_TIME_BOXES_JS = """
+(targets) => {
+    const tables = document.querySelectorAll('table.calendar.horizon.toggle');
+    let picked = 0;
+    for (const {id, table, row, col} of targets) {
+        let el = id ? document.getElementById(id) : null;
+        if (!el) {
+            const tr = tables[table]?.querySelectorAll('tbody tr')[row];
+            el = tr?.querySelectorAll('td')[col]?.querySelector("input[name='checktime']");
+        }
+        if (!el) continue;
+        if (!el.checked) el.click();
+        if (!el.checked && el.id) document.querySelector(`label[for="${el.id}"]`)?.click();
+        if (!el.checked) {
+            el.checked = true;
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+        if (el.checked) picked++;
+    }
+    return picked;
+}
+"""
 
-    wanted_norm = {norm_wave(s) for s in WANTED_SLOTS}
-    cols = _find_wanted_columns(table, wanted_norm)
-    if len(cols) < len(WANTED_SLOTS):
-        debug(f"[timeslot] 対象列が不足: found={len(cols)} want={len(WANTED_SLOTS)}")
-        return False
 
-    cells = row.locator("td")
-    picked = 0
-    for ci in cols:
-        if ci >= cells.count():
-            continue
-        cell = cells.nth(ci)
-        mark_txt = cell.text_content() or ""
-        if not any(m in mark_txt for m in OK_MARKS):
-            debug(f"[timeslot] col={ci} は空きなし")
-            return False
-        if _check_time_cell(cell):
-            picked += 1
-
-    debug(f"[timeslot] picked={picked}/{len(WANTED_SLOTS)}")
-    return picked == len(WANTED_SLOTS)
-
-
-def _find_room_row(page):
-    """時間帯テーブルから多目的ホール行を見つける"""
-    tables = page.locator("table.calendar.horizon.toggle")
-    for i in range(tables.count()):
-        t = tables.nth(i)
-        rows = t.locator("tbody tr")
-        for r in range(rows.count()):
-            row = rows.nth(r)
-            head = row.locator("td.shisetsu, th.shisetsu")
-            if head.count():
-                txt = (head.first.text_content() or "").strip()
-                if ROOM_LABEL in txt:
-                    return t, row
-    return None, None
+def read_timeslot_grid(page) -> list[dict]:
+    """時間帯別画面の checktime グリッドを1回の evaluate で取得する。
+    戻り値: [{index, headers(norm_wave 済み), rows: [{index, room, cells: [{text, box, value}]}]}]
+    box は checktime の ID（ID なしは ""、チェックボックスなしは None）、value はその value 属性"""
+    tables = page.evaluate(_READ_TIMESLOT_GRID_JS)
+    for t in tables:
+        t["headers"] = [norm_wave(h) for h in t["headers"]]
+    return tables
 
 
-def _find_wanted_columns(table, wanted_norm: set) -> list[int]:
-    """テーブルヘッダーからWANTED_SLOTSに対応する列インデックスを返す"""
-    ths = table.locator("thead th")
+def _find_wanted_columns(headers: list[str], wanted_norm: set) -> list[int]:
+    """見出し（norm_wave 済み）から WANTED_SLOTS に対応する列インデックスを返す"""
     cols = []
-    for i in range(ths.count()):
-        raw = ths.nth(i).text_content() or ""
-        header_text = norm_wave(raw)
-        m = re.search(r"(\d{1,2})\s*[:：]\s*(\d{2})\s*[~～〜\-－–]\s*(\d{1,2})\s*[:：]\s*(\d{2})", header_text)
+    for i, header_text in enumerate(headers):
+        m = SLOT_RE.search(header_text)
         if not m:
             continue
         h1, m1, h2, m2 = int(m.group(1)), m.group(2), int(m.group(3)), m.group(4)
@@ -579,52 +1434,129 @@ def _find_wanted_columns(table, wanted_norm: set) -> list[int]:
     return cols
 
 
-def _check_time_cell(cell) -> bool:
-    """時間枠セルのチェックボックスをオンにする"""
-    try:
-        inp = cell.locator("input[name='checktime']")
-        if inp.count():
-            inp.first.check(timeout=800)
-            return True
-    except Exception:
-        pass
-    try:
-        lab = cell.locator("label")
-        if lab.count():
-            lab.first.click(timeout=800)
-            return True
-    except Exception:
-        pass
-    try:
-        inp = cell.locator("input[name='checktime']")
-        if inp.count():
-            inp.first.evaluate(
-                "(el) => { el.checked = true; el.dispatchEvent(new Event('change', {bubbles: true})); }"
-            )
-            return True
-    except Exception:
-        pass
-    return False
+def _row_slot_targets(table: dict, row: dict, slots: list[str]) -> list[dict] | None:
+    """部屋行の slots（WANTED_SLOTS）列が全て空いていれば、チェックする checktime の一覧を返す。
+    列が足りない・1枠でも埋まっている場合は None。"""
+    wanted_norm = {norm_wave(s) for s in slots}
+    cols = _find_wanted_columns(table["headers"], wanted_norm)
+    if len(cols) < len(slots):
+        debug(f"[timeslot] 対象列が不足: found={len(cols)} want={len(slots)}")
+        return None
+
+    targets = []
+    for ci in cols:
+        if ci >= len(row["cells"]):
+            continue
+        cell = row["cells"][ci]
+        if not any(m in cell["text"] for m in OK_MARKS):
+            debug(f"[timeslot] col={ci} は空きなし")
+            return None
+        if cell["box"] is not None:
+            targets.append({"id": cell["box"], "table": table["index"], "row": row["index"], "col": ci})
+    return targets
+
+
+@traced
+def pick_time_slots(page) -> bool:
+    """ページの対象の時間帯（既定: 18:30~19:30, 19:30~20:30, 20:30~21:30 の3枠）を選択
+    （グリッド読み取り1回 + チェック1回）"""
+    target = page_target(page)
+    table = row = None
+    for t in read_timeslot_grid(page):
+        row = next((r for r in t["rows"] if r["room"] and room_matches(r["room"], target.room)), None)
+        if row:
+            table = t
+            break
+    if not row:
+        debug(f"[timeslot] {target.room} 行が見つかりません")
+        return False
+
+    targets = _row_slot_targets(table, row, target.slots)
+    if targets is None:
+        return False
+    picked = page.evaluate(_CHECK_TIME_BOXES_JS, targets) if targets else 0
+    debug(f"[timeslot] picked={picked}/{len(target.slots)}")
+    return picked == len(target.slots)
+
+
+def _day_patterns(d: datetime) -> list[str]:
+    """画面上で日付が書かれうる表記"""
+    return [
+        f"{d.month}月{d.day}日",
+        d.strftime("%Y%m%d"),
+        d.strftime("%Y-%m-%d"),
+        f"{d.year}/{d.month}/{d.day}",
+        d.strftime("%Y/%m/%d"),
+    ]
+
+
+def mentions_day(text: str, d: datetime) -> bool:
+    """text に日付 d が書かれているか（2026/11/1 が 2026/11/16 に当たらないよう後ろの数字を見る）"""
+    text = re.sub(r"\s+", "", text)
+    return any(re.search(re.escape(p) + r"(?!\d)", text) for p in _day_patterns(d))
+
+
+def _match_day_rows(grid: list[dict], days: list[datetime], room: str) -> dict[datetime, tuple]:
+    """
+    時間帯画面（選んだ日ごとに1行）の行を日に対応付ける。戻り値: {日: (表, 行)}（見つからない日は含まない）
+    1. checktime の value の先頭（YYYYMMDD。checkdate と同じ形式）
+    2. value に日付がなければ行の順番（カレンダーでチェックした日は日付順に1行ずつ並ぶ）
+    3. 行数が合わなければ行の文字列に書かれた日付
+    """
+    rows = [(t, r) for t in grid for r in t["rows"]
+            if any(c["box"] is not None for c in r["cells"])
+            and (not r["room"] or room_matches(r["room"], room))]
+    by_ymd: dict[str, tuple] = {}
+    for t, r in rows:
+        ymd = next((c["value"][:8] for c in r["cells"] if re.match(r"\d{8}", c.get("value") or "")), None)
+        if ymd:
+            by_ymd.setdefault(ymd, (t, r))
+    if by_ymd:
+        return {d: by_ymd[d.strftime("%Y%m%d")] for d in days if d.strftime("%Y%m%d") in by_ymd}
+    if len(rows) == len(days):
+        return dict(zip(sorted(days), rows))
+    found = {}
+    for d in days:
+        for t, r in rows:
+            row_text = " ".join([r["room"] or ""] + [c["text"] for c in r["cells"]])
+            if mentions_day(row_text, d):
+                found[d] = (t, r)
+                break
+    return found
+
+
+@traced
+def pick_time_slots_batch(page, days: list[datetime]) -> list[datetime]:
+    """複数日分の時間帯グリッド（1日1行）で、ページの対象の時間帯が全て空いている行をまとめてチェックする。
+    行と日の対応は _match_day_rows。戻り値: チェックできた日のリスト（グリッド読み取り1回 + チェック1回）"""
+    target = page_target(page)
+    rows = _match_day_rows(read_timeslot_grid(page), days, target.room)
+    targets, picked_days = [], []
+    for d in days:
+        if d not in rows:
+            debug(f"[batch] {d.strftime('%Y-%m-%d')} の行が時間帯画面にありません")
+            continue
+        row_targets = _row_slot_targets(*rows[d], target.slots)
+        if row_targets is None or len(row_targets) < len(target.slots):
+            debug(f"[batch] {d.strftime('%Y-%m-%d')} 18:30-21:30 が空いていない → 外す")
+            continue
+        targets.extend(row_targets)
+        picked_days.append(d)
+
+    picked = page.evaluate(_CHECK_TIME_BOXES_JS, targets) if targets else 0
+    debug(f"[batch] picked={picked}/{len(targets)} ({len(picked_days)}日)")
+    return picked_days if picked == len(targets) else []
 
 
 # ====== Step 5: 申請フォーム入力 ======
+@traced
 def fill_application_form(page) -> bool:
     """申請フォームに必要事項を入力。
     jQuery/JSで直接値をセットすることでオーバーレイ等の影響を回避する。
     """
     page.wait_for_selector("input[name='spinnerNinzu']", timeout=5000)
 
-    # まずオーバーレイを閉じる（セッションタイムアウト警告等）
-    page.evaluate("""() => {
-        document.querySelectorAll('.remodal-overlay').forEach(el => {
-            el.style.display = 'none';
-        });
-        document.querySelectorAll('.remodal').forEach(el => {
-            el.style.display = 'none';
-        });
-    }""")
-
-    # 全フィールドをJavaScriptで一括設定
+    # 全フィールドをJavaScriptで一括設定（オーバーレイは OVERLAY_GUARD_JS が隠している）
     result = page.evaluate("""({ninzu, mokuteki, name, count, note}) => {
         const errors = [];
 
@@ -721,7 +1653,7 @@ def fill_application_form(page) -> bool:
             }
         } catch(e) { errors.push('contents3: ' + e.message); }
 
-        return {errors: errors, ok: errors.length === 0};
+        return {errors: errors, ok: errors.length === 0, overlay: window.__overlayGuard || null};
     }""", {
         "ninzu": NINZU,
         "mokuteki": MOKUTEKI,
@@ -730,6 +1662,7 @@ def fill_application_form(page) -> bool:
         "note": "なし",
     })
 
+    log_overlay_guard(result.get("overlay"), "form")
     if result.get("errors"):
         for e in result["errors"]:
             debug(f"[form] ERROR: {e}")
@@ -745,26 +1678,23 @@ def fill_application_form(page) -> bool:
 # ====== 戻る操作 ======
 def go_back_to_calendar(page) -> bool:
     """時間帯選択画面からカレンダー画面へ戻る"""
-    for sel in [
+    btn = find_first(page, "back", [
         "a.btnGray:has-text('戻る')",
         "a:has-text('戻る')",
         "button:has-text('戻る')",
         "input[type='submit'][value*='戻る']",
         "input[type='button'][value*='戻る']",
-    ]:
-        btn = page.locator(sel)
-        if btn.count():
-            btn.first.click()
-            page.wait_for_load_state("domcontentloaded")
-            debug("[back] カレンダー画面へ戻りました")
-            return True
+    ])
+    if btn is not None:
+        kind = wait_transition(page, btn.click, "back", expect="calendar")
+        debug(f"[back] カレンダー画面へ戻りました（{kind}）")
+        return kind not in NAV_FAILURES
 
     # フォールバック: __doPostBack で戻る
     try:
-        page.evaluate("__doPostBack('prev','')")
-        page.wait_for_load_state("domcontentloaded")
-        debug("[back] カレンダー画面へ戻りました (postback)")
-        return True
+        kind = wait_transition(page, lambda: page.evaluate("__doPostBack('prev','')"), "back", expect="calendar")
+        debug(f"[back] カレンダー画面へ戻りました (postback, {kind})")
+        return kind not in NAV_FAILURES
     except Exception:
         pass
 
@@ -772,6 +1702,7 @@ def go_back_to_calendar(page) -> bool:
     return False
 
 
+@traced
 def return_to_calendar_after_booking(page) -> bool:
     """予約完了後にカレンダー画面へ復帰する。
     施設選択からやり直す（最も確実で高速）。
@@ -785,6 +1716,88 @@ def return_to_calendar_after_booking(page) -> bool:
         return False
 
 
+def remember_calendar_url(page):
+    """今いるカレンダー画面の URL を quick 復帰用に覚える"""
+    global CALENDAR_URL
+    if page.locator("table.calendar.horizon.toggle").count():
+        CALENDAR_URL = page.url
+
+
+@traced
+def quick_restore_calendar(page, target_month: datetime) -> bool:
+    """覚えておいたカレンダー URL を直接開く（サーバー側のセッションに施設・部屋の選択が残っている前提）。
+    1ヶ月表示・対象月になっていなければ「表示」を1回押す。対象月のカレンダーに着けば True。"""
+    if not CALENDAR_URL:
+        return False
+    try:
+        kind = wait_transition(page, lambda: page.goto(CALENDAR_URL, wait_until="commit"), "restore", expect="calendar")
+    except Exception as e:
+        debug(f"[restore] カレンダー URL を開けません: {e}")
+        return False
+    if kind != "calendar":
+        debug(f"[restore] カレンダー URL を開けません（{kind}）")
+        return False
+    # 別の施設・部屋のカレンダーが出た場合（複数の予約対象で選択が上書きされた等）は使えない
+    room = page_target(page).room
+    if not page.locator("td.shisetsu, th.shisetsu").filter(has_text=room).count():
+        debug(f"[restore] カレンダーに {room} がありません")
+        return False
+    if not _is_target_month_view(page, target_month):
+        refresh_calendar(page, target_month)
+    return get_calendar_header_year_month(page) == (target_month.year, target_month.month)
+
+
+def _is_target_month_view(page, target_month: datetime) -> bool:
+    """1ヶ月表示で対象月のカレンダーが出ているか（quick 復帰で「表示」を押し直すかの判定）"""
+    one_month = page.evaluate("""() => {
+        const radio = document.querySelector('#radioPeriod1month') ||
+                      document.querySelector('input[type="radio"][value="1month"]');
+        return !!(radio && radio.checked);
+    }""")
+    return one_month and get_calendar_header_year_month(page) == (target_month.year, target_month.month)
+
+
+def restore_calendar(page, target_month: datetime):
+    """予約完了後、対象月の1ヶ月表示カレンダーまで戻す。
+    RESTORE_MODE=quick ならカレンダー URL を直接開き、失敗したときだけ施設選択からやり直す。"""
+    if RESTORE_MODE == "quick":
+        t0 = time.perf_counter()
+        try:
+            ok = quick_restore_calendar(page, target_month)
+        except Exception as e:
+            debug(f"[restore] quick 復帰で例外: {e}")
+            ok = False
+        if ok:
+            _record_restore("quick", time.perf_counter() - t0)
+            return
+        debug("[restore] quick 復帰失敗 → 施設選択から復帰")
+
+    t0 = time.perf_counter()
+    with span("restore_full"):
+        if not return_to_calendar_after_booking(page):
+            # 復帰失敗: フルリセット
+            debug("[main] カレンダー復帰失敗 → フルリセット")
+            login(page)
+            select_facility(page)
+        set_display_period_one_month(page, datetime(target_month.year, target_month.month, 1))
+        navigate_to_month(page, target_month)
+    remember_calendar_url(page)
+    _record_restore("full", time.perf_counter() - t0)
+
+
+def _record_restore(kind: str, sec: float):
+    RESTORE_TIMINGS.append((kind, sec))
+    debug(f"[restore] {kind} {sec:.2f}s")
+
+
+def report_restore_timings():
+    """カレンダー復帰の方式別 回数 / 平均 / 最大"""
+    for kind in ("quick", "full"):
+        v = [sec for k, sec in RESTORE_TIMINGS if k == kind]
+        if v:
+            debug(f"[restore] {kind}: n={len(v)} mean={statistics.mean(v):.2f}s max={max(v):.2f}s")
+
+
 # ====== 1日分の予約フロー（カレンダー画面から開始） ======
 def book_single_day(page, target: datetime) -> bool:
     """
@@ -814,7 +1827,7 @@ def book_single_day(page, target: datetime) -> bool:
         return False
 
     # 次へ → フォーム画面
-    if not click_next_button(page):
+    if click_next_button(page, expect="form") != "form":
         debug(f"[book] {ymd} 時間枠後の遷移に失敗")
         go_back_to_calendar(page)
         return False
@@ -824,8 +1837,11 @@ def book_single_day(page, target: datetime) -> bool:
 
     # Step 1: 確定ボタンを押す → 申込確認画面へ遷移
     try:
-        page.evaluate("__doPostBack('next','')")
-        page.wait_for_load_state("domcontentloaded")
+        with span("submit_confirm", day=ymd):
+            kind = wait_transition(page, lambda: page.evaluate("__doPostBack('next','')"), "confirm")
+        # 入力エラーでフォームに戻された・セッション切れ等は待たずに失敗
+        if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+            raise RuntimeError(f"申込確認画面に進めません（{kind}）")
         debug(f"[book] {ymd}({weekday_name}) 確定 → 申込確認画面")
     except Exception as e:
         debug(f"[book] 確定ボタン押下失敗: {e}")
@@ -841,8 +1857,10 @@ def book_single_day(page, target: datetime) -> bool:
 
     # Step 2: 申込確認画面 → 「申込」ボタンを押す
     try:
-        page.evaluate("__doPostBack('next','')")
-        page.wait_for_load_state("domcontentloaded")
+        with span("submit_apply", day=ymd):
+            kind = wait_transition(page, lambda: page.evaluate("__doPostBack('next','')"), "apply")
+        if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+            raise RuntimeError(f"申込が完了しません（{kind}）")
         debug(f"[book] {ymd}({weekday_name}) 申込完了")
     except Exception as e:
         debug(f"[book] 申込ボタン押下失敗: {e}")
@@ -853,83 +1871,1281 @@ def book_single_day(page, target: datetime) -> bool:
     return True
 
 
+# ====== 空き状況の履歴 ======
+# read_all_availability のスナップショット [(time.time(), 部屋, {YYYYMMDD: マーク})]
+HISTORY_BUFFER: list[tuple[float, str, dict[str, str]]] = []
+# (DB, 部屋, 年, 月) → 候補日の競合度。締切前に求めておき、締切後は引くだけにする
+_HISTORY_SCORES: dict[tuple, dict[str, float]] = {}
+
+
+def history_scores(year: int, month: int, target: Target | None = None) -> dict[str, float]:
+    """target（省略時は current_target）の候補日の、履歴から求めた競合度（history.contention_scores）。
+    データ不足なら空"""
+    if HISTORY_DB is None:
+        return {}
+    t = target or current_target()
+    key = (str(HISTORY_DB), t.room, year, month)
+    if key not in _HISTORY_SCORES:
+        scores = {}
+        try:
+            import history
+
+            days = build_candidate_days(year, month, set(), t.weekdays, t.weeks)
+            scores = history.contention_scores(HISTORY_DB, t.room, days)
+        except Exception as e:
+            debug(f"[history] 競合度の集計に失敗: {e}")
+        _HISTORY_SCORES[key] = scores
+        if scores:
+            top = sorted(scores, key=scores.get, reverse=True)[:5]
+            debug(f"[history] 履歴の競合度で順番を決定（上位: {', '.join(top)}）")
+        else:
+            debug("[history] 履歴が不足 → 既定の競合度（WEEK_PRIORITY）")
+    return _HISTORY_SCORES[key]
+
+
+def flush_history():
+    """溜めたスナップショットを HISTORY_DB に書き込む"""
+    if HISTORY_DB is None or not HISTORY_BUFFER:
+        HISTORY_BUFFER.clear()
+        return
+    try:
+        import history
+
+        history.save_snapshots(HISTORY_DB, HISTORY_BUFFER)
+        debug(f"[history] {len(HISTORY_BUFFER)}件のスナップショットを記録")
+    except Exception as e:
+        debug(f"[history] 記録に失敗: {e}")
+    HISTORY_BUFFER.clear()
+
+
+# ====== 予約計画 ======
+def default_contention(d: datetime, mark: str, weeks: list[int] | None = None) -> float:
+    """日ごとの競合度（大きいほど他団体に先に取られやすい）。
+    weeks（既定: WEEK_PRIORITY）で後ろの週ほど競合が多い前提で週の順位を使い、
+    既に一部埋まっている（△）日は上乗せする。"""
+    weeks = WEEK_PRIORITY if weeks is None else weeks
+    wn = get_week_number(d)
+    rank = weeks.index(wn) if wn in weeks else len(weeks)
+    return rank + (0.5 if mark == "△" else 0.0)
+
+
+class BookingPlan:
+    """
+    1回の空き状況スナップショットから作る予約計画。
+    1週1日・曜日優先・祝日除外（build_candidate_days）を満たす範囲で、最大 max_days 週を
+    週の優先順（target.weeks。省略時は current_target）に割り当て、各週の候補日は曜日優先順に並べる。
+    試す順番は競合度の高い日から（取られやすい日を最初の数秒で押さえる）。
+    結果を record で伝えると、成功した週は閉じ、失敗した日は同じ週の次の候補に、
+    週ごと尽きたら予備の週に差し替える（スキャンし直さない）。
+    """
+
+    def __init__(self, availability: dict[str, str], year: int, month: int, max_days: int,
+                 booked_weeks: set[int] = frozenset(), scores: dict[str, float] | None = None,
+                 target: Target | None = None):
+        t = target or current_target()
+        self.weeks = list(t.weeks)
+        self.marks = availability
+        self.scores = scores or {}
+        self.slots = max(0, max_days)
+        self.booked: list[datetime] = []
+        # 週 → その週の候補日（曜日優先順）
+        self.by_week: dict[int, list[datetime]] = {}
+        for d in build_candidate_days(year, month, set(booked_weeks), t.weekdays, t.weeks):
+            if availability.get(d.strftime("%Y%m%d"), "") in OK_MARKS:
+                self.by_week.setdefault(get_week_number(d), []).append(d)
+        weeks = [wn for wn in self.weeks if wn in self.by_week]
+        self.active: list[int] = weeks[:self.slots]
+        self.reserve: list[int] = weeks[self.slots:]
+
+    def score(self, d: datetime) -> float:
+        ymd = d.strftime("%Y%m%d")
+        if ymd in self.scores:
+            return self.scores[ymd]
+        return default_contention(d, self.marks.get(ymd, ""), self.weeks)
+
+    def next_day(self) -> datetime | None:
+        """次に試す日（割り当て中の週の先頭候補のうち競合度が最大のもの）"""
+        if len(self.booked) >= self.slots or not self.active:
+            return None
+        heads = [self.by_week[wn][0] for wn in self.active]
+        return max(heads, key=lambda d: (self.score(d), -self.active.index(get_week_number(d))))
+
+    def record(self, d: datetime, ok: bool):
+        """試行結果を反映する"""
+        wn = get_week_number(d)
+        if wn not in self.active:
+            return
+        if ok:
+            self.booked.append(d)
+            self.active.remove(wn)
+            return
+        days = self.by_week[wn]
+        if d in days:
+            days.remove(d)
+        if not days:
+            self._retire(wn)
+
+    def next_after(self, d: datetime, ok: bool = True) -> datetime | None:
+        """d の結果が ok だったとしたら次に試す日（計画は変えない。先読みの対象を決める）"""
+        trial = copy.deepcopy(self)
+        trial.record(d, ok)
+        return trial.next_day()
+
+    def drop_unavailable(self, availability: dict[str, str]):
+        """新しく読んだマークで埋まった日を計画から外す（並び順は変えない）"""
+        self.marks.update(availability)
+        for wn in list(self.active) + list(self.reserve):
+            days = [d for d in self.by_week[wn] if availability.get(d.strftime("%Y%m%d"), "") in OK_MARKS]
+            self.by_week[wn] = days
+            if not days:
+                self._retire(wn)
+
+    def _retire(self, wn: int):
+        """候補の尽きた週を外し、割り当て中だったら予備の週を1つ繰り上げる"""
+        if wn in self.reserve:
+            self.reserve.remove(wn)
+            return
+        self.active.remove(wn)
+        while self.reserve:
+            nxt = self.reserve.pop(0)
+            if self.by_week[nxt]:
+                self.active.append(nxt)
+                break
+
+    def log(self):
+        debug(f"[plan] 割り当て {len(self.active)}週 / 予備 {len(self.reserve)}週")
+        order = sorted(self.active, key=lambda wn: -self.score(self.by_week[wn][0]))
+        for wn in order:
+            days = " → ".join(
+                f"{d.strftime('%m/%d')}({WEEKDAY_JA[d.weekday()]})" for d in self.by_week[wn]
+            )
+            debug(f"[plan]   第{wn}週 競合度={self.score(self.by_week[wn][0]):.1f}: {days}")
+
+
 # ====== メインフロー: 最大5日予約 ======
-def book_days(page, target_month: datetime) -> list[datetime]:
+def setup_calendar(page, target_month: datetime):
+    """ログイン → 施設選択 → 1ヶ月表示 → 対象月 まで進める"""
+    login(page)
+    select_facility(page)
+    set_display_period_one_month(page, datetime(target_month.year, target_month.month, 1))
+    navigate_to_month(page, target_month)
+    remember_calendar_url(page)
+
+
+def book_days(page, target_month: datetime, prepared: bool = False,
+              booked_weeks: set[int] | None = None, spare=None,
+              max_days: int | None = None) -> list[datetime]:
     """
-    対象月の平日(月火水木)を最大MAX_DAYS日予約する。
+    対象月の平日(月火水木)を最大 max_days 日（省略時はページの予約対象の max_days）予約する。
     曜日優先順位: 月→火→水→木
     週を分散: 第1週→第2週→…、同じ週には1日だけ。
+    最初のスキャンで BookingPlan を作り、競合度の高い日から試して結果ごとに計画を更新する。
+    prepared=True の場合は対象月のカレンダー上にいる前提でセットアップを省略する。
+
+    BATCH=True の場合は一括申込（book_days_batch）で行う。
+    booked_weeks を渡すとその週は飛ばし、取れた週を書き足す（複数の予約対象で共有する）。
+
+    SPECULATE=True の場合は1日の予約と同時に別セッションの2枚目のタブ（spare。なければ open_calendar_tab で開く）で
+    次の候補日の時間帯別画面まで進めておき、計画どおりならそのタブで時間帯の選択から始める（先読み）。
 
     戻り値: 予約成功した日のリスト
     """
+    if booked_weeks is None:
+        booked_weeks = set()
+    target = page_target(page)
+    max_days = target.max_days if max_days is None else max_days
+    if BATCH:
+        return book_days_batch(page, target_month, prepared, booked_weeks, max_days)
     year, month = target_month.year, target_month.month
     booked: list[datetime] = []
-    booked_weeks: set[int] = set()
+    unclear: list[datetime] = []
+    timings: list[tuple[datetime, float, bool]] = []
 
-    debug(f"[main] 対象月: {year}年{month}月 / 最大{MAX_DAYS}日")
+    debug(f"[main] 対象月: {year}年{month}月 / 最大{max_days}日")
 
     # === セットアップ（1回だけ） ===
-    login(page)
-    select_facility(page)
+    if not prepared:
+        setup_calendar(page, target_month)
 
-    # カレンダー表示設定
-    target_month_start = datetime(year, month, 1)
-    set_display_period_one_month(page, target_month_start)
-    navigate_to_month(page, target_month)
+    fast = None
+    if ENGINE == "http":
+        import postback_client
 
-    while len(booked) < MAX_DAYS:
-        candidates = build_candidate_days(year, month, booked_weeks)
-        tried_ymds = {d.strftime("%Y%m%d") for d in booked}
-        candidates = [d for d in candidates if d.strftime("%Y%m%d") not in tried_ymds]
+        fast = postback_client.HttpBooker(page, target_month)
 
-        if not candidates:
-            debug("[main] 候補日がもうありません")
+    # === 1回のスキャンから予約計画を作り、以降は結果に応じて計画だけを更新する ===
+    availability = read_all_availability(page, target.room)
+    plan = BookingPlan(availability, year, month, max_days, booked_weeks | weeks_taken_elsewhere(),
+                       history_scores(year, month, target), target)
+    plan.log()
+
+    caller_page = page
+    if SPECULATE and fast is None and spare is None:
+        try:
+            spare = open_calendar_tab(page.context, target_month, target)
+        except Exception as e:
+            debug(f"[speculate] 先読み用のタブを開けません → 先読みなし: {e}")
+    if fast is not None:
+        spare = None
+    # spare のタブが時間帯別画面まで進めてある日
+    spare_day: datetime | None = None
+
+    t_start = t_cycle = time.perf_counter()
+    while (day := plan.next_day()) is not None:
+        if spare_day is not None and spare_day != day:
+            # 直前の結果で計画が変わった（週が埋まった・失敗した等）→ 先読みは捨てる
+            debug(f"[speculate] {spare_day.strftime('%Y-%m-%d')} の先読みを破棄（次は {day.strftime('%Y-%m-%d')}）")
+            SPECULATION["discarded"] += 1
+            spare_day = None
+        on_grid = spare_day is not None
+        if not on_grid and fast is None and page not in CALENDAR_INDEX:
+            # 復帰・戻るで索引が消えたら読み直す（クリック用。計画からは埋まった日だけ外す）
+            availability = read_all_availability(page, target.room)
+            if not availability:
+                # 確認画面などで止まっていてカレンダーに居ない
+                restore_calendar(page, target_month)
+                availability = read_all_availability(page, target.room)
+            plan.drop_unavailable(availability)
+            continue
+        if not claim_day(day):
+            plan.record(day, False)
+            continue
+        if on_grid:
+            SPECULATION["hit"] += 1
+            page, spare = spare, page
+            spare_day = None
+        guess = plan.next_after(day) if spare is not None and CALENDAR_URL else None
+
+        t0 = time.perf_counter()
+        ok = False
+        fresh: dict[str, str] = {}
+        try:
+            with span("book_day", day=day.strftime("%Y-%m-%d"), speculated=on_grid) as rec:
+                if spare is None:
+                    ok = fast.book(day) if fast else book_single_day(page, day)
+                    if ok == APPLY_UNCLEAR:
+                        unclear.append(day)
+                        ok = False
+                else:
+                    # 予約と先読みのポストバックを交互に発火し、サーバーの応答待ちを重ねる
+                    flows = {"book": _book_day_steps(page, day, on_grid=on_grid)}
+                    if guess is not None:
+                        flows["prefetch"] = _prefetch_grid_steps(spare, guess, target_month)
+                    results = run_lockstep(flows)
+                    ok = bool(results["book"])
+                    if guess is not None:
+                        reached, fresh = results.get("prefetch") or (False, {})
+                        if reached:
+                            spare_day = guess
+                        else:
+                            SPECULATION["failed"] += 1
+                rec["ok"] = ok
+        finally:
+            if day not in unclear:
+                settle_day(day, ok)
+        timings.append((day, time.perf_counter() - t0, ok))
+        if spare is not None:
+            SPECULATION_TIMINGS.append(("hit" if on_grid else "cold", day, time.perf_counter() - t_cycle))
+        if day in unclear:
+            # 取れているかもしれないので、同じ週の別の日は試さない（枠も1日分使ったものとする）
+            plan.record(day, True)
+            booked_weeks.add(get_week_number(day))
+            debug(f"[main] {day.strftime('%Y-%m-%d')} は申込結果が不明 → 第{get_week_number(day)}週は押さえたまま")
+            continue
+        plan.record(day, ok)
+        if fresh:
+            # 先読みで開き直したカレンダーで埋まった日も外す
+            plan.drop_unavailable(fresh)
+        t_cycle = time.perf_counter()
+        if ok:
+            wn = get_week_number(day)
+            booked.append(day)
+            booked_weeks.add(wn)
+            debug(f"[main] 予約成功 {len(booked)}/{max_days}: "
+                  f"{day.strftime('%Y-%m-%d')}({WEEKDAY_JA[day.weekday()]}) 第{wn}週")
+            # カレンダーに復帰して次の予約へ（次の日を先読み済みならそのタブで続ける）
+            nxt = plan.next_day()
+            if nxt is not None and nxt != spare_day:
+                restore_calendar(page, target_month)
+    if len(booked) < max_days:
+        debug("[main] 計画上の候補日がもうありません")
+    for p in (page, spare):
+        if p is not None and p is not caller_page:
+            close_page(p)
+
+    report_day_timings("serial" if fast is None else "serial/http", timings, time.perf_counter() - t_start)
+    report_restore_timings()
+    report_nav_timings()
+    report_speculation()
+    debug(f"[main] 完了: {len(booked)}日予約成功")
+    for d in booked:
+        debug(f"  - {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 第{get_week_number(d)}週")
+    for d in unclear:
+        debug(f"  ? {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 申込結果不明（サイトで確認してください）")
+    return booked
+
+
+# ====== 一括申込: 複数日を1回の申込で ======
+# カレンダーの checkdate は複数選べ、時間帯画面は選んだ日ごとに1行になる。
+# 週ごとに1日ずつ選んで時間帯・フォーム・確定・申込を1回で済ませ、失敗した日だけ外してやり直す。
+_READ_MESSAGES_JS = """
+() => ({
+    messages: [...document.querySelectorAll(
+        '.message, .error, .errMsg, .validation-summary-errors, .field-validation-error'
+    )].map(el => el.textContent || '').join('\\n'),
+    body: document.body ? document.body.innerText : '',
+})
+"""
+
+
+def _pick_batch(available: list[datetime], booked_weeks: set[int], limit: int) -> list[datetime]:
+    """優先順の空き候補から、まだ取れていない週ごとに1日ずつ最大 limit 日を選ぶ"""
+    batch, weeks = [], set(booked_weeks)
+    for d in available:
+        wn = get_week_number(d)
+        if wn in weeks:
+            continue
+        batch.append(d)
+        weeks.add(wn)
+        if len(batch) >= limit:
             break
+    return batch
+
+
+def apply_batch(page, days: list[datetime]) -> tuple[list[datetime], list[datetime]] | str | None:
+    """
+    カレンダー画面から days をまとめて申し込む。
+    戻り値: (予約できた日, 外した日)。申込を送る前の、どの日が原因か分からない失敗は None
+    （呼び出し側で1日ずつに戻す）。申込を送った後で結果が判別できない場合は APPLY_UNCLEAR
+    （受け付けられた日があるかもしれないので、そのままやり直してはいけない）。
+    """
+    labels = ", ".join(d.strftime("%m/%d") for d in days)
+    debug(f"[batch] === {len(days)}日を一括申込: {labels} ===")
+    dropped: list[datetime] = []
+
+    clicked = []
+    for d in days:
+        if click_date_on_calendar(page, d):
+            clicked.append(d)
+        else:
+            dropped.append(d)
+    if not clicked:
+        return [], dropped
+
+    if not go_to_timeslot_grid(page):
+        go_back_to_calendar(page)
+        return None
+    picked = pick_time_slots_batch(page, clicked)
+    dropped.extend(d for d in clicked if d not in picked)
+    if not picked:
+        go_back_to_calendar(page)
+        return [], dropped
+
+    if click_next_button(page, expect="form") != "form":
+        go_back_to_calendar(page)
+        return None
+    fill_application_form(page)
+
+    try:
+        with span("submit_confirm", day=labels):
+            kind = wait_transition(page, lambda: page.evaluate("__doPostBack('next','')"), "confirm")
+        if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+            raise RuntimeError(f"申込確認画面に進めません（{kind}）")
+    except Exception as e:
+        debug(f"[batch] 確定ボタン押下失敗: {e}")
+        save_diag(page, "batch_confirm_fail", level=1)
+        return None
+    save_diag(page, "batch_confirm")
 
-        # === 事前スキャン: カレンダーの空き状況を一括取得 ===
-        availability = read_all_availability(page, ROOM_LABEL)
-        available_candidates = scan_available_days(availability, candidates)
+    if DRY_RUN:
+        debug(f"[batch] DRY_RUN: 確認画面で停止（申込しません） {labels}")
+        return [], []
 
-        if not available_candidates:
-            debug("[main] 空きのある候補日がありません")
+    try:
+        with span("submit_apply", day=labels):
+            kind = wait_transition(page, lambda: page.evaluate("__doPostBack('next','')"), "apply")
+        if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+            raise RuntimeError(f"申込が完了しません（{kind}）")
+        texts = page.evaluate(_READ_MESSAGES_JS)
+    except Exception as e:
+        debug(f"[batch] 申込ボタン押下失敗: {e}")
+        save_diag(page, "batch_submit_fail", level=1)
+        return APPLY_UNCLEAR
+
+    failed = [d for d in picked if mentions_day(texts["messages"], d)]
+    completed = "完了" in texts["body"]
+    if not completed and not failed:
+        debug("[batch] 申込結果が判別できません")
+        save_diag(page, "batch_unknown", level=1)
+        return APPLY_UNCLEAR
+    booked = [d for d in picked if d not in failed] if completed else []
+    for d in failed:
+        debug(f"[batch] {d.strftime('%Y-%m-%d')} は申込できず → 外してやり直す")
+    save_diag(page, "batch_booked")
+    return booked, dropped + failed
+
+
+def book_days_batch(page, target_month: datetime, prepared: bool = False,
+                    booked_weeks: set[int] | None = None, max_days: int | None = None) -> list[datetime]:
+    """
+    book_days の一括申込版。空き候補から週ごとに1日ずつ（最大 max_days 日）選んで1回で申し込み、
+    取れなかった日を外して残りの週をやり直す。申込前に失敗した場合はその回の日を1日ずつ予約する。
+    申込を送った後で結果が判別できない場合は、カレンダーを開き直して申込前とマークが変わった日を
+    「取れたかもしれない日」として押さえたまま（週も使用済み）にし、変わっていない日だけを1日ずつ予約する。
+    """
+    year, month = target_month.year, target_month.month
+    booked: list[datetime] = []
+    unclear: list[datetime] = []
+    booked_weeks = set() if booked_weeks is None else booked_weeks
+    dropped: set[str] = set()
+    timings: list[tuple[datetime, float, bool]] = []
+    target = page_target(page)
+    max_days = target.max_days if max_days is None else max_days
+
+    debug(f"[batch] 対象月: {year}年{month}月 / 最大{max_days}日")
+    if not prepared:
+        setup_calendar(page, target_month)
+
+    t_start = time.perf_counter()
+    while len(booked) + len(unclear) < max_days:
+        taken_weeks = booked_weeks | weeks_taken_elsewhere()
+        candidates = [d for d in build_candidate_days(year, month, taken_weeks, target.weekdays, target.weeks)
+                      if d.strftime("%Y%m%d") not in dropped]
+        availability = read_all_availability(page, target.room)
+        batch = _pick_batch(scan_available_days(availability, candidates), taken_weeks,
+                            max_days - len(booked) - len(unclear))
+        batch = [d for d in batch if claim_day(d)]
+        if not batch:
+            debug("[batch] 空きのある候補日がありません")
             break
 
-        reserved_this_round = False
-        for day in available_candidates:
-            ymd = day.strftime("%Y%m%d")
-            if ymd in tried_ymds:
-                continue
-            tried_ymds.add(ymd)
+        t0 = time.perf_counter()
+        try:
+            with span("book_batch", day=",".join(d.strftime("%Y-%m-%d") for d in batch)):
+                result = apply_batch(page, batch)
+        except Exception:
+            # 押さえを失敗として返す（CLAIM_TTL まで他のアカウントを待たせない）
+            for d in batch:
+                settle_day(d, False)
+            raise
+        retry = batch
+        if result == APPLY_UNCLEAR:
+            # 申込は送信済み。開き直したカレンダーでマークが変わった日は取れたかもしれないので押さえたまま
+            restore_calendar(page, target_month)
+            after = read_all_availability(page, target.room)
+            retry = [d for d in batch
+                     if after and after.get(ymd := d.strftime("%Y%m%d")) == availability.get(ymd)]
+            for d in batch:
+                if d in retry:
+                    continue
+                unclear.append(d)
+                booked_weeks.add(get_week_number(d))
+                dropped.add(d.strftime("%Y%m%d"))
+                debug(f"[batch] {d.strftime('%Y-%m-%d')} は申込結果が不明 → 第{get_week_number(d)}週は押さえたまま")
+            result = None
+        elif result is not None:
+            for d in batch:
+                settle_day(d, d in result[0])
+        sec = time.perf_counter() - t0
+
+        if result is None:
+            # どの日で失敗したか分からない → 申込が通っていない日だけ1日ずつ従来の流れで
+            debug(f"[batch] 一括申込に失敗 → {len(retry)}日を1日ずつ予約")
+            if retry is batch:
+                restore_calendar(page, target_month)
+            for d in retry:
+                t0 = time.perf_counter()
+                ok = False
+                try:
+                    ok = book_single_day(page, d)
+                finally:
+                    settle_day(d, ok)
+                timings.append((d, time.perf_counter() - t0, ok))
+                dropped.add(d.strftime("%Y%m%d"))
+                if ok:
+                    booked.append(d)
+                    booked_weeks.add(get_week_number(d))
+                    restore_calendar(page, target_month)
+            continue
 
-            if book_single_day(page, day):
-                wn = get_week_number(day)
-                booked.append(day)
-                booked_weeks.add(wn)
-                debug(f"[main] 予約成功 {len(booked)}/{MAX_DAYS}: "
-                      f"{day.strftime('%Y-%m-%d')}({WEEKDAY_JA[day.weekday()]}) 第{wn}週")
-                reserved_this_round = True
-
-                # カレンダーに復帰して次の予約へ
-                if len(booked) < MAX_DAYS:
-                    if not return_to_calendar_after_booking(page):
-                        # 復帰失敗: フルリセット
-                        debug("[main] カレンダー復帰失敗 → フルリセット")
-                        login(page)
-                        select_facility(page)
-                    set_display_period_one_month(page, target_month_start)
-                    navigate_to_month(page, target_month)
-                break  # 候補リストを再生成（booked_weeksが更新されたので）
-
-        if not reserved_this_round:
-            debug("[main] この周回で予約できる日がありませんでした")
+        won, lost = result
+        for d in batch:
+            timings.append((d, sec, d in won))
+        for d in won:
+            booked.append(d)
+            booked_weeks.add(get_week_number(d))
+            debug(f"[batch] 予約成功 {len(booked)}/{max_days}: "
+                  f"{d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 第{get_week_number(d)}週")
+        dropped.update(d.strftime("%Y%m%d") for d in won + lost)
+        if DRY_RUN or not (won or lost):
             break
+        if len(booked) < max_days:
+            restore_calendar(page, target_month)
+
+    report_day_timings("batch", timings, time.perf_counter() - t_start)
+    report_restore_timings()
+    report_nav_timings()
+    debug(f"[batch] 完了: {len(booked)}日予約成功")
+    for d in booked:
+        debug(f"  - {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 第{get_week_number(d)}週")
+    for d in unclear:
+        debug(f"  ? {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 申込結果不明（サイトで確認してください）")
+    return booked
+
+
+# ====== 並列予約: 複数タブで同時に進める ======
+# sync API は1スレッドからしか操作できないため、各タブのフローをジェネレーターにして
+# ポストバックを発火した直後に yield する。スケジューラーが全タブを順番に進めることで、
+# サーバー応答待ちがタブ間で重なり、壁時計時間は「合計」ではなく「最大」に近づく。
+def _fire_postback(page, target: str, argument: str = ""):
+    """__doPostBack を発火するだけで、ロード完了は待たない"""
+    page.evaluate("([t, a]) => __doPostBack(t, a)", [target, argument])
+
+
+def _book_day_steps(page, target: datetime, on_grid: bool = False):
+    """
+    book_single_day のステップ版（カレンダー画面上にいる前提）。
+    各ポストバック発火直後に yield し（wait_transition_steps）、結果は StopIteration.value（yield from の戻り値）で返す。
+    on_grid=True なら target の時間帯別画面に居る前提（先読み済み）で、時間帯の選択から始める。
+    """
+    ymd = target.strftime("%Y-%m-%d")
+    weekday_name = WEEKDAY_JA[target.weekday()]
+    debug(f"[parallel] === {ymd}({weekday_name}) を試行{'（先読み済み）' if on_grid else ''} ===")
+
+    if not on_grid:
+        if not click_date_on_calendar(page, target):
+            debug(f"[parallel] {ymd} はカレンダー上で空きなし → スキップ")
+            return False
+
+        # カレンダー → 時間帯別画面
+        kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "next"), "next", expect="timeslot")
+        if kind != "timeslot":
+            save_diag(page, f"timeslot_fail_{ymd}", level=1)
+            debug(f"[parallel] {ymd} 時間帯画面への遷移失敗（{kind}）")
+            go_back_to_calendar(page)
+            return False
+
+    if not pick_time_slots(page):
+        debug(f"[parallel] {ymd} 18:30-21:30 が空いていない → 戻る")
+        go_back_to_calendar(page)
+        return False
+
+    # 時間帯別画面 → 申請フォーム
+    kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "next"), "next", expect="form")
+    if kind != "form":
+        debug(f"[parallel] {ymd} 時間枠後の遷移に失敗（{kind}）")
+        save_diag(page, f"form_fail_{ymd}", level=1)
+        go_back_to_calendar(page)
+        return False
+    fill_application_form(page)
+
+    # 確定 → 申込確認画面（入力エラーでフォームに戻された・セッション切れ等は待たずに失敗）
+    kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "next"), "confirm")
+    if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+        debug(f"[parallel] {ymd} 申込確認画面に進めません（{kind}）")
+        save_diag(page, f"confirm_fail_{ymd}", level=1)
+        return False
+    debug(f"[parallel] {ymd}({weekday_name}) 確定 → 申込確認画面")
+    save_diag(page, f"step7_confirm_{ymd}")
+
+    if DRY_RUN:
+        debug(f"[parallel] {ymd}({weekday_name}) DRY_RUN: 確認画面で停止（申込しません）")
+        return False
+
+    # 申込
+    kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "next"), "apply")
+    if kind in NAV_FAILURES or kind in PAGE_SELECTORS:
+        debug(f"[parallel] {ymd} 申込が完了しません（{kind}）")
+        save_diag(page, f"submit_fail_{ymd}", level=1)
+        return False
+    debug(f"[parallel] {ymd}({weekday_name}) 申込完了")
+    save_diag(page, f"booked_{ymd}")
+    return True
+
+
+def run_lockstep(flows: dict) -> dict:
+    """ジェネレーターを順番に1ステップずつ進め、全て終わるまで回す。
+    戻り値: {キー: ジェネレーターの戻り値（例外時は None）}
+    """
+    pending = dict(flows)
+    results = {}
+    while pending:
+        for key, gen in list(pending.items()):
+            try:
+                next(gen)
+            except StopIteration as stop:
+                results[key] = stop.value
+                del pending[key]
+            except Exception as exc:
+                debug(f"[parallel] {key} で例外: {exc}")
+                results[key] = None
+                del pending[key]
+    return results
+
+
+def open_calendar_tab(ctx, target_month: datetime, target: Target | None = None):
+    """
+    別セッションのタブ（new_session_page）を開き、ログインして target（省略時は current_target）の
+    対象月カレンダーまで進める。同じセッションのタブでは、一方のポストバックでもう一方の画面の状態
+    （選んだ日・時間帯）がサーバー側で書き換わるため、同時に進めるタブは必ずこれで開く。
+    """
+    page = new_session_page(ctx)
+    bind_target(page, target or current_target())
+    try:
+        setup_calendar(page, target_month)
+    except Exception:
+        close_page(page)
+        raise
+    return page
+
+
+def _refresh_calendar_steps(page, target_month: datetime):
+    """refresh_calendar のステップ版。「表示」ポストバックの発火直後に yield する。"""
+    _set_display_period_fields(page, datetime(target_month.year, target_month.month, 1))
+    btn = find_first(page, "display", ["#btnHyoji", "button:has-text('表示')", "input[type='submit'][value*='表示']"])
+    if btn is None:
+        raise RuntimeError("表示ボタンが見つかりません")
+    kind = yield from wait_transition_steps(page, btn.click, "display", expect="calendar")
+    if kind != "calendar":
+        save_diag(page, "display_fail", level=1)
+        raise RuntimeError(f"1ヶ月表示に失敗しました（{kind}）")
+    navigate_to_month(page, target_month)
+
+
+def _restore_calendar_steps(page, target_month: datetime):
+    """
+    restore_calendar のステップ版。カレンダー URL を開く・「表示」のポストバックの応答を待つ間 yield する。
+    RESTORE_MODE=quick で対象月のカレンダーに着けなければ、トップから _setup_calendar_steps でやり直す。
+    """
+    if RESTORE_MODE == "quick" and CALENDAR_URL:
+        t0 = time.perf_counter()
+        try:
+            kind = yield from wait_transition_steps(
+                page, lambda: page.evaluate("url => { location.href = url; }", CALENDAR_URL), "restore",
+                expect="calendar")
+            room = page_target(page).room
+            ok = kind == "calendar" and page.locator("td.shisetsu, th.shisetsu").filter(has_text=room).count() > 0
+            if ok and not _is_target_month_view(page, target_month):
+                yield from _refresh_calendar_steps(page, target_month)
+        except Exception as e:
+            debug(f"[restore] quick 復帰で例外: {e}")
+            ok = False
+        if ok:
+            _record_restore("quick", time.perf_counter() - t0)
+            return
+        debug("[restore] quick 復帰失敗 → トップから復帰")
+
+    t0 = time.perf_counter()
+    yield from _setup_calendar_steps(page, target_month)
+    remember_calendar_url(page)
+    _record_restore("full", time.perf_counter() - t0)
 
+
+def _goto_steps(page, url: str):
+    """url を開く（ステップ版）。遷移の開始直後に yield し、DOMContentLoaded まで待つ"""
+    with page.expect_navigation(wait_until="domcontentloaded", timeout=NAV_TIMEOUT):
+        page.evaluate("url => { location.href = url; }", url)
+        yield
+
+
+def _setup_calendar_steps(page, target_month: datetime):
+    """
+    setup_calendar のステップ版。トップ → ログイン → 施設・部屋選択（ページの予約対象）→ 1ヶ月表示 → 対象月
+    まで進め、各ポストバックの発火直後に yield する（run_lockstep で複数のタブを同時に準備する）。
+    想定外の画面に着いたら RuntimeError（呼び出し側で setup_calendar からやり直す）。戻り値: True
+    """
+    t = page_target(page)
+    yield from _goto_steps(page, BASE_URL)
+    if not is_logged_in(page):
+        kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "login"), "login_page",
+                                                expect="login")
+        if kind != "login":
+            raise RuntimeError(f"ログインページが表示されません（{kind}）")
+        page.locator("#userID").fill(LOGIN_ID)
+        page.locator("#passWord").fill(LOGIN_PASSWORD)
+        kind = yield from wait_transition_steps(page, page.locator("a.btnBlue:has-text('ログイン')").click,
+                                                "login_submit")
+        if kind in NAV_FAILURES or kind == "login":
+            raise RuntimeError(f"ログインに失敗しました（{kind}）")
+        page.wait_for_selector("a:has-text('ログアウト')", state="attached", timeout=NAV_TIMEOUT)
+        if not page.locator(f"#category_{t.category}").count():
+            yield from _goto_steps(page, BASE_URL)
+
+    cat_btn = page.locator(f"#category_{t.category}")
+    if not cat_btn.count():
+        raise RuntimeError(f"カテゴリ『{t.facility}』(#category_{t.category}) が見つかりません")
+    kind = yield from wait_transition_steps(page, cat_btn.click, "category", expect="facility")
+    # 施設一覧 →（施設を選んだ場合は）部屋選択 → カレンダー
+    for _ in range(2):
+        if kind != "facility":
+            break
+        tbl = page.locator("#shisetsutbl")
+        label = tbl.locator("td.shisetsu.toggle label").filter(has_text=t.room)
+        if not label.count():
+            label = tbl.locator("td.shisetsu label").filter(has_text=t.facility)
+        if label.count():
+            label.first.click()
+        btn = find_first(page, "next", NEXT_BUTTON_SELECTORS)
+        if btn is None:
+            raise RuntimeError("「次へ進む」ボタンが見つかりません")
+        kind = yield from wait_transition_steps(page, btn.click, "next")
+    if kind != "calendar":
+        raise RuntimeError(f"{t.name}: カレンダーに進めません（{kind}）")
+    yield from _refresh_calendar_steps(page, target_month)
+    return True
+
+
+def _tab_worker(page, target_month: datetime, week_queue: list, state: dict, stale: bool = False):
+    """1タブ分のワーカー。週キューから1週ずつ取り出し、その週の候補日を優先順に試す。
+    stale=True（事前待機で開いたタブ）の場合は、最初にカレンダーを再表示してから始める。"""
+    if stale and week_queue:
+        yield from _refresh_calendar_steps(page, target_month)
+    on_calendar = True
+    while week_queue:
+        # 予約済み + 試行中 が max_days に達したら新しい週には手を出さない
+        if len(state["booked"]) + state["in_flight"] >= state["max_days"]:
+            return
+        wn, days = week_queue.pop(0)
+        for day in days:
+            if len(state["booked"]) + state["in_flight"] >= state["max_days"]:
+                return
+            if not on_calendar:
+                yield from _restore_calendar_steps(page, target_month)
+                on_calendar = True
+            state["in_flight"] += 1
+            t0 = time.perf_counter()
+            try:
+                ok = yield from _book_day_steps(page, day)
+            finally:
+                state["in_flight"] -= 1
+            state["timings"].append((day, time.perf_counter() - t0, ok))
+            if ok:
+                state["booked"].append(day)
+                debug(f"[parallel] 予約成功 {len(state['booked'])}/{state['max_days']}: "
+                      f"{day.strftime('%Y-%m-%d')}({WEEKDAY_JA[day.weekday()]}) 第{wn}週")
+                on_calendar = False
+                break  # この週は確保済み（1週1日ルール）
+            # 確認画面まで進んで失敗した場合はカレンダーに居ないので戻す。時間帯別画面にも calendar の表が
+            # あるので、表ではなく最後に着いた画面の種類で見る（記録なし = カレンダーから動いていない）
+            if _PAGE_KIND.get(page, "calendar") != "calendar":
+                on_calendar = False
+
+
+def book_days_parallel(ctx, page, target_month: datetime, tabs: int,
+                       extra_pages: list | None = None, max_days: int | None = None) -> list[datetime]:
+    """
+    book_days の並列版。事前スキャンで空きのある候補日を週ごとにまとめ、
+    最大 tabs 個のタブに1週ずつ割り当てて同時に予約する。
+    部屋・曜日・週の優先順と max_days（省略時）は page の予約対象（page_target）から取る。
+    1週1日ルールは「1週 = 1ワーカーが担当」で、max_days は予約済み+試行中の数で守る。
+    extra_pages（事前待機で開いておいた追加タブ）を渡した場合、page は対象月の
+    カレンダー上にいる前提でセットアップを省略する。
+    """
+    target = page_target(page)
+    max_days = target.max_days if max_days is None else max_days
+    year, month = target_month.year, target_month.month
+    debug(f"[main] 対象月: {year}年{month}月 / 最大{max_days}日 / 並列{tabs}タブ")
+
+    if extra_pages is None:
+        setup_calendar(page, target_month)
+
+    candidates = build_candidate_days(year, month, set(), target.weekdays, target.weeks)
+    availability = read_all_availability(page, target.room)
+    available = scan_available_days(availability, candidates)
+    if not available:
+        debug("[main] 空きのある候補日がありません")
+        return []
+
+    # 週ごとに候補日をまとめる（候補順 = 優先順を保つ）
+    by_week: dict[int, list[datetime]] = {}
+    for d in available:
+        by_week.setdefault(get_week_number(d), []).append(d)
+    week_queue = list(by_week.items())
+
+    n_tabs = max(1, min(tabs, len(week_queue), max_days))
+    pages = [page]
+    if extra_pages is not None:
+        pages += extra_pages[:n_tabs - 1]
+        for p in extra_pages[n_tabs - 1:]:
+            close_page(p)
+    else:
+        for _ in range(n_tabs - 1):
+            try:
+                pages.append(open_calendar_tab(ctx, target_month, target))
+            except Exception as e:
+                debug(f"[parallel] タブ準備失敗: {e}")
+                break
+    debug(f"[parallel] {len(pages)}タブで開始 / 対象週: {[wn for wn, _ in week_queue]}")
+
+    state = {"booked": [], "in_flight": 0, "timings": [], "max_days": max_days}
+    t_start = time.perf_counter()
+    run_lockstep({
+        f"tab{i}": _tab_worker(p, target_month, week_queue, state,
+                               stale=(i > 0 and extra_pages is not None))
+        for i, p in enumerate(pages)
+    })
+    report_day_timings(f"parallel x{len(pages)}", state["timings"], time.perf_counter() - t_start)
+    report_restore_timings()
+    report_nav_timings()
+
+    for p in pages[1:]:
+        close_page(p)
+
+    booked = sorted(state["booked"])
     debug(f"[main] 完了: {len(booked)}日予約成功")
     for d in booked:
         debug(f"  - {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 第{get_week_number(d)}週")
     return booked
 
 
+# ====== 投機的な先読み: 次の候補日の時間帯画面を別タブで ======
+def _prefetch_grid_steps(page, d: datetime, target_month: datetime):
+    """
+    先読み: 別セッションのタブ（open_calendar_tab）でカレンダー URL を開き直し、d をクリックして時間帯別画面まで進める。
+    セッションが別なので、予約中のタブの画面の状態（選んだ日・時間帯）はサーバー側で書き換わらない。
+    どちらの遷移も wait_transition_steps で応答を待つ間 yield し（run_lockstep で予約と交互に進める）、
+    NAV_TIMEOUT までに届かなければ待ち続けずに先読みをやめる。戻り値: (時間帯別画面に着いたか, 開き直したカレンダーの空きマーク)
+    """
+    day = d.strftime('%Y-%m-%d')
+    kind = yield from wait_transition_steps(
+        page, lambda: page.evaluate("url => { location.href = url; }", CALENDAR_URL), "prefetch_calendar",
+        expect="calendar", timeout=NAV_TIMEOUT)
+    if kind != "calendar":
+        debug(f"[speculate] 先読みタブのカレンダーが開けません（{kind}）")
+        return False, {}
+    if get_calendar_header_year_month(page) != (target_month.year, target_month.month):
+        debug("[speculate] 先読みタブのカレンダーが対象月ではありません")
+        return False, {}
+    yield
+    availability = read_all_availability(page, page_target(page).room)
+    if not click_date_on_calendar(page, d):
+        return False, availability
+
+    kind = yield from wait_transition_steps(page, lambda: _fire_postback(page, "next"), "prefetch_next",
+                                            expect="timeslot", timeout=NAV_TIMEOUT)
+    if kind != "timeslot":
+        debug(f"[speculate] {day} の時間帯別画面を先読みできません（{kind}）")
+        return False, availability
+    debug(f"[speculate] {day} の時間帯別画面を先読み済み")
+    return True, availability
+
+
+def report_speculation():
+    """先読みの当たり・破棄・失敗の回数と、先読みで始めた日の短縮時間（通常の日の平均との差）"""
+    if not SPECULATION_TIMINGS:
+        return
+    debug("[speculate] " + " ".join(f"{k}={v}" for k, v in SPECULATION.items()))
+    cold = [sec for kind, _, sec in SPECULATION_TIMINGS if kind == "cold"]
+    base = statistics.mean(cold) if cold else None
+    for kind, d, sec in SPECULATION_TIMINGS:
+        saved = f" 短縮 {base - sec:+.2f}s" if kind == "hit" and base is not None else ""
+        debug(f"[speculate]   {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) {kind} {sec:.2f}s{saved}")
+    hit = [sec for kind, _, sec in SPECULATION_TIMINGS if kind == "hit"]
+    if hit and base is not None:
+        debug(f"[speculate] 1日あたり平均 {base - statistics.mean(hit):.2f}s 短縮 "
+              f"(hit n={len(hit)} mean={statistics.mean(hit):.2f}s / cold n={len(cold)} mean={base:.2f}s)")
+
+
+def launch_context(p, headless: bool):
+    """
+    ブラウザのコンテキストを用意する。ATTACH なら常駐ブラウザに CDP で接続して新しい
+    コンテキストを作り、それ以外（または接続失敗時）は udata プロファイルで起動する。
+    保存済みのセッションを戻し、不要リソースのブロックを設定する。
+    """
+    state = load_session_state()
+    ctx = None
+    if ATTACH:
+        t0 = time.perf_counter()
+        try:
+            with span("browser_attach", endpoint=BROWSER_ENDPOINT):
+                browser = p.chromium.connect_over_cdp(BROWSER_ENDPOINT)
+                ctx = browser.new_context(locale="ja-JP", timezone_id="Asia/Tokyo", storage_state=state)
+            debug(f"[browser] 常駐ブラウザに接続 {time.perf_counter() - t0:.2f}s ({BROWSER_ENDPOINT})")
+        except Exception as e:
+            debug(f"[browser] 常駐ブラウザに接続できません ({e}) → 起動します")
+    if ctx is None:
+        t0 = time.perf_counter()
+        with span("browser_cold_start"):
+            ctx = p.chromium.launch_persistent_context(
+                user_data_dir=str(USER_DATA_DIR),
+                headless=headless,
+                locale="ja-JP",
+                timezone_id="Asia/Tokyo",
+                args=["--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox"],
+            )
+            if state and state.get("cookies"):
+                # セッション cookie はプロファイルに残らないので保存分を戻す
+                ctx.add_cookies(state["cookies"])
+        debug(f"[browser] 起動 {time.perf_counter() - t0:.2f}s")
+    start_tracing(ctx)
+    _prepare_context(ctx)
+    _SESSION_BROWSER.update(playwright=p, headless=headless)
+    return ctx
+
+
+def _prepare_context(ctx):
+    """並列タブにも効くようコンテキスト単位で、不要リソースの遮断・オーバーレイ対策・スクリプトのキャッシュを設定する"""
+    install_blocking(ctx)
+    install_overlay_guard(ctx)
+    if ASSET_CACHE:
+        import asset_cache
+
+        asset_cache.install(ctx)
+
+
+# ====== 別セッションのタブ ======
+# サイトの検索状態（施設・表示期間・選んだ日）は ASP.NET のセッション（cookie）ごとにサーバーが持つため、
+# 同じコンテキストのタブ同士はポストバックのたびに互いの画面の状態を上書きする。
+# 同時に進めるタブ（並列予約・先読み・複数の予約対象）は cookie を共有しない別コンテキストに開く。
+# udata プロファイルで起動したコンテキストはブラウザを持たない（ctx.browser が None）ので、
+# その場合は別コンテキスト用のブラウザを初回だけ起動する。
+_SESSION_BROWSER: dict = {}
+_SESSION_CONTEXTS: weakref.WeakSet = weakref.WeakSet()
+
+
+def new_session_page(ctx):
+    """ctx と同じブラウザ（なければ別に起動したブラウザ）の新しいコンテキストにタブを開く（未ログイン）"""
+    browser = ctx.browser or _SESSION_BROWSER.get("browser")
+    if browser is None:
+        with span("browser_session_launch"):
+            browser = _SESSION_BROWSER["playwright"].chromium.launch(
+                headless=_SESSION_BROWSER.get("headless", True),
+                args=["--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox"],
+            )
+        _SESSION_BROWSER["browser"] = browser
+    sub = browser.new_context(locale="ja-JP", timezone_id="Asia/Tokyo")
+    _SESSION_CONTEXTS.add(sub)
+    _prepare_context(sub)
+    page = sub.new_page()
+    page.set_default_navigation_timeout(30000)
+    return page
+
+
+def close_page(page):
+    """タブを閉じる。new_session_page で開いたタブならそのコンテキスト（セッション）ごと閉じる"""
+    try:
+        sub = page.context
+        page.close()
+        if sub in _SESSION_CONTEXTS:
+            sub.close()
+    except Exception:
+        pass
+
+
+# ====== 事前待機（プリウォーム） ======
+def parse_deadline(spec: str, now: datetime | None = None) -> datetime:
+    """HH:MM:SS（今日）または YYYY-MM-DD HH:MM:SS（日本時間）を日時に変換する"""
+    now = now or datetime.now(JST)
+    try:
+        return datetime.strptime(spec.replace("T", " "), "%Y-%m-%d %H:%M:%S").replace(tzinfo=JST)
+    except ValueError:
+        t = datetime.strptime(spec, "%H:%M:%S").time()
+        return datetime.combine(now.date(), t, tzinfo=JST)
+
+
+def revalidate_assets(ctx):
+    """締切前に、期限切れのキャッシュ済みスクリプトを条件付きリクエストで確認しておく"""
+    if not ASSET_CACHE:
+        return
+    import asset_cache
+
+    try:
+        asset_cache.revalidate(ctx)
+    except Exception as e:
+        debug(f"[asset] 確認に失敗: {e}")
+
+
+def refresh_calendar(page, target_month: datetime):
+    """今のカレンダーを1回のポストバック（表示ボタン）で最新化する"""
+    set_display_period_one_month(page, datetime(target_month.year, target_month.month, 1))
+    navigate_to_month(page, target_month)
+
+
+def wait_until(deadline: datetime, keepalive=None):
+    """deadline まで待つ。KEEPALIVE_INTERVAL ごとに keepalive() を呼んでセッションを維持する。"""
+    last_keepalive = time.monotonic()
+    while True:
+        remaining = (deadline - datetime.now(JST)).total_seconds()
+        if remaining <= 0:
+            return
+        if keepalive and time.monotonic() - last_keepalive >= KEEPALIVE_INTERVAL and remaining > 30:
+            try:
+                keepalive()
+                debug(f"[prewarm] セッション維持（締切まで {remaining:.0f}s）")
+            except Exception as e:
+                debug(f"[prewarm] セッション維持失敗: {e}")
+            last_keepalive = time.monotonic()
+            continue
+        # 締切直前は細かく刻んで寝過ごしを防ぐ
+        time.sleep(min(remaining, 1.0) if remaining < 5 else min(remaining - 2, 5.0))
+
+
+def prewarm(ctx, page, target_month: datetime, deadline: datetime, tabs: int = 0,
+            clock_sync: bool = True) -> list:
+    """
+    締切前にセットアップ（ログイン〜対象月カレンダー）を済ませて待機し、
+    締切ちょうどにカレンダーを1回だけ再表示する。
+    clock_sync=True の場合は締切の CLOCK_SYNC_LEAD 秒前にサーバー時計との差を計測し、
+    サーバー時刻で締切になった瞬間に再表示を発火する。
+    並列モードの追加タブもここで開いておく（戻り値。再表示は各ワーカーが行う）。
+    """
+    debug(f"[prewarm] 締切 {deadline.strftime('%Y-%m-%d %H:%M:%S')} JST に向けてセットアップ開始")
+    t0 = time.perf_counter()
+    setup_calendar(page, target_month)
+    extra_pages = []
+    for _ in range(max(0, min(tabs, MAX_DAYS) - 1)):
+        try:
+            extra_pages.append(open_calendar_tab(ctx, target_month, page_target(page)))
+        except Exception as e:
+            debug(f"[prewarm] タブ準備失敗: {e}")
+            break
+    setup_sec = time.perf_counter() - t0
+    remaining = (deadline - datetime.now(JST)).total_seconds()
+    debug(f"[prewarm] セットアップ完了 {setup_sec:.2f}s / 締切まで {remaining:.1f}s")
+    history_scores(target_month.year, target_month.month)
+    if remaining < 0:
+        # 起動が遅れた: 今セットアップしたカレンダーは最新なので、時計合わせも再表示もせずに予約へ
+        debug("[prewarm] 締切を過ぎています → すぐに開始")
+        RUN_MARKS["deadline"] = deadline.timestamp()
+        return extra_pages
+    revalidate_assets(ctx)
+
+    def keepalive():
+        for p in [page] + extra_pages:
+            if is_session_timeout(p):
+                recover_session(p)
+            refresh_calendar(p, target_month)
+
+    wait_for_release(deadline, keepalive, clock_sync)
+    debug("[prewarm] 締切到達 → カレンダー再表示")
+    refresh_calendar(page, target_month)
+    return extra_pages
+
+
+def wait_for_release(deadline: datetime, keepalive, clock_sync: bool = True):
+    """
+    keepalive を回しながら締切まで待つ。clock_sync=True なら CLOCK_SYNC_LEAD 秒前に
+    サーバー時計との差を測り、サーバー時刻で締切になった瞬間に戻る。
+    RUN_MARKS["deadline"] に締切のローカル時刻を記録する。
+    """
+    sync = None
+    if clock_sync:
+        wait_until(deadline - timedelta(seconds=CLOCK_SYNC_LEAD), keepalive)
+        try:
+            sync = estimate_server_offset(BASE_URL)
+            debug(f"[clock] offset={sync['offset'] * 1000:+.0f}ms "
+                  f"±{sync['uncertainty'] * 1000:.0f}ms "
+                  f"rtt={sync['rtt_median'] * 1000:.0f}ms jitter={sync['rtt_jitter'] * 1000:.1f}ms")
+        except Exception as e:
+            debug(f"[clock] サーバー時計の計測失敗: {e} → ローカル時計で待機")
+
+    if sync:
+        sync["fire_error"] = wait_for_server_time(deadline.timestamp(), sync["offset"])
+        debug(f"[clock] 発火誤差 {sync['fire_error'] * 1000:+.1f}ms（サーバー時刻基準）")
+        write_clock_sync_diag(sync)
+        # 以降の「締切→初回クリック」もサーバー時刻基準のローカル時刻で測る
+        RUN_MARKS["deadline"] = deadline.timestamp() - sync["offset"]
+    else:
+        wait_until(deadline, keepalive)
+        RUN_MARKS["deadline"] = deadline.timestamp()
+
+
+# ====== 複数の予約対象: 施設・部屋ごとのタブで同時にスキャン ======
+def setup_target_pages(ctx, page, target_month: datetime, targets: list[Target]) -> list:
+    """
+    対象ごとにタブを用意し、それぞれの対象月カレンダーまで同時に進める（run_lockstep）。
+    1つ目は page を使い、2つ目以降は別セッションのタブ（new_session_page）に開く。
+    各タブには bind_target で対象を結び付ける（施設選択・部屋行・時間帯はタブの対象で決まる）。
+    同時の準備に失敗したタブは setup_calendar で1つずつやり直す。
+    """
+    pages = [page]
+    for _ in targets[1:]:
+        pages.append(new_session_page(ctx))
+    for t, p in zip(targets, pages):
+        bind_target(p, t)
+    page.set_default_navigation_timeout(30000)
+    with span("setup_targets", day=",".join(t.name for t in targets)):
+        results = run_lockstep({i: _setup_calendar_steps(p, target_month) for i, p in enumerate(pages)})
+    for i, (t, p) in enumerate(zip(targets, pages)):
+        if not results.get(i):
+            debug(f"[targets] {t.name}: 同時の準備に失敗 → やり直し")
+            setup_calendar(p, target_month)
+        debug(f"[targets] {t.name}: カレンダー準備完了")
+    return pages
+
+
+def scan_targets(pages: list, targets: list[Target], target_month: datetime,
+                 refresh: bool = True) -> dict[str, list[tuple[str, str]]]:
+    """
+    全対象のカレンダーを同時に再表示（run_lockstep で「表示」を一斉に発火）してから読み取り、
+    1つの表にまとめる。戻り値: {YYYYMMDD: [(対象名, マーク)]}（対象の優先順）
+    """
+    if refresh:
+        run_lockstep({i: _refresh_calendar_steps(p, target_month) for i, p in enumerate(pages)})
+    merged: dict[str, list[tuple[str, str]]] = {}
+    for t, p in zip(targets, pages):
+        for ymd, mark in read_all_availability(p, t.room).items():
+            merged.setdefault(ymd, []).append((t.name, mark))
+    for ymd in sorted(merged):
+        d = datetime.strptime(ymd, "%Y%m%d")
+        if d.weekday() < 5 and any(m in OK_MARKS for _, m in merged[ymd]):
+            marks = " ".join(f"{name}={mark}" for name, mark in merged[ymd])
+            debug(f"[targets] {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) {marks}")
+    return merged
+
+
+def book_targets(ctx, page, target_month: datetime, targets: list[Target], max_days: int,
+                 deadline: datetime | None = None, clock_sync: bool = True) -> list[datetime]:
+    """
+    複数の予約対象を優先順に予約する。全対象のカレンダーを開いて同時にスキャンし、
+    1つ目の対象で取れなかった週を2つ目以降の対象で埋める（全体で max_days 日・1週1日）。
+    deadline を渡すと、準備を済ませて締切まで待ってから始める。
+    """
+    pages = setup_target_pages(ctx, page, target_month, targets)
+    if deadline is not None:
+        def keepalive():
+            for p in pages:
+                if is_session_timeout(p):
+                    recover_session(p)
+                refresh_calendar(p, target_month)
+
+        for t in targets:
+            history_scores(target_month.year, target_month.month, t)
+        revalidate_assets(ctx)
+        wait_for_release(deadline, keepalive, clock_sync)
+    scan_targets(pages, targets, target_month, refresh=deadline is not None)
+
+    booked: list[datetime] = []
+    booked_weeks: set[int] = set()
+    try:
+        for t, p in zip(targets, pages):
+            left = min(t.max_days, max_days - len(booked))
+            if left <= 0:
+                break
+            remember_calendar_url(p)
+            debug(f"[targets] === {t.name} で予約（残り{left}日）===")
+            for d in book_days(p, target_month, prepared=True, booked_weeks=booked_weeks, max_days=left):
+                booked.append(d)
+    finally:
+        for p in pages[1:]:
+            close_page(p)
+    booked.sort()
+    return booked
+
+
+# ====== サーバー時計同期 ======
+def _probe_server_date(conn, path: str) -> tuple[float, float, float]:
+    """HEAD を1回送り (送信時刻, 受信時刻, Dateヘッダー[epoch秒]) を返す"""
+    t0 = time.time()
+    conn.request("HEAD", path, headers={"Cache-Control": "no-cache"})
+    resp = conn.getresponse()
+    t1 = time.time()
+    resp.read()
+    date = resp.getheader("Date")
+    if not date:
+        raise RuntimeError("Date ヘッダーがありません")
+    return t0, t1, parsedate_to_datetime(date).timestamp()
+
+
+def estimate_server_offset(url: str = BASE_URL, samples: int = CLOCK_SYNC_SAMPLES) -> dict:
+    """
+    サーバー時計とローカル時計の差（offset = サーバー − ローカル, 秒）を推定する。
+    Date ヘッダーは1秒単位なので、各サンプルから
+        D − t1 <= offset < D + 1 − t0
+    の区間が得られる。区間の共通部分をとり、次のサンプルは現在の推定で
+    「サーバー時刻が秒の境目をまたぐ瞬間」に着くよう送ることで区間を狭めていく。
+    """
+    parts = urlsplit(url)
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parts.netloc, timeout=5)
+    path = parts.path or "/"
+    lo, hi = float("-inf"), float("inf")
+    rtts, records = [], []
+    try:
+        # 1回目は接続確立（TLSハンドシェイク）を含むので捨てる
+        _probe_server_date(conn, path)
+        for _ in range(samples):
+            if rtts and lo > float("-inf") and hi < float("inf"):
+                # 推定 offset で次の秒の境目に到着するように送信時刻を合わせる
+                mid = (lo + hi) / 2
+                half_rtt = statistics.median(rtts) / 2
+                arrive = int(time.time() + mid) + 1 - mid
+                delay = arrive - half_rtt - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            t0, t1, d = _probe_server_date(conn, path)
+            rtts.append(t1 - t0)
+            records.append({"t0": t0, "t1": t1, "date": d})
+            new_lo, new_hi = max(lo, d - t1), min(hi, d + 1 - t0)
+            if new_lo <= new_hi:
+                lo, hi = new_lo, new_hi
+    finally:
+        conn.close()
+
+    if lo > float("-inf") and hi < float("inf"):
+        offset = (lo + hi) / 2
+        uncertainty = (hi - lo) / 2
+    else:
+        # 区間が作れない場合は中点推定の中央値で代用
+        offset = statistics.median(r["date"] + 0.5 - (r["t0"] + r["t1"]) / 2 for r in records)
+        uncertainty = 0.5
+    return {
+        "offset": offset,
+        "uncertainty": uncertainty,
+        "rtt_median": statistics.median(rtts),
+        "rtt_jitter": statistics.pstdev(rtts),
+        "samples": records,
+    }
+
+
+def wait_for_server_time(target_epoch: float, offset: float) -> float:
+    """サーバー時刻 target_epoch になるまで待ち、発火時のサーバー時刻との誤差（秒）を返す。
+    直前 50ms まではスリープ、残りはビジーウェイトで詰める。"""
+    local_target = target_epoch - offset
+    while True:
+        remaining = local_target - time.time()
+        if remaining <= 0.05:
+            break
+        time.sleep(min(remaining - 0.05, 1.0))
+    while time.time() < local_target:
+        pass
+    return time.time() + offset - target_epoch
+
+
+def write_clock_sync_diag(result: dict):
+    """時計同期の計測結果を diag/ に JSON で保存"""
+    if DIAG_LEVEL < 1:
+        return
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = LOG_DIR / f"clock_sync_{ts}.json"
+        path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        debug(f"[diag] saved {path.name}")
+    except Exception as exc:
+        debug(f"[diag] failed: {exc}")
+
+
+def report_prewarm():
+    deadline = RUN_MARKS.get("deadline")
+    first_click = RUN_MARKS.get("first_click")
+    if deadline is None:
+        return
+    if first_click is None:
+        debug("[prewarm] 締切→初回クリック: クリックなし")
+    else:
+        debug(f"[prewarm] 締切→初回クリック: {first_click - deadline:.3f}s")
+
+
+def print_booked(booked: list[datetime]):
+    if booked:
+        print(f"予約完了: {len(booked)}日")
+        for d in booked:
+            print(f"  {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]})")
+    else:
+        print("予約できませんでした（空きなし or エラー）。")
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="ふるさと千川館 自動予約")
     parser.add_argument("--test", action="store_true",
@@ -942,34 +3158,112 @@ def parse_args():
                         help="GUIモードで実行")
     parser.add_argument("--diag-level", type=int, choices=[0, 1, 2], default=None,
                         help="診断レベル (0=なし, 1=エラー時のみ, 2=全ステップ)")
+    parser.add_argument("--diag-ring", type=int, default=None, metavar="N",
+                        help="エラー時に直前 N ステップの HTML も書き出す（各ステップで page.content を取る。"
+                             f"0=取らない, デフォルト: {DIAG_RING_SIZE}）")
+    parser.add_argument("--parallel", type=int, default=None, metavar="N",
+                        help="N タブで候補日を同時に予約（0=逐次, デフォルト: 逐次）")
+    parser.add_argument("--engine", choices=["sync", "async", "http"], default="sync",
+                        help="予約エンジン (sync=従来, async=playwright.async_api, "
+                             "http=カレンダー以降を HTTP で直接ポストし失敗時は sync に戻る)")
+    parser.add_argument("--targets", metavar="TOML", default=None,
+                        help="予約対象（施設・部屋・時間帯・優先順位）の設定ファイル。上から順に優先")
+    parser.add_argument("--accounts", action="store_true",
+                        help=".env の ACCOUNTS の全アカウントで同時に予約（共有台帳で日・週の重複を防ぐ）")
+    parser.add_argument("--batch", action="store_true",
+                        help="候補日（週ごとに1日）をまとめて1回で申込む")
+    parser.add_argument("--speculate", action="store_true",
+                        help="予約中に2枚目のタブで次の候補日の時間帯画面まで進めておく（逐次モードのみ）")
+    parser.add_argument("--restore", choices=["quick", "full"], default="quick",
+                        help="予約後のカレンダー復帰 (quick=カレンダー URL を直接開く, full=施設選択から)")
+    parser.add_argument("--blocking", choices=["cdp", "glob", "route"], default="cdp",
+                        help="不要リソースの遮断方式 (cdp=ブラウザ側の URL 遮断, glob=遮断対象だけルート, "
+                             "route=全リクエストを Python で判定)")
+    parser.add_argument("--no-asset-cache", dest="asset_cache", action="store_false",
+                        help="静的スクリプトをディスクキャッシュから返さず、毎回サーバーから取得する")
+    parser.add_argument("--attach", nargs="?", const=True, default=None, metavar="URL",
+                        help="常駐ブラウザ（browser_server.py）に CDP で接続して起動時間を省く "
+                             "(URL 省略時は BROWSER_ENDPOINT。sync エンジンのみ)")
+    parser.add_argument("--watch", action="store_true",
+                        help="常駐して空き状況を見張り、キャンセルで空いた希望日をその場で予約する")
+    parser.add_argument("--watch-hours", type=float, default=None, metavar="H",
+                        help="--watch を H 時間で終了する（デフォルト: 止めるまで）")
+    parser.add_argument("--no-history", dest="history", action="store_false",
+                        help="空き状況の履歴を記録せず、履歴からの競合度も使わない（WEEK_PRIORITY のみ）")
+    parser.add_argument("--prewarm-until", metavar="[YYYY-MM-DD ]HH:MM:SS", default=None,
+                        help="指定時刻（日本時間。日付省略時は今日）の前にカレンダーまで準備して待機し、"
+                             "時刻ちょうどに予約開始。過ぎていればすぐに予約する")
+    parser.add_argument("--no-clock-sync", dest="clock_sync", action="store_false",
+                        help="--prewarm-until でサーバー時計に合わせず、ローカル時計で発火する")
     return parser.parse_args()
 
 
 def main():
-    global ROOM_LABEL, DIAG_LEVEL
+    global DIAG_LEVEL, DIAG_RING_SIZE, PARALLEL_TABS, ENGINE, RESTORE_MODE, BATCH, HISTORY_DB, BLOCKING, ASSET_CACHE
+    global ATTACH, BROWSER_ENDPOINT, SPECULATE
 
-    if not (LOGIN_ID and LOGIN_PASSWORD):
+    args = parse_args()
+
+    if args.accounts and not ACCOUNTS:
+        print("ERROR: --accounts には .env の ACCOUNTS（ID:PASS をカンマ区切り）が必要です。", file=sys.stderr)
+        sys.exit(1)
+    if not args.accounts and not (LOGIN_ID and LOGIN_PASSWORD):
         print("ERROR: .env に LOGIN_ID / LOGIN_PASSWORD を設定してください。", file=sys.stderr)
         sys.exit(1)
 
-    args = parse_args()
-
     global DRY_RUN
 
+    targets, total_days = None, MAX_DAYS
+    if args.targets:
+        targets, total_days = load_targets(Path(args.targets))
+        debug(f"[main] 予約対象 {len(targets)}件: {' → '.join(t.name for t in targets)} / 全体で最大{total_days}日")
+        apply_target(targets[0], total_days)
+
     # テストモード: 7月分、ふるさと千川の部屋、1日だけ
     if args.test:
-        ROOM_LABEL = "ふるさと千川の部屋"
-        MAX_DAYS = 1
+        apply_target(Target(name="test", room="ふるさと千川の部屋", max_days=1))
+        targets = None
         target_month = datetime(2026, 7, 1)
         debug("[main] テストモード: 7月分 / ふるさと千川の部屋 / 1日のみ")
         if args.diag_level is None:
             DIAG_LEVEL = 2  # テスト時はデフォルト全出力
     else:
-        now = datetime.now()
+        # --prewarm-until に日付があればその日から見た翌月（前日に起動して1日の締切を待つ場合）
+        now = parse_deadline(args.prewarm_until) if args.prewarm_until else datetime.now(JST)
         target_month = first_of_next_month(now)
 
     if args.diag_level is not None:
         DIAG_LEVEL = args.diag_level
+    if args.diag_ring is not None:
+        DIAG_RING_SIZE = args.diag_ring
+
+    if args.parallel is not None:
+        PARALLEL_TABS = args.parallel
+
+    ENGINE = args.engine
+    RESTORE_MODE = args.restore
+    BATCH = args.batch
+    BLOCKING = args.blocking
+    ASSET_CACHE = args.asset_cache
+    if args.attach:
+        ATTACH = True
+        if isinstance(args.attach, str):
+            BROWSER_ENDPOINT = args.attach
+    if not args.history:
+        HISTORY_DB = None
+    SPECULATE = args.speculate
+    if SPECULATE and (BATCH or ENGINE != "sync" or PARALLEL_TABS > 0):
+        debug("[main] --speculate は sync エンジンの逐次モードのみ対応のため無視します")
+        SPECULATE = False
+    if BATCH and (ENGINE == "http" or PARALLEL_TABS > 0):
+        debug("[main] --batch は逐次モードのみ対応のため --engine http / --parallel を無視します")
+        ENGINE, PARALLEL_TABS = "sync", 0
+    if ENGINE == "http" and PARALLEL_TABS > 0:
+        debug("[main] --engine http は逐次モードのみ対応のため --parallel を無視します")
+        PARALLEL_TABS = 0
+    if targets and len(targets) > 1 and (ENGINE == "async" or PARALLEL_TABS > 0):
+        debug("[main] 複数の予約対象は sync エンジンの逐次モードのみ対応のため 1つ目の対象だけで実行します")
+        targets = None
 
     if args.dry_run:
         DRY_RUN = True
@@ -980,45 +3274,86 @@ def main():
     if args.test and "--headless" not in sys.argv:
         headless = False
 
+    if args.watch and (args.accounts or ENGINE != "sync" or PARALLEL_TABS > 0 or BATCH or args.prewarm_until
+                       or targets and len(targets) > 1):
+        debug("[main] --watch は1つの予約対象・sync エンジンの逐次モードのみ対応のため "
+              "--accounts / --engine / --parallel / --batch / --prewarm-until / --targets の2件目以降を無視します")
+        args.accounts, args.engine, args.prewarm_until = False, "sync", None
+        ENGINE, PARALLEL_TABS, BATCH, targets = "sync", 0, False, None
+
+    if args.accounts:
+        import accounts
+
+        if targets and len(targets) > 1 or PARALLEL_TABS > 0 or ENGINE == "async":
+            debug("[main] --accounts は1つの予約対象・逐次モードのみ対応のため --targets の2件目以降 / "
+                  "--parallel / --engine async を無視します")
+            PARALLEL_TABS = 0
+            if ENGINE == "async":
+                ENGINE = "sync"
+        deadline = parse_deadline(args.prewarm_until) if args.prewarm_until else None
+        report = accounts.run_accounts(accounts.parse_accounts(ACCOUNTS), target_month, headless,
+                                       deadline, clock_sync=args.clock_sync)
+        print_booked([datetime.strptime(d, "%Y-%m-%d") for d in report["booked"]])
+        if any(r["error"] for r in report["accounts"]):
+            sys.exit(1)
+        return
+
+    if args.engine == "async":
+        import asyncio
+
+        import auto_reserve_async
+
+        debug("[main] engine=async")
+        if args.prewarm_until:
+            debug("[main] --prewarm-until は sync エンジンのみ対応のため無視します")
+        if args.batch:
+            debug("[main] --batch は sync エンジンのみ対応のため無視します")
+        if args.attach:
+            debug("[main] --attach は sync エンジンのみ対応のため無視します")
+        try:
+            booked = asyncio.run(auto_reserve_async.run(target_month, headless))
+        except Exception as exc:
+            print(f"ERROR: {exc}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            flush_history()
+            flush_diag()
+        print_booked(booked)
+        return
+
     with sync_playwright() as p:
-        ctx = p.chromium.launch_persistent_context(
-            user_data_dir=str(USER_DATA_DIR),
-            headless=headless,
-            locale="ja-JP",
-            timezone_id="Asia/Tokyo",
-            args=["--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox"],
-        )
+        ctx = launch_context(p, headless)
         page = ctx.new_page()
         page.set_default_navigation_timeout(30000)
 
-        # 不要リソースをブロック — 最小限のUIで高速遷移
-        BLOCKED_TYPES = {"image", "font", "media", "stylesheet"}
-        BLOCKED_URLS = [
-            "google-analytics", "googletagmanager", "gtag",
-            "facebook", "twitter", "jquery-ui.min.css",
-            "remodal", "favicon",
-        ]
-
-        def handle_route(route):
-            if route.request.resource_type in BLOCKED_TYPES:
-                route.abort()
-                return
-            url = route.request.url.lower()
-            if any(b in url for b in BLOCKED_URLS):
-                route.abort()
-                return
-            route.continue_()
-
-        page.route("**/*", handle_route)
-
         try:
-            booked = book_days(page, target_month)
-            if booked:
-                print(f"予約完了: {len(booked)}日")
-                for d in booked:
-                    print(f"  {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]})")
+            if args.watch:
+                import watch
+
+                until = datetime.now(JST) + timedelta(hours=args.watch_hours) if args.watch_hours else None
+                booked = watch.run_watch(ctx, page, until)
+            elif targets and len(targets) > 1:
+                deadline = parse_deadline(args.prewarm_until) if args.prewarm_until else None
+                booked = book_targets(ctx, page, target_month, targets, total_days,
+                                      deadline, clock_sync=args.clock_sync)
+                if deadline:
+                    report_prewarm()
+            elif args.prewarm_until:
+                deadline = parse_deadline(args.prewarm_until)
+                # 先読み用のタブも締切前に開いておく
+                extra_pages = prewarm(ctx, page, target_month, deadline, PARALLEL_TABS or (2 if SPECULATE else 0),
+                                      clock_sync=args.clock_sync)
+                if PARALLEL_TABS > 0:
+                    booked = book_days_parallel(ctx, page, target_month, PARALLEL_TABS, extra_pages)
+                else:
+                    booked = book_days(page, target_month, prepared=True,
+                                       spare=extra_pages[0] if extra_pages else None)
+                report_prewarm()
+            elif PARALLEL_TABS > 0:
+                booked = book_days_parallel(ctx, page, target_month, PARALLEL_TABS)
             else:
-                print("予約できませんでした（空きなし or エラー）。")
+                booked = book_days(page, target_month)
+            print_booked(booked)
 
             if not args.headless:
                 input("終了するには Enter を押してください: ")
@@ -1029,6 +3364,15 @@ def main():
                 input("エラー発生。Enter で終了: ")
             sys.exit(1)
         finally:
+            write_timeline()
+            flush_history()
+            flush_selector_cache()
+            if ASSET_CACHE:
+                import asset_cache
+
+                asset_cache.flush()
+            stop_tracing(ctx)
+            flush_diag()
             try:
                 ctx.close()
             except Exception:
@@ -1036,4 +3380,7 @@ def main():
 
 
 if __name__ == "__main__":
+    # auto_reserve_async / postback_client が `import auto_reserve` したときに
+    # main() で書き換えた設定値を共有できるよう、このモジュール自身を登録しておく
+    sys.modules.setdefault("auto_reserve", sys.modules[__name__])
     main()
@@ -0,0 +1,893 @@
+# -*- coding: utf-8 -*-
+"""
+auto_reserve.py の非同期エンジン（playwright.async_api 版）
+
+sync 版と同じフローを asyncio で実装し、1つの画面の中で互いに依存しない読み取りを同時に走らせる:
+  - エラー時の診断情報（スクリーンショット / HTML）の取得を並行実行
+  - フォールバックセレクターの count() を一斉に投げて、優先順で最初に当たったものを使う
+  - 並列モードでは追加タブ（別セッション）の準備（ログイン〜対象月表示）を全タブ同時に進める
+ポストバックはセッションの画面状態を進めるので、1つのセッションでは1日ずつ順に予約する
+（予約中のポストバックの裏で次の候補日を別の画面で準備することはしない）。
+
+設定値・予約計画（BookingPlan）・純粋関数は auto_reserve から共有する（main() や --targets が
+書き換えた値を参照するため `ar.ROOM_LABEL` / `ar.CATEGORY_ID` のようにモジュール経由で読む）。
+
+Usage:
+    python auto_reserve.py --engine async
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from playwright.async_api import async_playwright
+
+import auto_reserve as ar
+from auto_reserve import (
+    OK_MARKS,
+    WEEKDAY_JA,
+    build_candidate_days,
+    debug,
+    get_week_number,
+    norm_wave,
+    report_day_timings,
+    room_matches,
+    scan_available_days,
+)
+
+
+# ====== ユーティリティ ======
+async def save_diag(page, label: str, level: int = 2):
+    """
+    診断情報を保存（sync 版 save_diag と同じ規則）。取得だけをここで行い、ファイルへの書き出しは
+    ar の書き出しスレッドに任せる。エラー（level=1）のときは HTML とスクリーンショットを同時に取る。
+    """
+    if ar.DIAG_LEVEL < 1 or (level > ar.DIAG_LEVEL and ar.DIAG_RING_SIZE <= 0):
+        return
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    jobs = [page.content()]
+    if level <= 1:
+        jobs.append(page.screenshot(full_page=True))
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    if isinstance(results[0], Exception):
+        debug(f"[diag] failed: {results[0]}")
+        return
+    if level > ar.DIAG_LEVEL:
+        ar.DIAG_RING.append((label, ts, results[0]))
+        while len(ar.DIAG_RING) > ar.DIAG_RING_SIZE:
+            ar.DIAG_RING.popleft()
+        return
+    name = f"{label}_{ts}"
+    ar.enqueue_diag(ar.LOG_DIR / f"{name}.html", results[0])
+    if level > 1:
+        debug(f"[diag] saved {name}")
+        return
+    if isinstance(results[1], Exception):
+        debug(f"[diag] screenshot failed: {results[1]}")
+    else:
+        ar.enqueue_diag(ar.LOG_DIR / f"{name}.png", results[1])
+    for i, (prev_label, prev_ts, prev_html) in enumerate(ar.DIAG_RING):
+        ar.enqueue_diag(ar.LOG_DIR / f"{name}_before" / f"{i:02d}_{prev_label}_{prev_ts}.html", prev_html)
+    debug(f"[diag] saved {name}（直前 {len(ar.DIAG_RING)}ステップ付き）")
+    ar.DIAG_RING.clear()
+
+
+async def handle_route(route):
+    """BLOCKED_TYPES / BLOCKED_URLS に該当するリクエストを中断する"""
+    ar.ROUTE_CALLS += 1
+    if route.request.resource_type in ar.BLOCKED_TYPES:
+        await route.abort()
+        return
+    url = route.request.url.lower()
+    if any(b in url for b in ar.BLOCKED_URLS):
+        await route.abort()
+        return
+    await route.continue_()
+
+
+async def _abort_route(route):
+    ar.ROUTE_CALLS += 1
+    await route.abort()
+
+
+async def _block_urls_cdp(ctx, page):
+    try:
+        cdp = await ctx.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": ar.blocked_url_patterns()})
+    except Exception as e:
+        debug(f"[block] CDP で遮断できません ({e}) → glob ルートで代替")
+        await page.route(ar.blocked_url_regex(), _abort_route)
+
+
+async def install_blocking(ctx):
+    """ar.BLOCKING の方式で不要リソースの遮断を設定する（auto_reserve.install_blocking と同じ）"""
+    if ar.BLOCKING == "cdp":
+        for page in ctx.pages:
+            await _block_urls_cdp(ctx, page)
+        ctx.on("page", lambda page: _block_urls_cdp(ctx, page))
+    elif ar.BLOCKING == "glob":
+        await ctx.route(ar.blocked_url_regex(), _abort_route)
+    else:
+        await ctx.route("**/*", handle_route)
+
+
+async def first_present(page, selectors: list[str]):
+    """候補セレクターの count() を一斉に投げ、リスト順で最初に存在したロケーターを返す"""
+    locators = [page.locator(sel) for sel in selectors]
+    counts = await asyncio.gather(*(loc.count() for loc in locators), return_exceptions=True)
+    for loc, n in zip(locators, counts):
+        if isinstance(n, int) and n:
+            return loc
+    return None
+
+
+async def is_logged_in(page) -> bool:
+    try:
+        return await page.locator("a:has-text('ログアウト')").count() > 0
+    except Exception:
+        return False
+
+
+async def is_session_timeout(page) -> bool:
+    """sync 版 is_session_timeout と同じ判定。3つの読み取りを同時に行う。"""
+    try:
+        logout, tbl, text = await asyncio.gather(
+            page.locator("a:has-text('ログアウト')").count(),
+            page.locator("#shisetsutbl").count(),
+            page.text_content("body"),
+        )
+        if logout or tbl:
+            return False
+        return "セッションタイムアウト" in (text or "")
+    except Exception:
+        return False
+
+
+# ====== Step 1: ログイン ======
+async def login(page):
+    debug("[login] ModeSelect へ移動")
+    await page.goto(ar.BASE_URL, wait_until="domcontentloaded")
+
+    if await is_logged_in(page):
+        debug("[login] 既にログイン済み")
+        return
+
+    debug("[login] ログインページへ遷移")
+    await page.evaluate("__doPostBack('login','')")
+    await page.wait_for_load_state("domcontentloaded")
+    await page.wait_for_selector("#userID", timeout=5000)
+    diag = asyncio.create_task(save_diag(page, "step1_login_page"))
+
+    await asyncio.gather(
+        page.locator("#userID").fill(ar.LOGIN_ID),
+        page.locator("#passWord").fill(ar.LOGIN_PASSWORD),
+    )
+    await diag
+    debug("[login] ID/PW 入力完了")
+
+    await page.locator("a.btnBlue:has-text('ログイン')").click()
+    await page.wait_for_load_state("domcontentloaded")
+    await page.wait_for_selector("a:has-text('ログアウト')", timeout=10000)
+
+    debug("[login] ログイン成功")
+    await save_diag(page, "step2_logged_in")
+
+
+# ====== Step 2: 施設選択 ======
+async def click_next_button(page) -> bool:
+    btn = await first_present(page, [
+        "a.btnBlue:has-text('次へ進む')",
+        "button:has-text('次へ進む')",
+        "input[type='submit'][value*='次']",
+        "a:has-text('次へ')",
+    ])
+    if btn is None:
+        debug("[next] 次へボタンが見つかりません")
+        return False
+    await btn.first.click()
+    await page.wait_for_load_state("domcontentloaded")
+    return True
+
+
+async def _relogin_and_retry(page, _retry: int):
+    await page.goto(ar.BASE_URL, wait_until="domcontentloaded")
+    await login(page)
+    return await select_facility(page, _retry=_retry + 1)
+
+
+async def select_facility(page, _retry: int = 0):
+    if _retry > 1:
+        raise RuntimeError("施設選択のリトライ上限に達しました")
+    category = f"#category_{ar.CATEGORY_ID}"
+    if not await page.locator(category).count():
+        await page.goto(ar.BASE_URL, wait_until="domcontentloaded")
+
+    debug(f"[facility] {ar.FACILITY_NAME} を選択")
+    cat_btn = page.locator(category)
+    if not await cat_btn.count():
+        await save_diag(page, "category_not_found", level=1)
+        raise RuntimeError(f"カテゴリ『{ar.FACILITY_NAME}』({category}) が見つかりません")
+    await cat_btn.click()
+    await page.wait_for_load_state("domcontentloaded")
+
+    if await is_session_timeout(page):
+        debug("[facility] カテゴリ選択後にセッションタイムアウト検知")
+        return await _relogin_and_retry(page, _retry)
+
+    await page.wait_for_selector("#shisetsutbl", timeout=5000)
+    await save_diag(page, "step3_facility_list")
+
+    tbl = page.locator("#shisetsutbl")
+    room_labels = tbl.locator("td.shisetsu.toggle label").filter(has_text=ar.ROOM_LABEL)
+    facility_labels = tbl.locator("td.shisetsu label").filter(has_text=ar.FACILITY_NAME)
+    # 部屋・施設のどちらが表示されているかを同時に確認
+    n_room, n_facility = await asyncio.gather(room_labels.count(), facility_labels.count())
+    if n_room:
+        await room_labels.first.click()
+        debug(f"[facility] {ar.ROOM_LABEL} チェック済み")
+        await click_next_button(page)
+        await save_diag(page, "step4_calendar")
+        return
+
+    if n_facility:
+        await facility_labels.first.click()
+        debug(f"[facility] {ar.FACILITY_NAME} チェック済み")
+    else:
+        debug("[facility] 施設は既に選択済みの可能性あり")
+
+    if not await click_next_button(page):
+        await save_diag(page, "next_button_not_found", level=1)
+        raise RuntimeError("「次へ進む」ボタンが見つかりません")
+
+    if await is_session_timeout(page):
+        debug("[facility] セッションタイムアウト検知、再ログインします")
+        return await _relogin_and_retry(page, _retry)
+
+    if await page.locator("#shisetsutbl").count():
+        await save_diag(page, "step3b_room_list")
+        tbl2 = page.locator("#shisetsutbl")
+        room_labels2 = tbl2.locator("td.shisetsu.toggle label").filter(has_text=ar.ROOM_LABEL)
+        if await room_labels2.count():
+            await room_labels2.first.click()
+            debug(f"[facility] {ar.ROOM_LABEL} チェック済み（2段階目）")
+        else:
+            all_labels = tbl2.locator("label")
+            texts = await all_labels.all_text_contents()
+            for i, txt in enumerate(texts):
+                if ar.ROOM_LABEL in txt.strip():
+                    await all_labels.nth(i).click()
+                    debug(f"[facility] {ar.ROOM_LABEL} チェック済み（テキスト検索）")
+                    break
+            else:
+                await save_diag(page, "room_not_found", level=1)
+                raise RuntimeError(f"'{ar.ROOM_LABEL}' が見つかりません")
+        await click_next_button(page)
+        await save_diag(page, "step4_calendar")
+    else:
+        debug("[facility] カレンダーページに直接遷移")
+        await save_diag(page, "step4_calendar")
+
+
+# ====== Step 3: カレンダー操作 ======
+async def set_display_period_one_month(page, start_date: datetime):
+    y, m, d = start_date.year, start_date.month, start_date.day
+    val = f"{y}/{m}/{d}"
+
+    # 日付・期間の設定と「表示」ボタンの探索は独立しているので同時に行う
+    _, btn = await asyncio.gather(
+        page.evaluate(
+            """({val}) => {
+                const fire = (el, t) => {
+                    if (!el) return;
+                    el.dispatchEvent(new Event(t, {bubbles: true}));
+                };
+                const dp = document.querySelector('#dpStartDate') ||
+                           document.querySelector('input[name="textDate"]');
+                if (dp) {
+                    dp.value = val;
+                    fire(dp, 'input');
+                    fire(dp, 'change');
+                }
+                const radio = document.querySelector('#radioPeriod1month') ||
+                              document.querySelector('input[type="radio"][value="1month"]') ||
+                              document.querySelector('input[type="radio"][name*="Period"][value="1"]');
+                if (radio) {
+                    radio.checked = true;
+                    fire(radio, 'input');
+                    fire(radio, 'change');
+                }
+            }""",
+            {"val": val},
+        ),
+        first_present(page, [
+            "#btnHyoji",
+            "button:has-text('表示')",
+            "input[type='submit'][value*='表示']",
+        ]),
+    )
+    if btn is None:
+        debug("[calendar] 表示ボタンが見つかりません")
+        return
+    await btn.first.click()
+    await page.wait_for_load_state("domcontentloaded")
+    await page.wait_for_selector("table.calendar.horizon.toggle", timeout=5000)
+    debug(f"[calendar] 表示期間を1ヶ月に設定: {val}")
+
+
+async def get_calendar_header_year_month(page) -> tuple:
+    try:
+        table = page.locator("table.calendar.horizon.toggle")
+        if await table.count():
+            txt = await table.first.text_content() or ""
+            m = ar.MONTH_RE.search(txt)
+            if m:
+                return int(m.group(1)), int(m.group(2))
+    except Exception:
+        pass
+    return None, None
+
+
+async def navigate_to_month(page, target: datetime, max_hops: int = 6):
+    want = (target.year, target.month)
+    have = await get_calendar_header_year_month(page)
+    hops = 0
+    while have != want and hops < max_hops and all(have):
+        direction = "next" if have < want else "prev"
+        await page.evaluate(f"__doPostBack('period','{direction}')")
+        await page.wait_for_load_state("domcontentloaded")
+        await page.wait_for_selector("table.calendar.horizon.toggle", timeout=5000)
+        have = await get_calendar_header_year_month(page)
+        hops += 1
+    debug(f"[calendar] target={want} now={have} hops={hops}")
+    return have == want
+
+
+async def read_all_availability(page, room_label: str) -> dict[str, str]:
+    """sync 版と同じく、読んだ空き状況を履歴（ar.HISTORY_BUFFER）にも溜める"""
+    availability = await page.evaluate("""(roomLabel) => {
+        const roomMatches = ROOM_MATCH_JS;
+        const result = {};
+        document.querySelectorAll('input[name="checkdate"]').forEach(inp => {
+            const val = inp.value || '';
+            const ymd = val.substring(0, 8);
+            const label = document.querySelector('label[for="' + inp.id + '"]');
+            if (!label) return;
+            const row = inp.closest('tr');
+            if (!row) return;
+            const roomCell = row.querySelector('td.shisetsu, th.shisetsu');
+            const room = roomCell ? roomCell.textContent.trim() : '';
+            if (!roomMatches(room, roomLabel)) return;
+            const mark = (label.innerText || '').trim();
+            if (mark) result[ymd] = mark;
+        });
+        return result;
+    }""".replace("ROOM_MATCH_JS", ar.ROOM_MATCH_JS), room_label)
+    if availability:
+        ar.HISTORY_BUFFER.append((time.time(), room_label, availability))
+    return availability
+
+
+async def _read_mark(lab) -> str:
+    """ラベルの空きマークを読む。テキスト・属性・画像altの各候補を同時に取得する。"""
+    valid = {"○", "△", "×", "―"}
+    img = lab.locator("img")
+    results = await asyncio.gather(
+        lab.inner_text(),
+        lab.get_attribute("title"),
+        lab.get_attribute("aria-label"),
+        img.count(),
+        return_exceptions=True,
+    )
+    for v in results[:3]:
+        if isinstance(v, str) and v.strip() in valid:
+            return v.strip()
+    if isinstance(results[3], int) and results[3]:
+        try:
+            alt = (await img.first.get_attribute("alt") or "").strip()
+            if alt in valid:
+                return alt
+        except Exception:
+            pass
+    return ""
+
+
+async def click_date_on_calendar(page, d: datetime) -> bool:
+    ymd = d.strftime("%Y%m%d")
+    inputs = page.locator(f'input[name="checkdate"][value^="{ymd}"]')
+    n = await inputs.count()
+
+    async def probe(i):
+        el = inputs.nth(i)
+        head = el.locator("xpath=ancestor::tr[1]").locator("td.shisetsu, th.shisetsu")
+        room, cid = await asyncio.gather(head.first.text_content(), el.get_attribute("id"))
+        return (room or "").strip(), cid or ""
+
+    # 各 input の部屋見出しと id を一斉に取得
+    probes = await asyncio.gather(*(probe(i) for i in range(n)), return_exceptions=True)
+    for res in probes:
+        if isinstance(res, Exception):
+            continue
+        room, cid = res
+        if not room_matches(room, ar.ROOM_LABEL):
+            continue
+        lab = page.locator(f'label[for="{cid}"]')
+        if not await lab.count():
+            continue
+        mark = await _read_mark(lab.first)
+        if mark in OK_MARKS:
+            await lab.first.click()
+            debug(f"[calendar] {d.strftime('%Y-%m-%d')} をクリック (mark={mark})")
+            return True
+    debug(f"[calendar] {d.strftime('%Y-%m-%d')} は空きなし")
+    return False
+
+
+# ====== Step 4: 時間帯選択 ======
+async def go_to_timeslot_grid(page) -> bool:
+    if await click_next_button(page):
+        try:
+            await page.wait_for_selector("input[name='checktime']", timeout=5000)
+            debug("[timeslot] 時間帯別画面へ遷移成功")
+            await save_diag(page, "step5_timeslot")
+            return True
+        except Exception:
+            pass
+
+    try:
+        await page.evaluate("__doPostBack('next','')")
+        await page.wait_for_selector("input[name='checktime']", timeout=5000)
+        debug("[timeslot] 時間帯別画面へ遷移成功 (postback)")
+        return True
+    except Exception:
+        await save_diag(page, "timeslot_fail", level=1)
+        debug("[timeslot] 時間帯別画面への遷移失敗")
+        return False
+
+
+async def _find_room_row(page):
+    tables = page.locator("table.calendar.horizon.toggle")
+    for i in range(await tables.count()):
+        t = tables.nth(i)
+        rows = t.locator("tbody tr")
+        # 各行の見出しセルをまとめて読む（行ごとの往復をなくす）
+        heads = await rows.evaluate_all("""rows => rows.map(r => {
+            const h = r.querySelector('td.shisetsu, th.shisetsu');
+            return h ? h.textContent.trim() : null;
+        })""")
+        for r, txt in enumerate(heads):
+            if txt and room_matches(txt, ar.ROOM_LABEL):
+                return t, rows.nth(r)
+    return None, None
+
+
+async def _find_wanted_columns(table, wanted_norm: set) -> list[int]:
+    cols = []
+    for i, raw in enumerate(await table.locator("thead th").all_text_contents()):
+        header_text = norm_wave(raw)
+        m = ar.SLOT_RE.search(header_text)
+        if not m:
+            continue
+        h1, m1, h2, m2 = int(m.group(1)), m.group(2), int(m.group(3)), m.group(4)
+        slot = f"{h1:02d}:{m1}~{h2:02d}:{m2}"
+        if norm_wave(slot) in wanted_norm or header_text in wanted_norm:
+            cols.append(i)
+            debug(f"[timeslot] col={i} matched: {slot}")
+    return cols
+
+
+async def _check_time_cell(cell) -> bool:
+    inp = cell.locator("input[name='checktime']")
+    try:
+        if await inp.count():
+            await inp.first.check(timeout=800)
+            return True
+    except Exception:
+        pass
+    try:
+        lab = cell.locator("label")
+        if await lab.count():
+            await lab.first.click(timeout=800)
+            return True
+    except Exception:
+        pass
+    try:
+        if await inp.count():
+            await inp.first.evaluate(
+                "(el) => { el.checked = true; el.dispatchEvent(new Event('change', {bubbles: true})); }"
+            )
+            return True
+    except Exception:
+        pass
+    return False
+
+
+async def pick_time_slots(page) -> bool:
+    table, row = await _find_room_row(page)
+    if not table or not row:
+        debug("[timeslot] 多目的ホール行が見つかりません")
+        return False
+
+    wanted_norm = {norm_wave(s) for s in ar.WANTED_SLOTS}
+    cols = await _find_wanted_columns(table, wanted_norm)
+    if len(cols) < len(ar.WANTED_SLOTS):
+        debug(f"[timeslot] 対象列が不足: found={len(cols)} want={len(ar.WANTED_SLOTS)}")
+        return False
+
+    cells = row.locator("td")
+    texts = await cells.all_text_contents()
+    for ci in cols:
+        if ci < len(texts) and not any(m in texts[ci] for m in OK_MARKS):
+            debug(f"[timeslot] col={ci} は空きなし")
+            return False
+    # 空きを確認できた列はまとめてチェックする
+    checked = await asyncio.gather(*(_check_time_cell(cells.nth(ci)) for ci in cols if ci < len(texts)))
+    picked = sum(1 for ok in checked if ok)
+    debug(f"[timeslot] picked={picked}/{len(ar.WANTED_SLOTS)}")
+    return picked == len(ar.WANTED_SLOTS)
+
+
+# ====== Step 5: 申請フォーム入力 ======
+async def fill_application_form(page) -> bool:
+    await page.wait_for_selector("input[name='spinnerNinzu']", timeout=5000)
+    result = await page.evaluate("""({ninzu, mokuteki, name, count, note}) => {
+        const errors = [];
+        const setText = (sel, value, key) => {
+            const el = document.querySelector(sel);
+            if (!el) { errors.push(key + ' not found'); return; }
+            el.value = value;
+            el.setAttribute('value', value);
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        };
+        try {
+            const sp = document.querySelector("input[name='spinnerNinzu']");
+            if (sp) {
+                sp.value = ninzu;
+                sp.setAttribute('value', ninzu);
+                if (window.jQuery) {
+                    jQuery(sp).spinner('value', parseInt(ninzu));
+                }
+            } else {
+                errors.push('spinnerNinzu not found');
+            }
+        } catch(e) { errors.push('ninzu: ' + e.message); }
+        try {
+            let found = false;
+            const labels = document.querySelectorAll('#mokuteki label');
+            for (const keyword of ['バドミントン', '軽スポーツ', '軽運動']) {
+                if (found) break;
+                for (const label of labels) {
+                    if (label.textContent.includes(keyword)) {
+                        const radio = document.getElementById(label.getAttribute('for'));
+                        if (radio) {
+                            radio.checked = true;
+                            radio.dispatchEvent(new Event('change', {bubbles: true}));
+                            radio.dispatchEvent(new Event('click', {bubbles: true}));
+                            found = true;
+                        }
+                        break;
+                    }
+                }
+            }
+            if (!found) errors.push('mokuteki: バドミントン/軽スポーツ not found');
+        } catch(e) { errors.push('mokuteki: ' + e.message); }
+        try { setText("input[name='txtYykShousai']", mokuteki, 'txtYykShousai'); } catch(e) { errors.push('shousai: ' + e.message); }
+        try { setText("input[name='txtContents1']", name, 'txtContents1'); } catch(e) { errors.push('contents1: ' + e.message); }
+        try { setText("input[name='txtContents2']", count, 'txtContents2'); } catch(e) { errors.push('contents2: ' + e.message); }
+        try { setText("input[name='txtContents3']", note, 'txtContents3'); } catch(e) { errors.push('contents3: ' + e.message); }
+        return {errors: errors, ok: errors.length === 0, overlay: window.__overlayGuard || null};
+    }""", {
+        "ninzu": ar.NINZU,
+        "mokuteki": ar.MOKUTEKI,
+        "name": "三廉康平",
+        "count": "０",
+        "note": "なし",
+    })
+
+    ar.log_overlay_guard(result.get("overlay"), "form")
+    for e in result.get("errors") or []:
+        debug(f"[form] ERROR: {e}")
+    if result.get("ok"):
+        debug("[form] 全フィールド入力成功")
+    else:
+        debug(f"[form] 一部入力失敗: {result}")
+
+    await save_diag(page, "step6_form_filled")
+    return result.get("ok", False)
+
+
+# ====== 戻る操作 ======
+async def go_back_to_calendar(page) -> bool:
+    btn = await first_present(page, [
+        "a.btnGray:has-text('戻る')",
+        "a:has-text('戻る')",
+        "button:has-text('戻る')",
+        "input[type='submit'][value*='戻る']",
+        "input[type='button'][value*='戻る']",
+    ])
+    if btn is not None:
+        await btn.first.click()
+        await page.wait_for_load_state("domcontentloaded")
+        debug("[back] カレンダー画面へ戻りました")
+        return True
+    try:
+        await page.evaluate("__doPostBack('prev','')")
+        await page.wait_for_load_state("domcontentloaded")
+        debug("[back] カレンダー画面へ戻りました (postback)")
+        return True
+    except Exception:
+        pass
+    debug("[back] 戻るボタンが見つかりません")
+    return False
+
+
+async def restore_calendar(page, target_month: datetime):
+    try:
+        await select_facility(page)
+        debug("[return] カレンダーに復帰（施設選択経由）")
+    except Exception as e:
+        debug(f"[return] 施設選択からの復帰失敗: {e} → フルリセット")
+        await login(page)
+        await select_facility(page)
+    await set_display_period_one_month(page, datetime(target_month.year, target_month.month, 1))
+    await navigate_to_month(page, target_month)
+
+
+# ====== 1日分の予約フロー ======
+async def _postback_next(page):
+    await page.evaluate("__doPostBack('next','')")
+    await page.wait_for_load_state("domcontentloaded")
+
+
+async def book_single_day(page, target: datetime) -> bool:
+    ymd = target.strftime("%Y-%m-%d")
+    weekday_name = WEEKDAY_JA[target.weekday()]
+    debug(f"[book] === {ymd}({weekday_name}) を試行 ===")
+
+    if not await click_date_on_calendar(page, target):
+        debug(f"[book] {ymd} はカレンダー上で空きなし → スキップ")
+        return False
+
+    if not await go_to_timeslot_grid(page):
+        debug(f"[book] {ymd} 時間帯画面への遷移失敗")
+        await go_back_to_calendar(page)
+        return False
+
+    if not await pick_time_slots(page):
+        debug(f"[book] {ymd} 18:30-21:30 が空いていない → 戻る")
+        await go_back_to_calendar(page)
+        return False
+
+    if not await click_next_button(page):
+        debug(f"[book] {ymd} 時間枠後の遷移に失敗")
+        await go_back_to_calendar(page)
+        return False
+
+    await fill_application_form(page)
+
+    try:
+        await _postback_next(page)
+        debug(f"[book] {ymd}({weekday_name}) 確定 → 申込確認画面")
+    except Exception as e:
+        debug(f"[book] 確定ボタン押下失敗: {e}")
+        await save_diag(page, f"confirm_fail_{ymd}", level=1)
+        return False
+
+    await save_diag(page, f"step7_confirm_{ymd}")
+
+    if ar.DRY_RUN:
+        debug(f"[book] {ymd}({weekday_name}) DRY_RUN: 確認画面で停止（申込しません）")
+        return False
+
+    try:
+        await _postback_next(page)
+        debug(f"[book] {ymd}({weekday_name}) 申込完了")
+    except Exception as e:
+        debug(f"[book] 申込ボタン押下失敗: {e}")
+        await save_diag(page, f"submit_fail_{ymd}", level=1)
+        return False
+
+    await save_diag(page, f"booked_{ymd}")
+    return True
+
+
+# ====== メインフロー ======
+async def book_days(page, target_month: datetime) -> list[datetime]:
+    """sync 版 book_days と同じ予約計画（ar.BookingPlan: 1週1日・MAX_DAYS・競合度順）で予約する"""
+    year, month = target_month.year, target_month.month
+    booked: list[datetime] = []
+    timings: list[tuple[datetime, float, bool]] = []
+
+    debug(f"[main] 対象月: {year}年{month}月 / 最大{ar.MAX_DAYS}日 (async)")
+
+    await login(page)
+    await select_facility(page)
+    await set_display_period_one_month(page, datetime(year, month, 1))
+    await navigate_to_month(page, target_month)
+
+    t_start = time.perf_counter()
+    availability = await read_all_availability(page, ar.ROOM_LABEL)
+    plan = ar.BookingPlan(availability, year, month, ar.MAX_DAYS, ar.weeks_taken_elsewhere(),
+                          ar.history_scores(year, month))
+    plan.log()
+    while (day := plan.next_day()) is not None:
+        if not ar.claim_day(day):
+            plan.record(day, False)
+            continue
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            ok = await book_single_day(page, day)
+        finally:
+            ar.settle_day(day, ok)
+        timings.append((day, time.perf_counter() - t0, ok))
+        plan.record(day, ok)
+        if not ok:
+            # 時間帯画面から戻った・確認画面で止まった等。カレンダーでなければ作り直す
+            if not await page.locator("input[name='checkdate']").count():
+                await restore_calendar(page, target_month)
+            if fresh := await read_all_availability(page, ar.ROOM_LABEL):
+                plan.drop_unavailable(fresh)
+            continue
+
+        wn = get_week_number(day)
+        booked.append(day)
+        debug(f"[main] 予約成功 {len(booked)}/{ar.MAX_DAYS}: "
+              f"{day.strftime('%Y-%m-%d')}({WEEKDAY_JA[day.weekday()]}) 第{wn}週")
+        if plan.next_day() is None:
+            break
+        await restore_calendar(page, target_month)
+        if fresh := await read_all_availability(page, ar.ROOM_LABEL):
+            plan.drop_unavailable(fresh)
+
+    report_day_timings("async", timings, time.perf_counter() - t_start)
+    debug(f"[main] 完了: {len(booked)}日予約成功")
+    for d in booked:
+        debug(f"  - {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) 第{get_week_number(d)}週")
+    return booked
+
+
+# 並列タブは sync 版（ar.new_session_page）と同じく cookie を共有しない別コンテキスト（別セッション）に開く。
+# 永続コンテキストはブラウザを持たないので、別コンテキスト用のブラウザを初回だけ起動する（run が playwright を入れる）
+_SESSION_BROWSER: dict = {}
+
+
+async def _session_browser():
+    if "browser" not in _SESSION_BROWSER:
+        _SESSION_BROWSER["browser"] = await _SESSION_BROWSER["playwright"].chromium.launch(
+            headless=_SESSION_BROWSER.get("headless", True),
+            args=["--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox"],
+        )
+    return _SESSION_BROWSER["browser"]
+
+
+async def _open_calendar_tab(browser, target_month: datetime):
+    """browser に新しいコンテキスト（別セッション）を作り、ログインして対象月のカレンダーまで進める"""
+    sub = await browser.new_context(locale="ja-JP", timezone_id="Asia/Tokyo")
+    await _prepare_context(sub)
+    page = await sub.new_page()
+    page.set_default_navigation_timeout(30000)
+    await page.goto(ar.BASE_URL, wait_until="domcontentloaded")
+    if not await is_logged_in(page):
+        await login(page)
+    await select_facility(page)
+    await set_display_period_one_month(page, datetime(target_month.year, target_month.month, 1))
+    await navigate_to_month(page, target_month)
+    return page
+
+
+async def book_days_parallel(ctx, page, target_month: datetime, tabs: int) -> list[datetime]:
+    """sync 版 book_days_parallel の async 版。タブの準備もワーカーも asyncio.gather で同時に進める。"""
+    year, month = target_month.year, target_month.month
+    debug(f"[main] 対象月: {year}年{month}月 / 最大{ar.MAX_DAYS}日 / 並列{tabs}タブ (async)")
+
+    await login(page)
+    await select_facility(page)
+    await set_display_period_one_month(page, datetime(year, month, 1))
+    await navigate_to_month(page, target_month)
+
+    availability = await read_all_availability(page, ar.ROOM_LABEL)
+    available = scan_available_days(availability, build_candidate_days(year, month, set()))
+    if not available:
+        debug("[main] 空きのある候補日がありません")
+        return []
+
+    by_week: dict[int, list[datetime]] = {}
+    for d in available:
+        by_week.setdefault(get_week_number(d), []).append(d)
+    week_queue = list(by_week.items())
+
+    n_tabs = max(1, min(tabs, len(week_queue), ar.MAX_DAYS))
+    extra = []
+    if n_tabs > 1:
+        browser = await _session_browser()
+        extra = await asyncio.gather(
+            *(_open_calendar_tab(browser, target_month) for _ in range(n_tabs - 1)),
+            return_exceptions=True,
+        )
+    pages = [page] + [p for p in extra if not isinstance(p, Exception)]
+    debug(f"[parallel] {len(pages)}タブで開始 / 対象週: {[wn for wn, _ in week_queue]}")
+
+    state = {"booked": [], "in_flight": 0, "timings": []}
+
+    async def worker(p):
+        on_calendar = True
+        while week_queue:
+            if len(state["booked"]) + state["in_flight"] >= ar.MAX_DAYS:
+                return
+            wn, days = week_queue.pop(0)
+            for day in days:
+                if len(state["booked"]) + state["in_flight"] >= ar.MAX_DAYS:
+                    return
+                if not on_calendar:
+                    await restore_calendar(p, target_month)
+                    on_calendar = True
+                state["in_flight"] += 1
+                t0 = time.perf_counter()
+                try:
+                    ok = await book_single_day(p, day)
+                finally:
+                    state["in_flight"] -= 1
+                state["timings"].append((day, time.perf_counter() - t0, ok))
+                if ok:
+                    state["booked"].append(day)
+                    on_calendar = False
+                    break
+                # 時間帯別画面にも calendar の表があるので checkdate で見る
+                if not await p.locator("input[name='checkdate']").count():
+                    on_calendar = False
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(worker(p) for p in pages), return_exceptions=True)
+    report_day_timings(f"async parallel x{len(pages)}", state["timings"], time.perf_counter() - t_start)
+    await asyncio.gather(*(p.context.close() for p in pages[1:]), return_exceptions=True)
+
+    booked = sorted(state["booked"])
+    debug(f"[main] 完了: {len(booked)}日予約成功")
+    return booked
+
+
+async def _prepare_context(ctx):
+    """不要リソースの遮断・オーバーレイ対策・スクリプトのキャッシュをコンテキスト単位で設定する"""
+    await install_blocking(ctx)
+    # オーバーレイはページ自身に隠させる（auto_reserve.OVERLAY_GUARD_JS）
+    await ctx.add_init_script(ar.OVERLAY_GUARD_JS)
+    if ar.ASSET_CACHE:
+        import asset_cache
+
+        await asset_cache.install_async(ctx)
+
+
+async def run(target_month: datetime, headless: bool) -> list[datetime]:
+    """ブラウザを起動して予約を実行する（auto_reserve.main から呼ばれる）"""
+    async with async_playwright() as p:
+        ctx = await p.chromium.launch_persistent_context(
+            user_data_dir=str(ar.USER_DATA_DIR),
+            headless=headless,
+            locale="ja-JP",
+            timezone_id="Asia/Tokyo",
+            args=["--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox"],
+        )
+        await _prepare_context(ctx)
+        _SESSION_BROWSER.update(playwright=p, headless=headless)
+        page = await ctx.new_page()
+        page.set_default_navigation_timeout(30000)
+        try:
+            if ar.PARALLEL_TABS > 0:
+                return await book_days_parallel(ctx, page, target_month, ar.PARALLEL_TABS)
+            return await book_days(page, target_month)
+        except Exception:
+            await save_diag(page, "error", level=1)
+            raise
+        finally:
+            if ar.ASSET_CACHE:
+                import asset_cache
+
+                asset_cache.flush()
+            try:
+                await ctx.close()
+                if "browser" in _SESSION_BROWSER:
+                    await _SESSION_BROWSER.pop("browser").close()
+            except Exception:
+                pass
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+ローカルシミュレーター（pf489_sim.py）に対して book_days を端から端まで実行し、
+ステップごとの所要時間と合計時間を出力するベンチマーク。
+
+Usage:
+    python bench.py                              # 逐次・sync エンジン
+    python bench.py --latency 0.3 --runs 3       # サーバー遅延 300ms で3回
+    python bench.py --engine http                # HTTP ポストバックエンジン
+    python bench.py --parallel 3                 # 3タブ並列
+    python bench.py --restore full               # 予約後の復帰を従来の施設選択経由で計測
+    python bench.py --busy 20261102=x --json out.json
+    python bench.py --competitors 8 --runs 5     # 他団体8クライアントと取り合ったときの獲得数
+    python bench.py --competitors 8 --prewarm --engine http --week-priority 4,3,5,2,1
+    python bench.py --accounts 1,2,4             # アカウント数ごとのスループット（別プロセス + 共有台帳）
+    python bench.py --attach                     # 常駐ブラウザに接続（launch_context の時間を起動と比較）
+    python bench.py --diag-level 0,1,2           # 診断レベルごとのオーバーヘッド（同期部分と後からの書き出し）
+    python bench.py --diag-level 1 --diag-ring 0 # エラー用に直前ステップの HTML を持たないときとの差
+    python bench.py --blocking route,glob,cdp    # 遮断方式ごとのカレンダー・時間帯画面の遷移時間を比較
+"""
+
+import argparse
+import atexit
+import functools
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from playwright.sync_api import sync_playwright
+
+import accounts
+import auto_reserve as ar
+import pf489_sim as sim
+
+# 計測対象のステップ（auto_reserve のモジュール関数名）
+STEPS = [
+    "launch_context",
+    "login",
+    "select_facility",
+    "set_display_period_one_month",
+    "navigate_to_month",
+    "read_all_availability",
+    "click_date_on_calendar",
+    "go_to_timeslot_grid",
+    "pick_time_slots",
+    "click_next_button",
+    "wait_transition",
+    "fill_application_form",
+    "go_back_to_calendar",
+    "return_to_calendar_after_booking",
+    "restore_calendar",
+    "quick_restore_calendar",
+    "book_single_day",
+    "pick_time_slots_batch",
+    "apply_batch",
+    "save_diag",
+]
+# 1回の画面遷移に当たるステップ（--blocking の比較表に出す）
+NAV_STEPS = {
+    "set_display_period_one_month": "calendar",
+    "navigate_to_month": "calendar",
+    "quick_restore_calendar": "calendar",
+    "go_to_timeslot_grid": "timeslot",
+    "click_next_button": "timeslot",
+}
+
+
+def instrument(names: list[str]) -> tuple[list[dict], callable]:
+    """auto_reserve の関数を計測用ラッパーに差し替える。戻り値: (記録リスト, 元に戻す関数)"""
+    records: list[dict] = []
+    originals = {}
+    depth = [0]
+
+    def wrap(name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            depth[0] += 1
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+                records.append({"step": name, "ms": (time.perf_counter() - t0) * 1000, "depth": depth[0]})
+        return timed
+
+    for name in names:
+        originals[name] = getattr(ar, name)
+        setattr(ar, name, wrap(name, originals[name]))
+
+    def restore():
+        for name, fn in originals.items():
+            setattr(ar, name, fn)
+
+    return records, restore
+
+
+def run_once(config: sim.SimConfig, engine: str, tabs: int, headless: bool,
+             competitors: sim.CompetitorConfig | None = None, prewarm_lead: float | None = None,
+             diag_level: int = 0) -> dict:
+    """
+    シミュレーターを起動して book_days を1回実行する。
+    competitors を渡すと受付開始と同時に他団体クライアントを走らせる。
+    受付開始は prewarm_lead 指定時は N 秒後（その間に ar.prewarm で待機）、
+    それ以外は book_days の開始時刻。
+    diag_level の診断ファイルの書き出し（バックグラウンド）は計測後に待ち、diag_flush_ms に分けて記録する。
+    """
+    if prewarm_lead is not None:
+        config.release_at = time.time() + prewarm_lead
+    server, state, base_url = sim.start_in_thread(config)
+    ar.BASE_URL = base_url
+    ar.LOGIN_ID, ar.LOGIN_PASSWORD = "bench", "bench"
+    ar.ENGINE = engine
+    ar.PARALLEL_TABS = tabs
+    ar.DIAG_LEVEL = diag_level
+    ar.DIAG_RING.clear()
+    ar.RUN_MARKS.clear()
+    ar.SPANS.clear()
+    ar.RESTORE_TIMINGS.clear()
+    ar.NAV_TIMINGS.clear()
+    ar.SPECULATION_TIMINGS.clear()
+    ar.SPECULATION.update(dict.fromkeys(ar.SPECULATION, 0))
+    ar.SELECTOR_STATS.clear()
+    ar.CALENDAR_URL = ""
+    ar.ROUTE_CALLS = 0
+    target_month = ar.first_of_next_month(datetime(config.today.year, config.today.month, 1))
+
+    records, restore = instrument(STEPS)
+    try:
+        with tempfile.TemporaryDirectory() as udata, sync_playwright() as p:
+            ar.USER_DATA_DIR = Path(udata)
+            ctx = ar.launch_context(p, headless)
+            page = ctx.new_page()
+            extra_pages = None
+            if prewarm_lead is not None:
+                deadline = datetime.fromtimestamp(config.release_at, ar.JST)
+                extra_pages = ar.prewarm(ctx, page, target_month, deadline, tabs, clock_sync=False)
+            else:
+                config.release_at = time.time()
+            if competitors and competitors.clients:
+                state.start_competitors(competitors, config.release_at, target_month.year, target_month.month)
+            t0 = time.perf_counter()
+            if tabs > 0:
+                booked = ar.book_days_parallel(ctx, page, target_month, tabs, extra_pages)
+            else:
+                booked = ar.book_days(page, target_month, prepared=prewarm_lead is not None)
+            total = time.perf_counter() - t0
+            t1 = time.perf_counter()
+            ar.stop_tracing(ctx)
+            ar.flush_diag()
+            diag_flush = time.perf_counter() - t1
+            ctx.close()
+    finally:
+        restore()
+        server.shutdown()
+    return {
+        "booked": [d.strftime("%Y-%m-%d") for d in booked],
+        "total_ms": total * 1000,
+        "diag_flush_ms": diag_flush * 1000,
+        "requests": state.request_count,
+        "static_requests": state.static_count,
+        "route_calls": ar.ROUTE_CALLS,
+        "records": records,
+        "spans": list(ar.SPANS),
+        "contention": contention_result(state, config, target_month),
+    }
+
+
+def contention_result(state: sim.SimState, config: sim.SimConfig, target_month: datetime) -> dict:
+    """台帳から「候補日のうち自分/他団体/未予約」と、自分が取れた日の週・曜日優先度・遅延をまとめる"""
+    room = config.rooms[0]
+    owners = {b["ymd"]: b for b in state.bookings if b["room"] == room}
+    candidates = ar.build_candidate_days(target_month.year, target_month.month, set())
+    won, lost = [], []
+    for d in candidates:
+        b = owners.get(d.strftime("%Y%m%d"))
+        if b and b["owner"] == ar.LOGIN_ID:
+            won.append({
+                "date": d.strftime("%Y-%m-%d"),
+                "week": ar.get_week_number(d),
+                "week_rank": ar.WEEK_PRIORITY.index(ar.get_week_number(d)),
+                "weekday_rank": ar.WEEKDAY_PRIORITY.index(d.weekday()),
+                "latency_ms": (b["at"] - config.release_at) * 1000,
+            })
+        elif b:
+            lost.append(d.strftime("%Y-%m-%d"))
+    rivals = sum(1 for b in state.bookings if b["owner"].startswith("rival"))
+    return {"won": won, "lost_to_rivals": lost, "rival_bookings": rivals, "target": ar.MAX_DAYS}
+
+
+def run_accounts_once(config: sim.SimConfig, n_accounts: int, engine: str, headless: bool,
+                      competitors: sim.CompetitorConfig | None = None,
+                      prewarm_lead: float | None = None) -> dict:
+    """シミュレーターを起動して n_accounts 個のアカウントで accounts.run_accounts を1回実行する"""
+    if prewarm_lead is not None:
+        config.release_at = time.time() + prewarm_lead
+    server, state, base_url = sim.start_in_thread(config)
+    ar.BASE_URL = base_url
+    ar.ENGINE = engine
+    ar.DIAG_LEVEL = 0
+    target_month = ar.first_of_next_month(datetime(config.today.year, config.today.month, 1))
+    deadline = datetime.fromtimestamp(config.release_at, ar.JST) if prewarm_lead is not None else None
+    if competitors and competitors.clients:
+        state.start_competitors(competitors, config.release_at or time.time(),
+                                target_month.year, target_month.month)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            ar.USER_DATA_DIR = Path(tmp) / "udata"
+            report = accounts.run_accounts(
+                [(f"bench{i + 1}", "bench") for i in range(n_accounts)], target_month, headless,
+                deadline, clock_sync=False, ledger_path=Path(tmp) / "ledger.json",
+            )
+    finally:
+        server.shutdown()
+    book_sec = max((r["sec"] for r in report["accounts"]), default=0.0)
+    return {
+        "accounts": n_accounts,
+        "booked": report["booked"],
+        "wall_ms": report["wall_sec"] * 1000,
+        "book_ms": book_sec * 1000,
+        "requests": state.request_count,
+        "per_account": report["accounts"],
+        "errors": [r["error"] for r in report["accounts"] if r["error"]],
+    }
+
+
+def print_accounts_report(results: dict[int, list[dict]], label: str):
+    """アカウント数ごとの 予約日数 / 予約にかかった時間 / 日/分 を比較する（各 run の平均）"""
+    print(f"\n=== {label} ===")
+    print(f"{'accounts':>8}{'booked':>8}{'book':>10}{'wall':>10}{'days/min':>10}{'requests':>10}{'errors':>8}")
+    for n, runs in results.items():
+        booked = statistics.mean(len(r["booked"]) for r in runs)
+        book_ms = statistics.mean(r["book_ms"] for r in runs)
+        wall_ms = statistics.mean(r["wall_ms"] for r in runs)
+        per_min = booked / (book_ms / 60000) if book_ms else 0.0
+        errors = sum(len(r["errors"]) for r in runs)
+        print(f"{n:>8}{booked:>8.1f}{book_ms:>8.0f}ms{wall_ms:>8.0f}ms{per_min:>10.1f}"
+              f"{statistics.mean(r['requests'] for r in runs):>10.0f}{errors:>8}")
+
+
+def summarize(runs: list[dict]) -> dict:
+    """ステップ別に 回数 / 合計 / 平均 / 最大 をまとめる（各 run の平均）"""
+    steps: dict[str, list[float]] = {}
+    for run in runs:
+        for rec in run["records"]:
+            steps.setdefault(rec["step"], []).append(rec["ms"])
+    n = len(runs)
+    won = [w for r in runs for w in r["contention"]["won"]]
+    return {
+        "runs": n,
+        "won": sum(len(r["contention"]["won"]) for r in runs) / n,
+        "target": ar.MAX_DAYS,
+        "won_latency_ms": statistics.median(w["latency_ms"] for w in won) if won else None,
+        "won_by_week": {wk: sum(1 for w in won if w["week"] == wk) / n for wk in ar.WEEK_PRIORITY},
+        "won_by_weekday": {ar.WEEKDAY_JA[wd]: sum(1 for w in won if w["weekday_rank"] == i) / n
+                           for i, wd in enumerate(ar.WEEKDAY_PRIORITY)},
+        "lost_to_rivals": statistics.mean(len(r["contention"]["lost_to_rivals"]) for r in runs),
+        "total_ms": statistics.mean(r["total_ms"] for r in runs),
+        "diag_flush_ms": statistics.mean(r["diag_flush_ms"] for r in runs),
+        "booked": statistics.mean(len(r["booked"]) for r in runs),
+        "requests": statistics.mean(r["requests"] for r in runs),
+        "route_calls": statistics.mean(r["route_calls"] for r in runs),
+        "static_requests": statistics.mean(r["static_requests"] for r in runs),
+        "steps": {
+            name: {
+                "count": len(v) / n,
+                "total_ms": sum(v) / n,
+                "mean_ms": statistics.mean(v),
+                "max_ms": max(v),
+            }
+            for name, v in steps.items()
+        },
+    }
+
+
+def print_report(summary: dict, label: str):
+    print(f"\n=== {label} ===")
+    print(f"runs={summary['runs']} booked={summary['booked']:.1f} "
+          f"requests={summary['requests']:.0f} static={summary['static_requests']:.0f} "
+          f"route_calls={summary['route_calls']:.0f} "
+          f"total={summary['total_ms']:.0f}ms")
+    print(f"{'step':<34}{'count':>7}{'total':>10}{'mean':>10}{'max':>10}")
+    for name in STEPS:
+        s = summary["steps"].get(name)
+        if not s:
+            continue
+        print(f"{name:<34}{s['count']:>7.1f}{s['total_ms']:>8.0f}ms{s['mean_ms']:>8.0f}ms{s['max_ms']:>8.0f}ms")
+    lat = summary["won_latency_ms"]
+    print(f"\nwon={summary['won']:.1f}/{summary['target']} lost_to_rivals={summary['lost_to_rivals']:.1f} "
+          f"latency(median)={'-' if lat is None else f'{lat:.0f}ms'}")
+    print("  by week   : " + " ".join(f"第{wk}週={v:.1f}" for wk, v in summary["won_by_week"].items()))
+    print("  by weekday: " + " ".join(f"{wd}={v:.1f}" for wd, v in summary["won_by_weekday"].items()))
+
+
+def print_blocking_comparison(summaries: dict[str, dict]):
+    """遮断方式ごとの画面遷移1回あたりの平均（ms）と、Python に上がったルートの数"""
+    modes = list(summaries)
+    print("\n=== blocking: 画面遷移1回あたりの平均 ===")
+    print(f"{'step':<34}{'page':<10}" + "".join(f"{m:>10}" for m in modes))
+    for name, kind in NAV_STEPS.items():
+        cells = [summaries[m]["steps"].get(name) for m in modes]
+        if not any(cells):
+            continue
+        print(f"{name:<34}{kind:<10}" + "".join(f"{c['mean_ms']:>8.0f}ms" if c else f"{'-':>10}" for c in cells))
+    for kind in ("calendar", "timeslot"):
+        row = []
+        for m in modes:
+            v = [s for name, s in summaries[m]["steps"].items() if NAV_STEPS.get(name) == kind]
+            count = sum(s["count"] for s in v)
+            row.append(sum(s["total_ms"] for s in v) / count if count else None)
+        print(f"{'(平均)':<34}{kind:<10}" + "".join(f"{x:>8.0f}ms" if x is not None else f"{'-':>10}" for x in row))
+    print(f"{'route_calls':<44}" + "".join(f"{summaries[m]['route_calls']:>10.0f}" for m in modes))
+
+
+def print_diag_comparison(summaries: dict[int, dict]):
+    """診断レベルごとの予約の所要時間（レベル0との差）と、save_diag の同期部分・後からの書き出し時間"""
+    base = summaries[min(summaries)]["total_ms"]
+    print("\n=== diag level: オーバーヘッド ===")
+    print(f"{'level':<8}{'total':>10}{'delta':>10}{'save_diag':>12}{'count':>8}{'flush':>10}")
+    for level, s in summaries.items():
+        sd = s["steps"].get("save_diag", {"total_ms": 0.0, "count": 0})
+        print(f"{level:<8}{s['total_ms']:>8.0f}ms{s['total_ms'] - base:>+8.0f}ms"
+              f"{sd['total_ms']:>10.0f}ms{sd['count']:>8.1f}{s['diag_flush_ms']:>8.0f}ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="シミュレーター上で book_days を計測")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.1, help="ポストバック1回あたりの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--static-latency", type=float, default=0.02)
+    parser.add_argument("--busy", default="", help="埋まっている日: 20261102=x,20261109=e,...")
+    parser.add_argument("--today", default=None, help="サーバー上の今日 (YYYY-MM-DD)")
+    parser.add_argument("--engine", choices=["sync", "http"], default="sync")
+    parser.add_argument("--parallel", type=int, default=0, metavar="N")
+    parser.add_argument("--max-days", type=int, default=None)
+    parser.add_argument("--batch", action="store_true", help="一括申込（ar.BATCH）")
+    parser.add_argument("--restore", choices=["quick", "full"], default="quick", help="予約後のカレンダー復帰方式")
+    parser.add_argument("--competitors", type=int, default=0, help="受付開始時に押し寄せる他団体の数")
+    parser.add_argument("--arrival", choices=["exp", "normal", "uniform"], default="exp",
+                        help="他団体の到着時刻の分布")
+    parser.add_argument("--arrival-mean", type=float, default=3.0, help="受付開始から到着までの平均（秒）")
+    parser.add_argument("--arrival-spread", type=float, default=2.0)
+    parser.add_argument("--rival-picks", type=int, default=2, help="他団体1クライアントが取る日数")
+    parser.add_argument("--rival-service", type=float, default=1.0, help="他団体の1日分の申込時間（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--prewarm", type=float, nargs="?", const=10.0, default=None, metavar="SEC",
+                        help="受付開始 SEC 秒前からセットアップして待機（ar.prewarm）")
+    parser.add_argument("--week-priority", default=None, help="週の優先順位 例: 4,3,5,2,1")
+    parser.add_argument("--accounts", default=None, metavar="N,N,...",
+                        help="アカウント数を変えて複数アカウント予約を計測 例: 1,2,4")
+    parser.add_argument("--blocking", default="cdp", metavar="MODE[,MODE]",
+                        help="不要リソースの遮断方式（cdp / glob / route）。カンマ区切りで比較")
+    parser.add_argument("--no-asset-cache", dest="asset_cache", action="store_false",
+                        help="静的スクリプトのディスクキャッシュを使わない（使う場合は run をまたいで温まる）")
+    parser.add_argument("--attach", nargs="?", const=True, default=None, metavar="URL",
+                        help="起動せずに常駐ブラウザ（browser_server.py）へ接続（launch_context を比較）")
+    parser.add_argument("--diag-level", default="0", metavar="N[,N]",
+                        help="診断レベル（0 / 1 / 2）。カンマ区切りでオーバーヘッドを比較")
+    parser.add_argument("--diag-ring", type=int, default=ar.DIAG_RING_SIZE, metavar="N",
+                        help="エラー時に書き出す直前のステップ数（auto_reserve.py --diag-ring と同じ。0=取らない, "
+                             f"デフォルト: {ar.DIAG_RING_SIZE}）")
+    parser.add_argument("--no-headless", dest="headless", action="store_false")
+    parser.add_argument("--json", default=None, help="結果を JSON で保存")
+    return parser.parse_args()
+
+
+def make_config(args, i: int) -> tuple[sim.SimConfig, sim.CompetitorConfig]:
+    """コマンドライン引数から i 回目の run のシミュレーター設定を作る"""
+    config = sim.SimConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        static_latency=args.static_latency,
+        busy=sim.parse_availability(args.busy),
+    )
+    if args.today:
+        config.today = date.fromisoformat(args.today)
+    competitors = sim.CompetitorConfig(
+        clients=args.competitors, arrival=args.arrival, mean=args.arrival_mean,
+        spread=args.arrival_spread, picks=args.rival_picks, service=args.rival_service,
+        seed=None if args.seed is None else args.seed + i,
+    )
+    return config, competitors
+
+
+def run_accounts_sweep(args):
+    """--accounts 1,2,4: アカウント数ごとに --runs 回ずつ計測して比較表を出す"""
+    results: dict[int, list[dict]] = {}
+    for n in (int(x) for x in args.accounts.split(",")):
+        for i in range(args.runs):
+            config, competitors = make_config(args, i)
+            run = run_accounts_once(config, n, args.engine, args.headless, competitors, args.prewarm)
+            results.setdefault(n, []).append(run)
+            print(f"[bench] accounts={n} run {i + 1}/{args.runs}: {run['book_ms']:.0f}ms "
+                  f"booked={run['booked']}", file=sys.stderr)
+    label = f"accounts engine={args.engine} latency={args.latency * 1000:.0f}ms"
+    if args.competitors:
+        label += f" competitors={args.competitors}/{args.arrival}"
+    print_accounts_report(results, label)
+    if args.json:
+        Path(args.json).write_text(json.dumps({"label": label, "results": results},
+                                              ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def main():
+    args = parse_args()
+    # シミュレーターの空き状況・スクリプトを本番の履歴・キャッシュに混ぜない
+    ar.HISTORY_DB = None
+    ar.SELECTOR_CACHE_PATH = None
+    ar.ASSET_CACHE = args.asset_cache
+    if args.attach:
+        ar.ATTACH = True
+        if isinstance(args.attach, str):
+            ar.BROWSER_ENDPOINT = args.attach
+    ar.ASSET_CACHE_DIR = Path(tempfile.mkdtemp(prefix="bench_assets_"))
+    atexit.register(shutil.rmtree, ar.ASSET_CACHE_DIR, True)
+    ar.LOG_DIR = Path(tempfile.mkdtemp(prefix="bench_diag_"))
+    atexit.register(shutil.rmtree, ar.LOG_DIR, True)
+    if args.max_days is not None:
+        ar.MAX_DAYS = args.max_days
+    ar.DIAG_RING_SIZE = args.diag_ring
+    ar.RESTORE_MODE = args.restore
+    ar.BATCH = args.batch
+    if args.week_priority:
+        ar.WEEK_PRIORITY = [int(w) for w in args.week_priority.split(",")]
+    if args.accounts:
+        ar.BLOCKING = args.blocking.split(",")[0]
+        run_accounts_sweep(args)
+        return
+    modes = args.blocking.split(",")
+    levels = [int(x) for x in args.diag_level.split(",")]
+    results = {}
+    for mode, level in ((m, lv) for m in modes for lv in levels):
+        ar.BLOCKING = mode
+        runs = []
+        for i in range(args.runs):
+            config, competitors = make_config(args, i)
+            runs.append(run_once(config, args.engine, args.parallel, args.headless, competitors, args.prewarm,
+                                 level))
+            print(f"[bench] blocking={mode} diag={level} run {i + 1}/{args.runs}: "
+                  f"{runs[-1]['total_ms']:.0f}ms booked={runs[-1]['booked']}", file=sys.stderr)
+        summary = summarize(runs)
+        label = (f"engine={args.engine} parallel={args.parallel} restore={args.restore} blocking={mode} "
+                 f"diag={level} latency={args.latency * 1000:.0f}ms")
+        if args.competitors:
+            label += f" competitors={args.competitors}/{args.arrival}"
+        if args.batch:
+            label += " batch"
+        if args.prewarm is not None:
+            label += " prewarm"
+        print_report(summary, label)
+        results[(mode, level)] = {"label": label, "summary": summary, "runs": runs}
+    if ar.ASSET_CACHE:
+        import asset_cache
+
+        asset_cache.flush()
+    if len(modes) > 1:
+        print_blocking_comparison({m: results[(m, levels[0])]["summary"] for m in modes})
+    if len(levels) > 1:
+        print_diag_comparison({lv: results[(modes[0], lv)]["summary"] for lv in levels})
+    if args.json:
+        out = (next(iter(results.values())) if len(results) == 1
+               else {f"{m}/diag{lv}": r for (m, lv), r in results.items()})
+        Path(args.json).write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+常駐ブラウザ（auto_reserve.py --attach の接続先）
+
+Chromium を --remote-debugging-port 付きで起動したまま待機する。--attach の実行は
+ここに CDP で接続して新しいコンテキストを作るだけなので、毎回のブラウザ起動
+（コールドスタート）がかからない。Ctrl+C で終了するまでブラウザは残る。
+
+Usage:
+    python browser_server.py                  # http://127.0.0.1:9222 で待機
+    python browser_server.py --port 9333 --no-headless
+    python auto_reserve.py --attach           # BROWSER_ENDPOINT（既定 http://127.0.0.1:9222）に接続
+    python auto_reserve.py --attach http://127.0.0.1:9333
+"""
+
+import argparse
+import time
+
+from playwright.sync_api import sync_playwright
+
+from auto_reserve import debug
+
+
+def main():
+    parser = argparse.ArgumentParser(description="--attach 用の常駐ブラウザ")
+    parser.add_argument("--port", type=int, default=9222)
+    parser.add_argument("--no-headless", dest="headless", action="store_false")
+    args = parser.parse_args()
+
+    with sync_playwright() as p:
+        t0 = time.perf_counter()
+        browser = p.chromium.launch(
+            headless=args.headless,
+            args=[
+                f"--remote-debugging-port={args.port}",
+                "--remote-debugging-address=127.0.0.1",
+                "--disable-dev-shm-usage", "--disable-gpu", "--no-sandbox",
+            ],
+        )
+        debug(f"[server] 起動 {time.perf_counter() - t0:.2f}s / http://127.0.0.1:{args.port} で待機（Ctrl+C で終了）")
+        try:
+            while browser.is_connected():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            browser.close()
+
+
+if __name__ == "__main__":
+    main()
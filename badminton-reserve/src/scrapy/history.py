@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+空き状況の履歴ストア（SQLite）
+
+read_all_availability のスナップショット（時刻・部屋・日付→マーク）を貯めておき、
+「受付開始から何秒で埋まったか」を週・曜日ごとに集計する。集計結果は予約計画
+（BookingPlan）の競合度として使い、取られやすい日から先に試す。
+
+受付開始は「対象月の前月1日 9:00 JST」。ある日が最初に ○/△ 以外（×・―等）で
+観測された時刻と受付開始の差を「埋まるまでの時間」とする。最後まで空いていた日は
+「観測した間は埋まらなかった」ものとして埋まった割合にだけ数える。
+
+Usage:
+    python history.py                 # 週・曜日ごとの集計を表示
+    python history.py --room 多目的ホール --db history.sqlite3
+"""
+
+import argparse
+import sqlite3
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+
+from auto_reserve import JST, OK_MARKS, WEEKDAY_JA, debug, get_week_number
+
+DEFAULT_DB = Path(__file__).parent / "history.sqlite3"
+# 週・曜日の統計を使うのに必要な最低日数（これ未満なら既定の競合度に任せる）
+MIN_SAMPLES = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at REAL NOT NULL,
+    room TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS marks (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    ymd TEXT NOT NULL,
+    mark TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS marks_ymd ON marks (ymd, snapshot_id);
+"""
+
+
+def connect(path: Path = DEFAULT_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_snapshots(path: Path, snapshots: list[tuple[float, str, dict[str, str]]]):
+    """[(時刻, 部屋, {YYYYMMDD: マーク})] をまとめて書き込む"""
+    if not snapshots:
+        return
+    with connect(path) as conn:
+        for taken_at, room, marks in snapshots:
+            cur = conn.execute("INSERT INTO snapshots (taken_at, room) VALUES (?, ?)", (taken_at, room))
+            conn.executemany(
+                "INSERT INTO marks (snapshot_id, ymd, mark) VALUES (?, ?, ?)",
+                [(cur.lastrowid, ymd, mark) for ymd, mark in marks.items()],
+            )
+
+
+def release_time(ymd: str) -> float:
+    """その日の予約受付開始（前月1日 9:00 JST）の epoch 秒"""
+    y, m = int(ymd[:4]), int(ymd[4:6])
+    y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+    return datetime(y, m, 1, 9, 0, tzinfo=JST).timestamp()
+
+
+def day_outcomes(conn: sqlite3.Connection, room: str) -> list[dict]:
+    """
+    日ごとに「受付開始後に空いていた日が、何秒で埋まったか」を求める。
+    戻り値: [{ymd, week, weekday, taken_after(秒 or None), observed(最後の観測まで秒)}]
+    """
+    rows = conn.execute(
+        "SELECT m.ymd, s.taken_at, m.mark FROM marks m JOIN snapshots s ON s.id = m.snapshot_id "
+        "WHERE s.room = ? ORDER BY m.ymd, s.taken_at",
+        (room,),
+    ).fetchall()
+    outcomes = []
+    by_day: dict[str, list[tuple[float, str]]] = {}
+    for ymd, taken_at, mark in rows:
+        by_day.setdefault(ymd, []).append((taken_at, mark))
+    for ymd, seen in by_day.items():
+        release = release_time(ymd)
+        seen = [(t, mk) for t, mk in seen if t >= release]
+        # 受付開始後の最初の観測で空いていなければ、統計に使えない（最初から埋まっていた）
+        if not seen or seen[0][1] not in OK_MARKS:
+            continue
+        taken_after = next((t - release for t, mk in seen if mk not in OK_MARKS), None)
+        d = datetime.strptime(ymd, "%Y%m%d")
+        outcomes.append({
+            "ymd": ymd,
+            "week": get_week_number(d),
+            "weekday": d.weekday(),
+            "taken_after": taken_after,
+            "observed": seen[-1][0] - release,
+        })
+    return outcomes
+
+
+def _summarize(values: list[dict]) -> dict:
+    taken = [o["taken_after"] for o in values if o["taken_after"] is not None]
+    return {
+        "days": len(values),
+        "taken": len(taken),
+        "taken_rate": len(taken) / len(values) if values else 0.0,
+        "median_sec": statistics.median(taken) if taken else None,
+    }
+
+
+def contention_stats(conn: sqlite3.Connection, room: str) -> dict:
+    """週別・曜日別の「埋まるまでの時間」統計。戻り値: {"week": {n: 集計}, "weekday": {n: 集計}}"""
+    outcomes = day_outcomes(conn, room)
+    stats: dict[str, dict[int, dict]] = {"week": {}, "weekday": {}}
+    for key in stats:
+        groups: dict[int, list[dict]] = {}
+        for o in outcomes:
+            groups.setdefault(o[key], []).append(o)
+        stats[key] = {k: _summarize(v) for k, v in sorted(groups.items())}
+    return stats
+
+
+def _group_score(s: dict | None) -> float | None:
+    """1グループの競合度: 埋まった割合 × 1時間あたりの「速さ」（早く埋まるほど大きい）"""
+    if not s or s["days"] < MIN_SAMPLES:
+        return None
+    if s["median_sec"] is None:
+        return 0.0
+    return s["taken_rate"] * 3600 / (s["median_sec"] + 60)
+
+
+def contention_scores(path: Path, room: str, days: list[datetime]) -> dict[str, float]:
+    """
+    候補日ごとの競合度（大きいほど早く埋まる）。週と曜日の統計の平均で、
+    どちらも MIN_SAMPLES に満たない日は含めない（BookingPlan は既定の競合度で補う）。
+    ただし一部の日だけ履歴で決まると尺度が混ざるので、全候補日が揃わなければ空を返す。
+    """
+    if not Path(path).exists():
+        return {}
+    with connect(path) as conn:
+        stats = contention_stats(conn, room)
+    scores = {}
+    for d in days:
+        parts = [x for x in (_group_score(stats["week"].get(get_week_number(d))),
+                             _group_score(stats["weekday"].get(d.weekday()))) if x is not None]
+        if not parts:
+            return {}
+        scores[d.strftime("%Y%m%d")] = sum(parts) / len(parts)
+    return scores
+
+
+def print_stats(stats: dict):
+    def fmt(s):
+        med = "-" if s["median_sec"] is None else f"{s['median_sec']:.0f}s"
+        return f"days={s['days']:>3} taken={s['taken_rate'] * 100:>5.1f}% median={med}"
+
+    print("週別（受付開始から埋まるまで）")
+    for wn, s in stats["week"].items():
+        print(f"  第{wn}週  {fmt(s)}")
+    print("曜日別")
+    for wd, s in stats["weekday"].items():
+        print(f"  {WEEKDAY_JA[wd]}曜   {fmt(s)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="空き状況履歴の集計")
+    parser.add_argument("--db", default=str(DEFAULT_DB))
+    parser.add_argument("--room", default="多目的ホール")
+    args = parser.parse_args()
+    if not Path(args.db).exists():
+        debug(f"[history] {args.db} がありません")
+        return
+    t0 = time.perf_counter()
+    with connect(Path(args.db)) as conn:
+        stats = contention_stats(conn, args.room)
+    print_stats(stats)
+    debug(f"[history] 集計 {time.perf_counter() - t0:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,681 @@
+# -*- coding: utf-8 -*-
+"""
+豊島区施設予約システム（www2.pf489.com）のローカルシミュレーター
+
+auto_reserve.py が触るページを、実サイトと同じ ID・ポストバック名で返す:
+  ModeSelect(#category_18) → ログイン(#userID/#passWord) → 施設一覧/部屋一覧(#shisetsutbl)
+  → 施設別空き状況(table.calendar.horizon.toggle + checkdate) → 時間帯別(checktime)
+  → 申請フォーム(spinnerNinzu) → 申込確認 → 申込完了
+サーバー遅延・空き状況・受付開始時刻・セッションタイムアウトを設定できる。
+--competitors を付けると、受付開始後に他団体のクライアントが夜枠を取り合う。
+
+Usage:
+    python pf489_sim.py --port 8489 --latency 0.2
+    python pf489_sim.py --release-in 30 --competitors 8 --arrival normal
+    RESERVE_BASE_URL=http://127.0.0.1:8489/toshima/WebR/Home/WgR_ModeSelect python auto_reserve.py --dry-run
+"""
+
+import argparse
+import hashlib
+import html
+import random
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+MODESELECT_PATH = "/toshima/WebR/Home/WgR_ModeSelect"
+PAGE_PATHS = {
+    "modeselect": MODESELECT_PATH,
+    "login": "/toshima/WebR/Home/WgR_Login",
+    "facility": "/toshima/WebR/Shisetsu/WgR_ShisetsuKensaku",
+    "rooms": "/toshima/WebR/Shisetsu/WgR_ShitsujyoKensaku",
+    "calendar": "/toshima/WebR/Shisetsu/WgR_ShisetsubetsuAkiJoukyou",
+    "timeslot": "/toshima/WebR/Shisetsu/WgR_JikantaibetsuAkiJoukyou",
+    "form": "/toshima/WebR/Yoyaku/WgR_YoyakuShinsei",
+    "confirm": "/toshima/WebR/Yoyaku/WgR_YoyakuKakunin",
+    "done": "/toshima/WebR/Yoyaku/WgR_YoyakuKanryou",
+}
+SCRIPT_PATHS = {
+    "/toshima/WebR/Scripts/jquery-1.11.1.min.js": "/* jquery stub */\n",
+    "/toshima/WebR/Scripts/common.js": (
+        "function __doPostBack(t, a) {\n"
+        "  var f = document.getElementById('form1');\n"
+        "  f.elements['__EVENTTARGET'].value = t;\n"
+        "  f.elements['__EVENTARGUMENT'].value = a;\n"
+        "  f.submit();\n"
+        "}\n"
+    ),
+}
+# 時間帯別画面の列（実サイトと同じく全角の「～」を使う）
+SLOTS = [
+    "9:00～10:00", "10:00～11:00", "11:00～12:00", "13:00～14:00", "14:00～15:00",
+    "15:00～16:00", "16:00～17:00", "17:00～18:00", "18:30～19:30", "19:30～20:30", "20:30～21:30",
+]
+EVENING = [8, 9, 10]
+WEEKDAY_JA = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+def static_etag(body: str) -> str:
+    """静的ファイルの ETag（プロセスをまたいでも同じ値になるよう内容のハッシュから作る）"""
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:16] + '"'
+
+
+@dataclass
+class SimConfig:
+    latency: float = 0.1           # ページ（ポストバック）1回あたりのサーバー処理時間（秒）
+    jitter: float = 0.0            # latency に足す一様乱数の幅（秒）
+    static_latency: float = 0.02   # JS 等の静的ファイル1回あたりの遅延（秒）
+    facility: str = "ふるさと千川館"
+    rooms: tuple = ("多目的ホール", "ふるさと千川の部屋")
+    today: date = field(default_factory=date.today)
+    release_at: float | None = None  # この時刻(epoch)までは翌月以降を「―」で表示し予約不可
+    session_timeout: float = 1200.0
+    # {YYYYMMDD: 埋まっている時間帯の列番号リスト}（全部屋共通）
+    busy: dict[str, list[int]] = field(default_factory=dict)
+
+
+@dataclass
+class CompetitorConfig:
+    """受付開始と同時に押し寄せる他団体のクライアント"""
+    clients: int = 0
+    arrival: str = "exp"         # 到着時刻の分布: exp / normal / uniform
+    mean: float = 3.0            # 受付開始から到着までの平均（秒）
+    spread: float = 2.0          # normal の標準偏差 / uniform の幅（秒）
+    picks: int = 2               # 1クライアントが取ろうとする日数
+    service: float = 1.0         # 1日分の申込にかかる時間（秒）
+    weekdays: tuple = (0, 1, 2, 3)
+    seed: int | None = None
+
+
+def parse_availability(spec: str) -> dict[str, list[int]]:
+    """"20261102=x,20261109=e,20261116=m" 形式を busy に変換する。
+    x=終日埋まり(×) / e=夜の1枠埋まり(△・希望枠は取れない) / m=午前が埋まり(△・夜は空き)"""
+    busy = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        ymd, kind = item.split("=")
+        busy[ymd] = {
+            "x": list(range(len(SLOTS))),
+            "e": [EVENING[1]],
+            "m": [0, 1, 2],
+        }[kind]
+    return busy
+
+
+def _month_add(d: date, months: int) -> date:
+    y, m = divmod(d.month - 1 + months, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+# ====== サーバー状態 ======
+class SimState:
+    """予約台帳とセッション。スレッドセーフ（ThreadingHTTPServer から同時に呼ばれる）"""
+
+    def __init__(self, config: SimConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        # (部屋, YYYYMMDD) -> {列番号: 予約者}
+        self.taken: dict[tuple[str, str], dict[int, str]] = {}
+        for ymd, cols in config.busy.items():
+            for room in config.rooms:
+                self.taken[(room, ymd)] = {c: "preset" for c in cols}
+        self.sessions: dict[str, dict] = {}
+        self.bookings: list[dict] = []
+        self.request_count = 0
+        # 静的ファイルへのリクエスト数（304 で返した分は not_modified にも数える）
+        self.static_count = 0
+        self.not_modified = 0
+
+    def is_open(self, d: date) -> bool:
+        """受付開始前は翌月以降を予約不可にする"""
+        if self.config.release_at is None or time.time() >= self.config.release_at:
+            return True
+        return d < _month_add(self.config.today, 1)
+
+    def slot_free(self, room: str, ymd: str, col: int) -> bool:
+        return col not in self.taken.get((room, ymd), {})
+
+    def day_mark(self, room: str, d: date) -> str:
+        if not self.is_open(d) or d < self.config.today:
+            return "―"
+        n = len(self.taken.get((room, d.strftime("%Y%m%d")), {}))
+        if n == 0:
+            return "○"
+        return "×" if n >= len(SLOTS) else "△"
+
+    def try_book(self, owner: str, room: str, ymd: str, cols: list[int]) -> bool:
+        """全ての列が空いていれば確保する（誰かに先を越されたら False）"""
+        with self.lock:
+            d = date(int(ymd[:4]), int(ymd[4:6]), int(ymd[6:8]))
+            if not self.is_open(d) or not all(self.slot_free(room, ymd, c) for c in cols):
+                return False
+            slot_map = self.taken.setdefault((room, ymd), {})
+            for c in cols:
+                slot_map[c] = owner
+            self.bookings.append({"owner": owner, "room": room, "ymd": ymd, "cols": cols, "at": time.time()})
+            return True
+
+    def new_session(self) -> tuple[str, dict]:
+        sid = secrets.token_hex(12)
+        sess = {"stage": "modeselect", "user": None, "touched": time.time()}
+        with self.lock:
+            self.sessions[sid] = sess
+        return sid, sess
+
+    def start_competitors(self, comp: CompetitorConfig, release_at: float, year: int, month: int):
+        """他団体クライアントをスレッドで走らせる。各クライアントは到着時刻になったら
+        対象月の平日の夜枠（EVENING）が全部空いている日をランダムに取りにいく。"""
+        rng = random.Random(comp.seed)
+        days, d = [], date(year, month, 1)
+        while d.month == month:
+            if d.weekday() in comp.weekdays:
+                days.append(d.strftime("%Y%m%d"))
+            d += timedelta(days=1)
+        room = self.config.rooms[0]
+
+        def arrival() -> float:
+            if comp.arrival == "normal":
+                return max(0.0, rng.gauss(comp.mean, comp.spread))
+            if comp.arrival == "uniform":
+                return max(0.0, comp.mean + rng.uniform(-comp.spread / 2, comp.spread / 2))
+            return rng.expovariate(1 / comp.mean) if comp.mean > 0 else 0.0
+
+        def client(name: str, at: float, order: list[str]):
+            time.sleep(max(0.0, at - time.time()))
+            got = 0
+            for ymd in order:
+                if got >= comp.picks:
+                    break
+                if not all(self.slot_free(room, ymd, c) for c in EVENING):
+                    continue
+                time.sleep(comp.service)
+                if self.try_book(name, room, ymd, list(EVENING)):
+                    got += 1
+
+        threads = []
+        for i in range(comp.clients):
+            order = days[:]
+            rng.shuffle(order)
+            t = threading.Thread(target=client, args=(f"rival{i}", release_at + arrival(), order), daemon=True)
+            t.start()
+            threads.append(t)
+        return threads
+
+
+# ====== HTML ======
+def _page(sess: dict, stage: str, body: str, message: str = "") -> str:
+    logout = (
+        "<a href=\"javascript:__doPostBack('logout','')\" class=\"btnGray\">ログアウト</a>"
+        if sess.get("user") else
+        "<a href=\"javascript:__doPostBack('login','')\" class=\"btnBlue\">ログイン</a>"
+    )
+    scripts = "".join(
+        f'<script type="text/javascript" src="{p}?LastUpdDate=20180817"></script>' for p in SCRIPT_PATHS
+    )
+    msg = f'<div class="message"><p>{html.escape(message)}</p></div>' if message else ""
+    return (
+        '<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">'
+        f"<title>豊島区公共施設予約システム</title>{scripts}</head><body>"
+        f'<form action="{PAGE_PATHS[stage]}" id="form1" method="post" autocomplete="off">'
+        f'<input name="__RequestVerificationToken" type="hidden" value="{sess["token"]}">'
+        '<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="">'
+        '<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="">'
+        f'<div class="header">{logout}</div>{msg}{body}</form></body></html>'
+    )
+
+
+def _nav_buttons(back: bool = True, next_label: str = "次へ進む") -> str:
+    parts = ['<div class="btn">']
+    if back:
+        parts.append("<a href=\"javascript:__doPostBack('prev','')\" class=\"btnGray\">戻る</a>")
+    parts.append(f"<a href=\"javascript:__doPostBack('next','')\" class=\"btnBlue\">{next_label}</a>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def render_modeselect(state: SimState, sess: dict) -> str:
+    cats = [(10, "区民集会室・区民ひろば"), (18, state.config.facility), (19, "ふるさと千川ひろば"), (20, "スポーツ施設")]
+    items = "".join(
+        f'<li><input type="button" name="command" id="category_{cid}" value="{html.escape(name)}" '
+        f"onclick=\"__doPostBack('ssCategory','{cid}');\" class=\"btnSky\"></li>"
+        for cid, name in cats
+    )
+    return _page(sess, "modeselect", f'<div class="category"><ul>{items}</ul></div>')
+
+
+def render_login(state: SimState, sess: dict, message: str = "") -> str:
+    body = (
+        '<div class="login">'
+        '<input type="text" id="userID" name="userID" value="">'
+        '<input type="password" id="passWord" name="passWord" value="">'
+        "<a href=\"javascript:__doPostBack('btnLogin','')\" class=\"btnBlue\">ログイン</a>"
+        "</div>"
+    )
+    return _page(sess, "login", body, message)
+
+
+def _checkbox_table(name: str, labels: list[str]) -> str:
+    rows = "".join(
+        f'<tr><td class="shisetsu toggle"><input type="checkbox" name="{name}" id="{name}_{i}" value="{i}">'
+        f'<label for="{name}_{i}">{html.escape(lab)}</label></td></tr>'
+        for i, lab in enumerate(labels)
+    )
+    return f'<table id="shisetsutbl"><tbody>{rows}</tbody></table>'
+
+
+def render_facility(state: SimState, sess: dict, message: str = "") -> str:
+    return _page(sess, "facility", _checkbox_table("checkShisetsu", [state.config.facility]) + _nav_buttons(), message)
+
+
+def render_rooms(state: SimState, sess: dict, message: str = "") -> str:
+    return _page(sess, "rooms", _checkbox_table("checkShitsujyo", list(state.config.rooms)) + _nav_buttons(), message)
+
+
+def _calendar_days(sess: dict) -> list[date]:
+    start = sess["cal_start"]
+    if sess["period"] == "1month":
+        first = date(start.year, start.month, 1)
+        end = _month_add(first, 1)
+    else:
+        first, end = start, start + timedelta(days=14)
+    days, d = [], first
+    while d < end:
+        days.append(d)
+        d += timedelta(days=1)
+    return days
+
+
+def render_calendar(state: SimState, sess: dict, message: str = "") -> str:
+    days = _calendar_days(sess)
+    head = f'<th class="month">{days[0].year}年{days[0].month}月</th>' + "".join(
+        f"<th>{d.day}<br>{WEEKDAY_JA[d.weekday()]}</th>" for d in days
+    )
+    rows = []
+    for ri, room in enumerate(sess["rooms"]):
+        cells = [f'<td class="shisetsu">{html.escape(room)}</td>']
+        for d in days:
+            ymd = d.strftime("%Y%m%d")
+            mark = state.day_mark(room, d)
+            cid = f"checkdate_{ri}_{ymd}"
+            if mark in ("○", "△"):
+                cells.append(
+                    f'<td><input type="checkbox" name="checkdate" id="{cid}" value="{ymd}_{ri}">'
+                    f'<label for="{cid}">{mark}</label></td>'
+                )
+            else:
+                cells.append(f'<td><input type="checkbox" name="checkdate" id="{cid}" value="{ymd}_{ri}" disabled>'
+                             f'<label for="{cid}">{mark}</label></td>')
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    start = sess["cal_start"]
+    one_month = "checked" if sess["period"] == "1month" else ""
+    two_week = "" if one_month else "checked"
+    controls = (
+        '<div class="period">'
+        f'<input type="text" id="dpStartDate" name="textDate" value="{start.year}/{start.month}/{start.day}">'
+        f'<input type="radio" id="radioPeriod2week" name="radioPeriod" value="2week" {two_week}>'
+        '<label for="radioPeriod2week">2週間</label>'
+        f'<input type="radio" id="radioPeriod1month" name="radioPeriod" value="1month" {one_month}>'
+        '<label for="radioPeriod1month">1ヶ月</label>'
+        "<input type=\"button\" id=\"btnHyoji\" value=\"表示\" onclick=\"__doPostBack('hyoji','')\">"
+        "<a href=\"javascript:__doPostBack('period','prev')\">前へ</a>"
+        "<a href=\"javascript:__doPostBack('period','next')\">次へ</a>"
+        "</div>"
+    )
+    table = (
+        f'<table class="calendar horizon toggle"><thead><tr>{head}</tr></thead>'
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+    return _page(sess, "calendar", controls + table + _nav_buttons(), message)
+
+
+def render_timeslot(state: SimState, sess: dict, message: str = "") -> str:
+    head = "<th></th>" + "".join(f"<th>{s}</th>" for s in SLOTS)
+    rows = []
+    for ri, (room, ymd) in enumerate(sess["picked_dates"]):
+        d = date(int(ymd[:4]), int(ymd[4:6]), int(ymd[6:8]))
+        cells = [f'<td class="shisetsu">{d.month}月{d.day}日({WEEKDAY_JA[d.weekday()]}) {html.escape(room)}</td>']
+        for ci in range(len(SLOTS)):
+            cid = f"checktime_{ri}_{ci}"
+            if state.slot_free(room, ymd, ci):
+                cells.append(
+                    f'<td><input type="checkbox" name="checktime" id="{cid}" value="{ymd}_{ri}_{ci}">'
+                    f'<label for="{cid}">○</label></td>'
+                )
+            else:
+                cells.append("<td>×</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    table = (
+        f'<table class="calendar horizon toggle"><thead><tr>{head}</tr></thead>'
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+    return _page(sess, "timeslot", table + _nav_buttons(), message)
+
+
+def render_form(state: SimState, sess: dict, message: str = "") -> str:
+    purposes = ["バドミントン", "卓球", "軽スポーツ"]
+    radios = "".join(
+        f'<input type="radio" name="mokuteki" id="mokuteki_{i}" value="{i}">'
+        f'<label for="mokuteki_{i}">{p}</label>'
+        for i, p in enumerate(purposes)
+    )
+    body = (
+        '<div class="form">'
+        '<input type="text" name="spinnerNinzu" id="spinnerNinzu" value="">'
+        f'<div id="mokuteki">{radios}</div>'
+        '<input type="text" name="txtYykShousai" value="">'
+        '<input type="text" name="txtContents1" value="">'
+        '<input type="text" name="txtContents2" value="">'
+        '<input type="text" name="txtContents3" value="">'
+        "</div>"
+    )
+    return _page(sess, "form", body + _nav_buttons(next_label="確定"), message)
+
+
+def render_confirm(state: SimState, sess: dict, message: str = "") -> str:
+    items = "".join(f"<li>{ymd} {html.escape(room)} {len(cols)}枠</li>" for room, ymd, cols in sess["picked_slots"])
+    return _page(sess, "confirm", f'<div class="confirm"><p>申込内容確認</p><ul>{items}</ul></div>'
+                 + _nav_buttons(next_label="申込"), message)
+
+
+def render_done(state: SimState, sess: dict, message: str = "") -> str:
+    items = "".join(f"<li>{ymd} {html.escape(room)}</li>" for room, ymd in sess.get("done", []))
+    return _page(sess, "done", f'<div class="complete"><p>申込が完了しました</p><ul>{items}</ul></div>', message)
+
+
+def render_timeout(state: SimState, sess: dict) -> str:
+    return _page(sess, "modeselect", '<div class="message"><p>セッションタイムアウトしました。</p></div>')
+
+
+RENDER = {
+    "modeselect": render_modeselect,
+    "login": render_login,
+    "facility": render_facility,
+    "rooms": render_rooms,
+    "calendar": render_calendar,
+    "timeslot": render_timeslot,
+    "form": render_form,
+    "confirm": render_confirm,
+    "done": render_done,
+}
+
+
+# ====== ポストバック処理 ======
+def handle_postback(state: SimState, sess: dict, form: list[tuple[str, str]]) -> str:
+    """現在の画面と __EVENTTARGET から次の画面を決めて HTML を返す"""
+    fields = dict(form)
+    target = fields.get("__EVENTTARGET", "")
+    arg = fields.get("__EVENTARGUMENT", "")
+    checked = lambda name: [v for k, v in form if k == name]  # noqa: E731
+    stage = sess["stage"]
+
+    def go(new_stage: str, message: str = "") -> str:
+        sess["stage"] = new_stage
+        return RENDER[new_stage](state, sess, message) if message else RENDER[new_stage](state, sess)
+
+    if target == "logout":
+        sess["user"] = None
+        return go("modeselect")
+    if stage == "modeselect":
+        if target == "login":
+            return go("login")
+        if target == "ssCategory" and arg == "18":
+            return go("facility")
+        return go("modeselect")
+    if stage == "login":
+        if target == "btnLogin":
+            if fields.get("userID") and fields.get("passWord"):
+                sess["user"] = fields["userID"]
+                return go("modeselect")
+            return go("login", "利用者IDまたはパスワードが違います")
+        return go("login")
+    if not sess.get("user"):
+        return go("modeselect")
+
+    if stage == "facility":
+        if target == "prev":
+            return go("modeselect")
+        if target == "next":
+            return go("rooms") if checked("checkShisetsu") else go("facility", "施設を選択してください")
+        return go("facility")
+    if stage == "rooms":
+        if target == "prev":
+            return go("facility")
+        if target == "next":
+            picked = [state.config.rooms[int(i)] for i in checked("checkShitsujyo")]
+            if not picked:
+                return go("rooms", "室場を選択してください")
+            sess.update(rooms=picked, cal_start=state.config.today, period="2week")
+            return go("calendar")
+        return go("rooms")
+    if stage == "calendar":
+        if target == "hyoji":
+            try:
+                y, m, d = (int(x) for x in fields.get("textDate", "").split("/"))
+                sess["cal_start"] = date(y, m, d)
+            except ValueError:
+                return go("calendar", "日付が正しくありません")
+            sess["period"] = "1month" if fields.get("radioPeriod") == "1month" else "2week"
+            return go("calendar")
+        if target == "period":
+            step = 1 if arg == "next" else -1
+            if sess["period"] == "1month":
+                sess["cal_start"] = _month_add(sess["cal_start"], step)
+            else:
+                sess["cal_start"] = sess["cal_start"] + timedelta(days=14 * step)
+            return go("calendar")
+        if target == "prev":
+            return go("rooms")
+        if target == "next":
+            picked = []
+            for v in checked("checkdate"):
+                ymd, ri = v.split("_")
+                picked.append((sess["rooms"][int(ri)], ymd))
+            if not picked:
+                return go("calendar", "日付を選択してください")
+            sess["picked_dates"] = picked
+            return go("timeslot")
+        return go("calendar")
+    if stage == "timeslot":
+        if target == "prev":
+            return go("calendar")
+        if target == "next":
+            by_row: dict[int, list[int]] = {}
+            for v in checked("checktime"):
+                _, ri, ci = v.split("_")
+                by_row.setdefault(int(ri), []).append(int(ci))
+            if not by_row:
+                return go("timeslot", "時間帯を選択してください")
+            sess["picked_slots"] = [
+                (sess["picked_dates"][ri][0], sess["picked_dates"][ri][1], cols) for ri, cols in sorted(by_row.items())
+            ]
+            return go("form")
+        return go("timeslot")
+    if stage == "form":
+        if target == "prev":
+            return go("timeslot")
+        if target == "next":
+            if not fields.get("spinnerNinzu") or "mokuteki" not in fields:
+                return go("form", "利用人数と使用目的を入力してください")
+            return go("confirm")
+        return go("form")
+    if stage == "confirm":
+        if target == "prev":
+            return go("form")
+        if target == "next":
+            done, failed = [], []
+            for room, ymd, cols in sess["picked_slots"]:
+                if state.try_book(sess["user"], room, ymd, cols):
+                    done.append((room, ymd))
+                else:
+                    failed.append(ymd)
+            sess["done"] = done
+            if failed:
+                return go("done", f"既に予約されています: {', '.join(failed)}")
+            return go("done")
+        return go("confirm")
+    return go("modeselect")
+
+
+class SimHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: SimState = None  # make_server でサブクラスに設定する
+
+    def log_message(self, *args):
+        pass
+
+    def _session(self) -> tuple[str, dict, bool]:
+        cookie = self.headers.get("Cookie") or ""
+        sid = ""
+        for part in cookie.split(";"):
+            k, _, v = part.strip().partition("=")
+            if k == "ASP.NET_SessionId":
+                sid = v
+        sess = self.state.sessions.get(sid)
+        if sess is None:
+            sid, sess = self.state.new_session()
+            sess["token"] = secrets.token_hex(16)
+            return sid, sess, True
+        expired = time.time() - sess["touched"] > self.state.config.session_timeout
+        sess["touched"] = time.time()
+        return sid, sess, expired
+
+    def _delay(self, base: float):
+        if base or self.state.config.jitter:
+            time.sleep(base + random.uniform(0, self.state.config.jitter))
+
+    def _send(self, status: int, body: str, content_type: str = "text/html; charset=utf-8",
+              sid: str = "", cache: bool = False):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if cache:
+            self.send_header("Cache-Control", "public, max-age=86400")
+            self.send_header("ETag", static_etag(body))
+        else:
+            self.send_header("Cache-Control", "no-cache")
+        if sid:
+            self.send_header("Set-Cookie", f"ASP.NET_SessionId={sid}; path=/; HttpOnly")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self._send(200, "")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path in SCRIPT_PATHS:
+            self._delay(self.state.config.static_latency)
+            with self.state.lock:
+                self.state.static_count += 1
+            if self.headers.get("If-None-Match") == static_etag(SCRIPT_PATHS[path]):
+                with self.state.lock:
+                    self.state.not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", static_etag(SCRIPT_PATHS[path]))
+                self.end_headers()
+                return
+            self._send(200, SCRIPT_PATHS[path], "application/javascript", cache=True)
+            return
+        if path == "/favicon.ico":
+            self._send(404, "")
+            return
+        self._delay(self.state.config.latency)
+        with self.state.lock:
+            self.state.request_count += 1
+        sid, sess, expired = self._session()
+        # 施設・部屋を選んだ後のセッションならカレンダーの URL を直接開ける（検索条件はサーバー側に残る）
+        if path == PAGE_PATHS["calendar"] and not expired and sess.get("user") and sess.get("rooms"):
+            sess["stage"] = "calendar"
+            self._send(200, render_calendar(self.state, sess), sid=sid)
+            return
+        sess["stage"] = "modeselect"
+        self._send(200, render_modeselect(self.state, sess), sid=sid)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8")
+        self._delay(self.state.config.latency)
+        with self.state.lock:
+            self.state.request_count += 1
+        sid, sess, expired = self._session()
+        if expired:
+            sess.update(stage="modeselect", user=None)
+            self._send(200, render_timeout(self.state, sess), sid=sid)
+            return
+        form = parse_qsl(raw, keep_blank_values=True)
+        if dict(form).get("__RequestVerificationToken") != sess["token"]:
+            self._send(200, render_modeselect(self.state, sess), sid=sid)
+            return
+        self._send(200, handle_postback(self.state, sess, form), sid=sid)
+
+
+def make_server(config: SimConfig, host: str = "127.0.0.1", port: int = 0):
+    """シミュレーターを作る（serve_forever は呼び出し側で）。戻り値: (server, state, base_url)"""
+    state = SimState(config)
+    handler = type("BoundSimHandler", (SimHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    base_url = f"http://{host}:{server.server_port}{MODESELECT_PATH}"
+    return server, state, base_url
+
+
+def start_in_thread(config: SimConfig, host: str = "127.0.0.1", port: int = 0):
+    """バックグラウンドスレッドで起動する。戻り値: (server, state, base_url)"""
+    server, state, base_url = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, base_url
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="pf489 予約サイトのローカルシミュレーター")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8489)
+    parser.add_argument("--latency", type=float, default=0.1, help="ポストバック1回あたりの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に足す乱数の幅（秒）")
+    parser.add_argument("--static-latency", type=float, default=0.02, help="静的ファイルの遅延（秒）")
+    parser.add_argument("--today", default=None, help="サーバー上の今日 (YYYY-MM-DD)")
+    parser.add_argument("--busy", default="", help="埋まっている日: 20261102=x,20261109=e,...")
+    parser.add_argument("--release-in", type=float, default=None,
+                        help="起動から N 秒後に翌月分の受付を開始する")
+    parser.add_argument("--competitors", type=int, default=0, help="受付開始時に押し寄せる他団体の数")
+    parser.add_argument("--arrival", choices=["exp", "normal", "uniform"], default="exp",
+                        help="他団体の到着時刻の分布")
+    parser.add_argument("--arrival-mean", type=float, default=3.0, help="受付開始から到着までの平均（秒）")
+    parser.add_argument("--arrival-spread", type=float, default=2.0, help="normal の標準偏差 / uniform の幅（秒）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = SimConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        static_latency=args.static_latency,
+        busy=parse_availability(args.busy),
+    )
+    if args.today:
+        config.today = date.fromisoformat(args.today)
+    if args.release_in is not None:
+        config.release_at = time.time() + args.release_in
+    server, state, base_url = make_server(config, args.host, args.port)
+    print(f"pf489 simulator: {base_url}")
+    if args.competitors:
+        target = _month_add(config.today, 1)
+        state.start_competitors(
+            CompetitorConfig(clients=args.competitors, arrival=args.arrival,
+                             mean=args.arrival_mean, spread=args.arrival_spread),
+            config.release_at or time.time(), target.year, target.month,
+        )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
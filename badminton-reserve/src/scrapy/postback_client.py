@@ -0,0 +1,551 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP レベルのポストバックエンジン
+
+ログイン〜対象月カレンダーまではブラウザで進め、そこから先の
+日付チェック → 時間帯(checktime) → 申請フォーム → 確定 → 申込 を
+Cookie とフォームの hidden 値を引き継いだ軽量 HTTP クライアントで直接ポストする。
+DOM の描画・スクリプト実行を挟まないため、1日あたりの予約が数百ms で終わる。
+
+申込を送る前に想定外のページが返ってきた場合は None を返し、呼び出し側（HttpBooker）が
+ブラウザをカレンダーに戻して従来の Playwright 経路でやり直す。申込を送った後で結果が
+判別できない場合（セッション切れ・完了の文言がない・通信エラー）は、受け付けられている
+可能性があるので ar.APPLY_UNCLEAR を返し、やり直さない。
+
+Usage:
+    python auto_reserve.py --engine http
+"""
+
+import gzip
+import http.client
+import re
+import time
+from datetime import datetime
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import auto_reserve as ar
+from auto_reserve import OK_MARKS, SLOT_RE, WEEKDAY_JA, debug, mark_once, mentions_day, norm_wave, room_matches
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+# _READ_MESSAGES_JS（auto_reserve.py）と同じメッセージ欄のクラス
+MESSAGE_CLASSES = ("message", "error", "errMsg", "validation-summary-errors", "field-validation-error")
+
+
+# ====== 軽量 HTML ツリー ======
+class Node:
+    __slots__ = ("tag", "attrs", "children", "parent", "text")
+
+    def __init__(self, tag: str, attrs: dict, parent=None):
+        self.tag = tag
+        self.attrs = attrs
+        self.children: list = []
+        self.parent = parent
+        self.text: list[str] = []
+
+    def iter(self, tag: str | None = None):
+        """自身を含む子孫ノードを文書順に返す"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if tag is None or node.tag == tag:
+                yield node
+            stack.extend(reversed(node.children))
+
+    def text_content(self) -> str:
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            parts.extend(node.text)
+            stack.extend(reversed(node.children))
+        return "".join(parts)
+
+    def has_class(self, *names: str) -> bool:
+        classes = (self.attrs.get("class") or "").split()
+        return all(n in classes for n in names)
+
+    def closest(self, tag: str):
+        node = self.parent
+        while node is not None and node.tag != tag:
+            node = node.parent
+        return node
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("#root", {})
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, {k: (v if v is not None else "") for k, v in attrs}, self.stack[-1])
+        self.stack[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        node = Node(tag, {k: (v if v is not None else "") for k, v in attrs}, self.stack[-1])
+        self.stack[-1].children.append(node)
+
+    def handle_endtag(self, tag):
+        # 閉じ忘れがあっても、対応する開始タグまで巻き戻す
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        if self.stack[-1].tag not in ("script", "style"):
+            self.stack[-1].text.append(data)
+
+
+def parse_html(html: str) -> Node:
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+class Document:
+    """1ページ分の HTML とフォーム状態"""
+
+    def __init__(self, url: str, html: str):
+        self.url = url
+        self.html = html
+        self.root = parse_html(html)
+        self.form = next(self.root.iter("form"), None)
+        self._by_id = {n.attrs["id"]: n for n in self.root.iter() if "id" in n.attrs}
+        self._labels = {n.attrs["for"]: n for n in self.root.iter("label") if n.attrs.get("for")}
+
+    def by_id(self, node_id: str):
+        return self._by_id.get(node_id)
+
+    def label_for(self, node_id: str):
+        return self._labels.get(node_id)
+
+    def inputs(self, name: str) -> list[Node]:
+        return [n for n in self.root.iter("input") if n.attrs.get("name") == name]
+
+    def has_input(self, name: str) -> bool:
+        return any(n.attrs.get("name") == name for n in self.root.iter("input"))
+
+    def calendar_tables(self) -> list[Node]:
+        return [t for t in self.root.iter("table") if t.has_class("calendar", "horizon", "toggle")]
+
+    def is_session_timeout(self) -> bool:
+        return "セッションタイムアウト" in self.html and "ログアウト" not in self.html
+
+    def messages(self) -> str:
+        """メッセージ欄（MESSAGE_CLASSES）の文言を改行区切りで返す"""
+        return "\n".join(
+            n.text_content() for n in self.root.iter()
+            if any(n.has_class(c) for c in MESSAGE_CLASSES)
+        )
+
+    def action_url(self) -> str:
+        action = self.form.attrs.get("action") if self.form is not None else ""
+        return urljoin(self.url, action or self.url)
+
+    def form_fields(self) -> list[tuple[str, str]]:
+        """ブラウザが送信するのと同じ「成功したコントロール」を文書順に集める"""
+        if self.form is None:
+            return []
+        fields = []
+        for node in self.form.iter():
+            name = node.attrs.get("name")
+            if not name or "disabled" in node.attrs:
+                continue
+            if node.tag == "input":
+                typ = (node.attrs.get("type") or "text").lower()
+                if typ in ("checkbox", "radio"):
+                    if "checked" in node.attrs:
+                        fields.append((name, node.attrs.get("value", "on")))
+                elif typ not in ("button", "submit", "image", "reset", "file"):
+                    fields.append((name, node.attrs.get("value", "")))
+            elif node.tag == "textarea":
+                fields.append((name, node.text_content()))
+            elif node.tag == "select":
+                options = list(node.iter("option"))
+                chosen = [o for o in options if "selected" in o.attrs] or options[:1]
+                for o in chosen:
+                    fields.append((name, o.attrs.get("value", o.text_content().strip())))
+        return fields
+
+
+def _row_head_text(row: Node) -> str:
+    for cell in row.children:
+        if cell.tag in ("td", "th") and cell.has_class("shisetsu"):
+            return cell.text_content().strip()
+    return ""
+
+
+def _read_mark(doc: Document, inp: Node) -> str:
+    """checkbox に対応するラベルから空きマークを読む（テキスト / title / img alt）"""
+    lab = doc.label_for(inp.attrs.get("id", ""))
+    if lab is None:
+        return ""
+    valid = {"○", "△", "×", "―"}
+    t = lab.text_content().strip()
+    if t in valid:
+        return t
+    for attr in ("title", "aria-label"):
+        v = (lab.attrs.get(attr) or "").strip()
+        if v in valid:
+            return v
+    for img in lab.iter("img"):
+        alt = (img.attrs.get("alt") or "").strip()
+        if alt in valid:
+            return alt
+    return ""
+
+
+def _set_checked(node: Node, checked: bool = True):
+    if checked:
+        node.attrs["checked"] = "checked"
+    else:
+        node.attrs.pop("checked", None)
+
+
+# ====== HTTP クライアント ======
+class PostbackClient:
+    """ブラウザから引き継いだ Cookie とフォーム状態で __doPostBack を直接再現する"""
+
+    def __init__(self, url: str, html: str, cookies: dict[str, str], user_agent: str = ""):
+        self.doc = Document(url, html)
+        self.cookies = dict(cookies)
+        self.user_agent = user_agent
+        self.posted = 0  # 送信したポストバック数（0 ならサーバー側の画面は動いていない）
+        self.applied = False  # 申込（確認画面からの next）を送信したか
+        self._conn = None
+        self._netloc = ""
+
+    @classmethod
+    def from_page(cls, page) -> "PostbackClient":
+        host = urlsplit(page.url).hostname or ""
+        cookies = {
+            c["name"]: c["value"]
+            for c in page.context.cookies()
+            if host.endswith(c.get("domain", "").lstrip("."))
+        }
+        ua = page.evaluate("navigator.userAgent")
+        return cls(page.url, page.content(), cookies, ua)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self, parts):
+        if self._conn is None or self._netloc != parts.netloc:
+            self.close()
+            cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            self._conn = cls(parts.netloc, timeout=15)
+            self._netloc = parts.netloc
+        return self._conn
+
+    def _request(self, method: str, url: str, body: bytes | None = None, referer: str = "") -> tuple[str, str]:
+        """1リクエスト送信（リダイレクトは GET で追従）。戻り値: (最終URL, HTML)"""
+        for _ in range(5):
+            parts = urlsplit(url)
+            path = parts.path + (f"?{parts.query}" if parts.query else "")
+            headers = {
+                "User-Agent": self.user_agent or "Mozilla/5.0",
+                "Accept": "text/html,application/xhtml+xml",
+                "Accept-Encoding": "gzip",
+                "Accept-Language": "ja-JP,ja;q=0.9",
+            }
+            if referer:
+                headers["Referer"] = referer
+            if self.cookies:
+                headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+            if body is not None:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+                headers["Origin"] = f"{parts.scheme}://{parts.netloc}"
+            try:
+                conn = self._connection(parts)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # keep-alive 切れは1回だけ張り直して再送
+                self.close()
+                conn = self._connection(parts)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            data = resp.read()
+            for raw in resp.msg.get_all("Set-Cookie") or []:
+                jar = SimpleCookie()
+                jar.load(raw)
+                for name, morsel in jar.items():
+                    self.cookies[name] = morsel.value
+            if resp.status in (301, 302, 303, 307, 308):
+                referer = url
+                url = urljoin(url, resp.getheader("Location") or url)
+                if resp.status in (301, 302, 303):
+                    method, body = "GET", None
+                continue
+            if resp.status >= 400:
+                raise RuntimeError(f"HTTP {resp.status} {url}")
+            if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+                data = gzip.decompress(data)
+            m = re.search(r"charset=([\w-]+)", resp.getheader("Content-Type") or "")
+            return url, data.decode(m.group(1) if m else "utf-8", errors="replace")
+        raise RuntimeError("リダイレクトが多すぎます")
+
+    def postback(self, target: str, argument: str = "", overrides: dict[str, str] | None = None) -> Document:
+        """__doPostBack(target, argument) 相当のフォーム送信を行い、現在のページを更新する"""
+        fields = [
+            (k, v) for k, v in self.doc.form_fields()
+            if k not in ("__EVENTTARGET", "__EVENTARGUMENT") and k not in (overrides or {})
+        ]
+        fields = [("__EVENTTARGET", target), ("__EVENTARGUMENT", argument)] + fields
+        fields += list((overrides or {}).items())
+        body = urlencode(fields, encoding="utf-8").encode("ascii")
+        self.posted += 1
+        url, html = self._request("POST", self.doc.action_url(), body, referer=self.doc.url)
+        self.doc = Document(url, html)
+        return self.doc
+
+    # ====== カレンダー ======
+    def calendar_year_month(self) -> tuple:
+        for t in self.doc.calendar_tables():
+            m = ar.MONTH_RE.search(t.text_content())
+            if m:
+                return int(m.group(1)), int(m.group(2))
+        return None, None
+
+    def navigate_to_month(self, target: datetime, max_hops: int = 6) -> bool:
+        want = (target.year, target.month)
+        have = self.calendar_year_month()
+        hops = 0
+        while have != want and hops < max_hops and all(have):
+            self.postback("period", "next" if have < want else "prev")
+            have = self.calendar_year_month()
+            hops += 1
+        return have == want
+
+    def read_all_availability(self, room_label: str) -> dict[str, str]:
+        result = {}
+        for inp in self.doc.inputs("checkdate"):
+            row = inp.closest("tr")
+            if row is None:
+                continue
+            if not room_matches(_row_head_text(row), room_label):
+                continue
+            mark = _read_mark(self.doc, inp)
+            if mark:
+                result[(inp.attrs.get("value") or "")[:8]] = mark
+        return result
+
+    def check_date(self, d: datetime, room_label: str) -> bool:
+        """カレンダーの指定日の checkdate をオンにする（空きがある部屋行のみ）"""
+        ymd = d.strftime("%Y%m%d")
+        for inp in self.doc.inputs("checkdate"):
+            if not (inp.attrs.get("value") or "").startswith(ymd):
+                continue
+            row = inp.closest("tr")
+            if row is None or not room_matches(_row_head_text(row), room_label):
+                continue
+            if _read_mark(self.doc, inp) in OK_MARKS:
+                _set_checked(inp)
+                return True
+        return False
+
+    # ====== 時間帯 ======
+    def check_time_slots(self, room_label: str, wanted_slots: list[str]) -> bool:
+        """時間帯グリッドの部屋行で WANTED_SLOTS の checktime を全てオンにする"""
+        wanted_norm = {norm_wave(s) for s in wanted_slots}
+        for table in self.doc.calendar_tables():
+            head_cells = [c for tr in table.iter("thead") for c in tr.iter("th")]
+            cols = []
+            for i, th in enumerate(head_cells):
+                header_text = norm_wave(th.text_content())
+                m = SLOT_RE.search(header_text)
+                if not m:
+                    continue
+                slot = f"{int(m.group(1)):02d}:{m.group(2)}~{int(m.group(3)):02d}:{m.group(4)}"
+                if norm_wave(slot) in wanted_norm or header_text in wanted_norm:
+                    cols.append(i)
+            for tbody in table.iter("tbody"):
+                for row in tbody.iter("tr"):
+                    if not room_matches(_row_head_text(row), room_label):
+                        continue
+                    cells = [c for c in row.children if c.tag == "td"]
+                    if len(cols) < len(wanted_slots):
+                        return False
+                    picked = []
+                    for ci in cols:
+                        if ci >= len(cells):
+                            continue
+                        cell = cells[ci]
+                        if not any(mk in cell.text_content() for mk in OK_MARKS):
+                            return False
+                        boxes = [n for n in cell.iter("input") if n.attrs.get("name") == "checktime"]
+                        if not boxes:
+                            return False
+                        picked.append(boxes[0])
+                    if len(picked) != len(wanted_slots):
+                        return False
+                    for box in picked:
+                        _set_checked(box)
+                    return True
+        return False
+
+    # ====== 申請フォーム ======
+    def fill_application_form(self) -> dict[str, str]:
+        """fill_application_form と同じ値をフォームに入れる。戻り値: 送信時に上書きする値"""
+        overrides = {
+            "spinnerNinzu": ar.NINZU,
+            "txtYykShousai": ar.MOKUTEKI,
+            "txtContents1": "三廉康平",
+            "txtContents2": "０",
+            "txtContents3": "なし",
+        }
+        mokuteki = self.doc.by_id("mokuteki")
+        if mokuteki is not None:
+            labels = list(mokuteki.iter("label"))
+            for keyword in ("バドミントン", "軽スポーツ", "軽運動"):
+                lab = next((lb for lb in labels if keyword in lb.text_content()), None)
+                radio = self.doc.by_id(lab.attrs.get("for", "")) if lab is not None else None
+                if radio is not None:
+                    for other in self.doc.inputs(radio.attrs.get("name", "")):
+                        _set_checked(other, other is radio)
+                    break
+        return overrides
+
+
+# ====== 予約フロー ======
+def book_single_day_http(client: PostbackClient, target: datetime,
+                         room: str | None = None, slots: list[str] | None = None) -> bool | None:
+    """
+    カレンダー上の client で1日分を予約する。room / slots を省略すると ar.ROOM_LABEL / ar.WANTED_SLOTS。
+    戻り値: True=申込完了 / False=空きなし・申込不成立 / None=申込前の想定外（要フォールバック）/
+    ar.APPLY_UNCLEAR=申込ポストバックの後で結果が判別できない（やり直さない）
+    False のとき client がカレンダーにいなければ（確認画面・結果画面）HttpBooker が作り直す。
+    """
+    room = ar.ROOM_LABEL if room is None else room
+    slots = ar.WANTED_SLOTS if slots is None else slots
+    ymd = target.strftime("%Y-%m-%d")
+    label = f"{ymd}({WEEKDAY_JA[target.weekday()]})"
+
+    if not client.check_date(target, room):
+        debug(f"[http] {label} はカレンダー上で空きなし")
+        return False
+    mark_once("first_click")
+
+    doc = client.postback("next")
+    if doc.is_session_timeout() or not doc.has_input("checktime"):
+        debug(f"[http] {label} 時間帯画面に遷移できません")
+        return None
+
+    if not client.check_time_slots(room, slots):
+        debug(f"[http] {label} 18:30-21:30 が空いていない → 戻る")
+        doc = client.postback("prev")
+        return False if doc.has_input("checkdate") else None
+
+    doc = client.postback("next")
+    if not doc.has_input("spinnerNinzu"):
+        debug(f"[http] {label} 申請フォームに遷移できません")
+        return None
+    overrides = client.fill_application_form()
+
+    doc = client.postback("next", overrides=overrides)
+    if doc.is_session_timeout() or doc.has_input("spinnerNinzu"):
+        # フォームが再表示された = 入力エラー
+        debug(f"[http] {label} 確定できません（入力エラーの可能性）")
+        return None
+    debug(f"[http] {label} 確定 → 申込確認画面")
+
+    if ar.DRY_RUN:
+        debug(f"[http] {label} DRY_RUN: 確認画面で停止（申込しません）")
+        return False
+
+    # ここから先は申込を送信済み。受け付けられた可能性があるので、判別できなくても None にはしない
+    client.applied = True
+    doc = client.postback("next")
+    if doc.is_session_timeout():
+        debug(f"[http] {label} 申込後にセッションタイムアウト → 結果不明")
+        return ar.APPLY_UNCLEAR
+    # apply_batch と同じく、メッセージ欄にこの日が出ていれば不成立（完了画面の文言より先に見る）
+    if mentions_day(doc.messages(), target):
+        debug(f"[http] {label} 申込できませんでした: {doc.messages().strip()}")
+        return False
+    if "完了" not in doc.root.text_content():
+        debug(f"[http] {label} 申込結果が判別できません")
+        return ar.APPLY_UNCLEAR
+    debug(f"[http] {label} 申込完了")
+    return True
+
+
+class HttpBooker:
+    """
+    book_days から1日ずつ呼ばれる HTTP 経路の窓口。
+    クライアントはカレンダーにいる間だけ使い回し、申込完了・DRY_RUN・想定外のページの後は
+    ブラウザ側のカレンダーを作り直してから新しいクライアントを作る。
+    """
+
+    def __init__(self, page, target_month: datetime):
+        self.page = page
+        self.target_month = target_month
+        self.client: PostbackClient | None = None
+        self.browser_stale = False  # HTTP 側で画面を進めたのでブラウザの画面は古い
+
+    def _ensure_client(self) -> PostbackClient:
+        if self.client is None:
+            if self.browser_stale:
+                ar.restore_calendar(self.page, self.target_month)
+                self.browser_stale = False
+            self.client = PostbackClient.from_page(self.page)
+        return self.client
+
+    def _drop_client(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+
+    def _save_diag(self, label: str):
+        """HTTP 側で最後に受け取ったページを診断情報として保存する（ブラウザの画面は古いので使わない）"""
+        if ar.DIAG_LEVEL < 1 or self.client is None:
+            return
+        name = f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        ar.enqueue_diag(ar.LOG_DIR / f"{name}.html", self.client.doc.html)
+        debug(f"[diag] saved {name}")
+
+    def book(self, day: datetime) -> bool | str:
+        """戻り値: True / False / ar.APPLY_UNCLEAR（申込送信後に結果不明。フォールバックしない）"""
+        t0 = time.perf_counter()
+        try:
+            client = self._ensure_client()
+            t = ar.page_target(self.page)
+            result = book_single_day_http(client, day, t.room, t.slots)
+        except Exception as e:
+            debug(f"[http] 例外: {e}")
+            # 申込（確認画面からの next）を送った後の例外なら結果不明
+            result = ar.APPLY_UNCLEAR if self.client is not None and self.client.applied else None
+        if result is not None:
+            debug(f"[http] {day.strftime('%Y-%m-%d')} {time.perf_counter() - t0:.3f}s "
+                  f"{'OK' if result else 'NG'}")
+        if result is True:
+            # book_days がこの後 restore_calendar でブラウザを戻す
+            self._drop_client()
+            return True
+        if result == ar.APPLY_UNCLEAR:
+            self._save_diag(f"apply_unclear_{day.strftime('%Y-%m-%d')}")
+            self._drop_client()
+            self.browser_stale = True
+            return ar.APPLY_UNCLEAR
+        if result is False:
+            if self.client is not None and self.client.posted:
+                self.browser_stale = True
+            if self.client is not None and not self.client.doc.has_input("checkdate"):
+                # 確認画面（DRY_RUN）や申込結果画面に止まっているので、次はブラウザから作り直す
+                self._drop_client()
+            return False
+
+        # フォールバック（申込を送る前の失敗だけ）: ブラウザをカレンダーに戻して従来の経路でやり直す
+        self._drop_client()
+        debug(f"[http] {day.strftime('%Y-%m-%d')} → Playwright 経路にフォールバック")
+        ar.restore_calendar(self.page, self.target_month)
+        self.browser_stale = False
+        return ar.book_single_day(self.page, day)
@@ -0,0 +1,6 @@
+# conftest.py
+# scrapy 直下のモジュール（auto_reserve 等）をテストから import できるようにする
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,68 @@
+# test_asset_cache.py
+# 静的ファイルのディスクキャッシュ: 本文の照合・容量超過時の LRU 削除・再確認の対象
+import asset_cache
+from asset_cache import AssetCache
+
+JQ = "https://example.test/js/jquery.js?LastUpdDate=1"
+SITE = "https://example.test/js/site.js?LastUpdDate=1"
+HEADERS = {"Content-Type": "text/javascript", "ETag": '"abc"', "Last-Modified": "Thu, 01 Oct 2026 00:00:00 GMT"}
+
+
+def test_store_and_lookup_survive_reopen(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.store(JQ, 200, HEADERS, b"var $ = 1;")
+    entry, body = AssetCache(tmp_path).lookup(JQ)
+    assert body == b"var $ = 1;"
+    assert entry["headers"] == {"content-type": "text/javascript", "etag": '"abc"',
+                                "last-modified": "Thu, 01 Oct 2026 00:00:00 GMT"}
+    assert cache.validators(entry) == {"if-none-match": '"abc"',
+                                       "if-modified-since": "Thu, 01 Oct 2026 00:00:00 GMT"}
+
+
+def test_does_not_store_errors_or_no_store(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.store(JQ, 404, HEADERS, b"")
+    cache.store(SITE, 200, {"Cache-Control": "no-store"}, b"x")
+    assert cache.lookup(JQ) is None
+    assert cache.lookup(SITE) is None
+
+
+def test_corrupt_body_is_evicted(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.store(JQ, 200, HEADERS, b"var $ = 1;")
+    cache._body_path(cache._key(JQ)).write_bytes(b"var $ = 2;")
+    assert cache.lookup(JQ) is None
+    assert cache.stats["corrupt"] == 1
+    assert cache._key(JQ) not in cache.index
+    assert not cache._body_path(cache._key(JQ)).exists()
+
+
+def test_missing_body_is_evicted(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.store(JQ, 200, HEADERS, b"var $ = 1;")
+    cache._body_path(cache._key(JQ)).unlink()
+    assert cache.lookup(JQ) is None
+    assert cache._key(JQ) not in cache.index
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path):
+    cache = AssetCache(tmp_path, max_bytes=10)
+    cache.store(JQ, 200, HEADERS, b"12345")
+    cache.store(SITE, 200, HEADERS, b"12345")
+    cache.index[cache._key(SITE)]["used_at"] -= 100  # site.js の方が長く使われていない
+    cache.lookup(JQ)
+    cache.store("https://example.test/js/extra.js", 200, HEADERS, b"123")
+    assert cache.lookup(SITE) is None
+    assert cache.lookup(JQ) is not None
+    assert sum(e["size"] for e in cache.index.values()) <= 10
+
+
+def test_stale_entries_need_revalidation(tmp_path):
+    cache = AssetCache(tmp_path)
+    cache.store(JQ, 200, HEADERS, b"var $ = 1;")
+    cache.store(SITE, 200, HEADERS, b"site")
+    cache.index[cache._key(JQ)]["validated_at"] -= asset_cache.ASSET_CACHE_TTL + 1
+    assert cache.stale_urls() == [JQ]
+    cache.mark_validated(JQ)
+    assert cache.stale_urls() == []
+    assert cache.stats["revalidated"] == 1
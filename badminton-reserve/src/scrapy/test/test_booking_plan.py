@@ -0,0 +1,74 @@
+# test_booking_plan.py
+# BookingPlan: 1回のスナップショットから、1週1日・最大 max_days 週の計画を作り、結果で差し替える
+from datetime import datetime
+
+import auto_reserve as ar
+from auto_reserve import BookingPlan, Target
+
+# 2026年11月: 月曜 2, 9, 16, 23, 30 / 火曜 3, 10, 17, 24（3日は文化の日・23日は勤労感謝の日）
+TARGET = Target(name="test", weekdays=[0, 1], weeks=[3, 4, 5, 2, 1], max_days=5)
+
+
+def day(n: int) -> datetime:
+    return datetime(2026, 11, n)
+
+
+def marks(**kw) -> dict[str, str]:
+    return {f"202611{k[1:]}": v for k, v in kw.items()}
+
+
+def test_candidates_skip_holidays_and_booked_weeks():
+    days = ar.build_candidate_days(2026, 11, {1}, TARGET.weekdays, TARGET.weeks)
+    assert day(23) not in days  # 祝日
+    assert all(ar.get_week_number(d) != 1 for d in days)
+    # 曜日優先（月→火）× 週の優先順
+    assert days[:3] == [day(16), day(30), day(9)]
+
+
+def test_assigns_weeks_in_priority_order_and_keeps_the_rest_in_reserve():
+    avail = marks(d02="○", d09="○", d16="○", d17="○", d24="○", d30="○")
+    plan = BookingPlan(avail, 2026, 11, 2, target=TARGET)
+    assert plan.active == [3, 4]
+    assert plan.reserve == [5, 2, 1]
+    assert plan.by_week[3] == [day(16), day(17)]
+    assert plan.by_week[4] == [day(24)]  # 23日は祝日
+
+
+def test_tries_the_most_contended_head_first():
+    avail = marks(d09="○", d16="○", d24="○")
+    plan = BookingPlan(avail, 2026, 11, 3, scores={"20261109": 9.0}, target=TARGET)
+    assert plan.next_day() == day(9)
+    # 履歴がなければ既定の競合度（週の優先順で後ろほど高い・△は上乗せ）
+    plan = BookingPlan(marks(d09="○", d16="△", d24="○"), 2026, 11, 3, target=TARGET)
+    assert plan.next_day() == day(9)
+
+
+def test_failure_moves_to_next_day_then_promotes_a_reserve_week():
+    avail = marks(d16="○", d17="○", d24="○", d30="○")
+    plan = BookingPlan(avail, 2026, 11, 1, target=TARGET)
+    assert plan.active == [3]
+    plan.record(day(16), False)
+    assert plan.next_day() == day(17)
+    plan.record(day(17), False)
+    assert plan.active == [4]
+    plan.record(day(24), True)
+    assert plan.next_day() is None
+    assert plan.booked == [day(24)]
+
+
+def test_next_after_does_not_change_the_plan():
+    avail = marks(d16="○", d17="○", d24="○")
+    plan = BookingPlan(avail, 2026, 11, 2, target=TARGET)
+    first = plan.next_day()
+    guess = plan.next_after(first)
+    assert guess is not None and ar.get_week_number(guess) != ar.get_week_number(first)
+    assert plan.next_day() == first
+
+
+def test_drop_unavailable_retires_emptied_weeks():
+    avail = marks(d16="○", d24="○", d30="○")
+    plan = BookingPlan(avail, 2026, 11, 2, target=TARGET)
+    assert plan.active == [3, 4]
+    # 読み直したカレンダー（全日分）で16日が埋まっていた
+    plan.drop_unavailable(marks(d16="×", d24="○", d30="○"))
+    assert plan.active == [4, 5]
@@ -0,0 +1,52 @@
+# test_classify_page.py
+# classify_page: ポストバックのレスポンス本文から着いた画面を判定する
+from datetime import date, datetime
+
+import pytest
+
+import auto_reserve as ar
+import pf489_sim as sim
+import postback_client as pc
+
+
+def test_status_and_timeout_pages():
+    assert ar.classify_page("<html>Server Error</html>", status=500) == "error"
+    assert ar.classify_page("<p>セッションタイムアウトになりました。</p>") == "timeout"
+    # ログイン中の画面に出るカウントダウン等の文言はセッション切れではない
+    assert ar.classify_page('<a>ログアウト</a><p>セッションタイムアウトまであと5分</p>'
+                            '<table id="shisetsutbl"></table>') == "facility"
+    assert ar.classify_page("<html><body>お知らせ</body></html>") == "other"
+
+
+def test_timeslot_grid_wins_over_its_calendar_table():
+    html = ('<table class="calendar horizon toggle"><tr><td>'
+            '<input type="checkbox" name="checktime" value="1"></td></tr></table>')
+    assert ar.classify_page(html) == "timeslot"
+
+
+@pytest.fixture
+def base():
+    server, _, base = sim.start_in_thread(sim.SimConfig(latency=0, static_latency=0, today=date(2026, 10, 17)))
+    yield base
+    server.shutdown()
+    server.server_close()
+
+
+def test_each_step_of_the_simulated_site(base):
+    client = pc.PostbackClient(base, "", {})
+    url, html = client._request("GET", base)
+    client.doc = pc.Document(url, html)
+    assert ar.classify_page(client.postback("login").html) == "login"
+    client.postback("btnLogin", overrides={"userID": "a", "passWord": "pw"})
+    assert ar.classify_page(client.postback("ssCategory", "18").html) == "facility"
+    pc._set_checked(client.doc.inputs("checkShisetsu")[0])
+    assert ar.classify_page(client.postback("next").html) == "facility"  # 部屋選択
+    for box in client.doc.inputs("checkShitsujyo"):
+        pc._set_checked(box)
+    client.postback("next")
+    doc = client.postback("hyoji", overrides={"textDate": "2026/11/1", "radioPeriod": "1month"})
+    assert ar.classify_page(doc.html) == "calendar"
+    assert client.check_date(datetime(2026, 11, 2), ar.ROOM_LABEL)
+    assert ar.classify_page(client.postback("next").html) == "timeslot"
+    assert client.check_time_slots(ar.ROOM_LABEL, ar.WANTED_SLOTS)
+    assert ar.classify_page(client.postback("next").html) == "form"
@@ -0,0 +1,62 @@
+# test_clock_sync.py
+# estimate_server_offset: Date ヘッダー（1秒単位）の区間の共通部分からサーバー時計の差を推定する
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import auto_reserve as ar
+
+SKEW = 3.4  # テスト用サーバーの時計の進み（秒）
+
+
+class SkewedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def date_time_string(self, timestamp=None):
+        return formatdate(time.time() + SKEW, usegmt=True)
+
+    def log_message(self, *args):
+        pass
+
+
+def fake_probes(monkeypatch, records):
+    """_probe_server_date を (送信, 受信, Date) の列に差し替える（1件目は接続確立分として捨てられる）"""
+    it = iter(records)
+    monkeypatch.setattr(ar, "_probe_server_date", lambda conn, path: next(it))
+    monkeypatch.setattr(ar.time, "sleep", lambda sec: None)
+
+
+def test_offset_is_middle_of_interval_intersection(monkeypatch):
+    # 1件目 [103-100.1, 104-100.0] = [2.9, 4.0]、2件目 [204-200.6, 205-200.5] = [3.4, 4.5]
+    fake_probes(monkeypatch, [(0.0, 0.1, 0.0), (100.0, 100.1, 103.0), (200.5, 200.6, 204.0)])
+    sync = ar.estimate_server_offset("http://127.0.0.1:9/", samples=2)
+    assert abs(sync["offset"] - 3.7) < 1e-9
+    assert abs(sync["uncertainty"] - 0.3) < 1e-9
+    assert abs(sync["rtt_median"] - 0.1) < 1e-9
+    assert len(sync["samples"]) == 2
+
+
+def test_inconsistent_sample_does_not_empty_the_interval(monkeypatch):
+    # 2件目は1件目の区間と交わらない（[5.4, 6.5]）→ 捨てて1件目の区間のまま
+    fake_probes(monkeypatch, [(0.0, 0.1, 0.0), (100.0, 100.1, 103.0), (200.5, 200.6, 206.0)])
+    sync = ar.estimate_server_offset("http://127.0.0.1:9/", samples=2)
+    assert abs(sync["offset"] - 3.45) < 1e-9
+    assert abs(sync["uncertainty"] - 0.55) < 1e-9
+
+
+def test_estimates_skew_of_a_real_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SkewedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sync = ar.estimate_server_offset(f"http://127.0.0.1:{server.server_port}/", samples=4)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert abs(sync["offset"] - SKEW) <= sync["uncertainty"] + 0.05
+    assert sync["uncertainty"] < 0.5
@@ -0,0 +1,58 @@
+# test_history.py
+# 空き状況の履歴: 受付開始から何秒で埋まったか（day_outcomes）と、そこから求める競合度
+from datetime import datetime
+
+import history
+
+ROOM = "多目的ホール"
+
+
+def record(path, observations):
+    """[(YYYYMMDD, 受付開始からの秒, マーク)] を1件ずつスナップショットとして保存する"""
+    history.save_snapshots(path, [
+        (history.release_time(ymd) + sec, ROOM, {ymd: mark}) for ymd, sec, mark in observations
+    ])
+
+
+def test_release_time_is_first_of_previous_month_9am_jst():
+    assert history.release_time("20261102") == datetime.fromisoformat("2026-10-01T09:00:00+09:00").timestamp()
+    assert history.release_time("20270112") == datetime.fromisoformat("2026-12-01T09:00:00+09:00").timestamp()
+
+
+def test_day_outcomes(tmp_path):
+    db = tmp_path / "history.sqlite3"
+    record(db, [
+        ("20261102", -60, "×"), ("20261102", 5, "○"), ("20261102", 30, "×"),  # 受付前の観測は使わない
+        ("20261103", 5, "×"),                                                  # 最初から埋まっていた
+        ("20261109", 5, "○"), ("20261109", 600, "○"),                          # 最後まで空き
+        ("20261116", 5, "○"), ("20261116", 600, "△"),                          # △ はまだ空き
+    ])
+    history.save_snapshots(db, [(history.release_time("20261102") + 10, "別の部屋", {"20261102": "×"})])
+    with history.connect(db) as conn:
+        outcomes = {o["ymd"]: o for o in history.day_outcomes(conn, ROOM)}
+    assert set(outcomes) == {"20261102", "20261109", "20261116"}
+    assert outcomes["20261102"]["taken_after"] == 30
+    assert (outcomes["20261102"]["week"], outcomes["20261102"]["weekday"]) == (1, 0)
+    assert outcomes["20261109"]["taken_after"] is None
+    assert outcomes["20261109"]["observed"] == 600
+    assert outcomes["20261116"]["taken_after"] is None
+
+
+def test_contention_scores_rank_fast_filling_groups_first(tmp_path):
+    db = tmp_path / "history.sqlite3"
+    week1 = ["20261102", "20261207", "20270104"]  # 第1週の月曜: 10秒で埋まる
+    week2 = ["20261109", "20261214", "20270111"]  # 第2週の月曜: 埋まらない
+    record(db, [(ymd, 1, "○") for ymd in week1 + week2]
+           + [(ymd, 10, "×") for ymd in week1] + [(ymd, 3600, "○") for ymd in week2])
+
+    scores = history.contention_scores(db, ROOM, [datetime(2027, 2, 1), datetime(2027, 2, 8)])
+    assert scores["20270201"] > scores["20270208"] > 0
+    # 週・曜日どちらの統計もない日が混ざると尺度が揃わないので使わない
+    assert history.contention_scores(db, ROOM, [datetime(2027, 2, 1), datetime(2027, 2, 16)]) == {}
+    assert history.contention_scores(tmp_path / "missing.sqlite3", ROOM, [datetime(2027, 2, 1)]) == {}
+
+
+def test_groups_below_min_samples_are_ignored(tmp_path):
+    db = tmp_path / "history.sqlite3"
+    record(db, [("20261102", 1, "○"), ("20261102", 10, "×")])
+    assert history.contention_scores(db, ROOM, [datetime(2027, 2, 1)]) == {}
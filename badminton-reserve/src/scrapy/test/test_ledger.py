@@ -0,0 +1,60 @@
+# test_ledger.py
+# 複数アカウントの共有台帳: 同じ日・同じ週・全体の上限を押さえ合わない
+import json
+
+import accounts
+from accounts import Ledger
+
+
+def ledgers(tmp_path, limit=5):
+    path = tmp_path / "ledger.json"
+    return Ledger(path, "a", limit), Ledger(path, "b", limit)
+
+
+def test_same_day_and_same_week_go_to_the_first_claim(tmp_path):
+    a, b = ledgers(tmp_path)
+    assert a.claim("20261102", 1)
+    assert not b.claim("20261102", 1)
+    assert not b.claim("20261103", 1)  # 同じ第1週
+    assert b.claim("20261109", 2)
+    assert a.weeks_taken() == {2}
+    assert b.weeks_taken() == {1}
+
+
+def test_claim_is_reentrant_for_owner_until_settled(tmp_path):
+    a, _ = ledgers(tmp_path)
+    assert a.claim("20261102", 1)
+    assert a.claim("20261102", 1)
+    a.settle("20261102", True)
+    assert not a.claim("20261102", 1)  # 予約済みは押さえ直せない
+    assert a.snapshot()["20261102"]["state"] == "booked"
+
+
+def test_failed_settle_releases_the_week(tmp_path):
+    a, b = ledgers(tmp_path)
+    assert a.claim("20261102", 1)
+    b.settle("20261102", False)  # 他人の押さえは外せない
+    assert not b.claim("20261103", 1)
+    a.settle("20261102", False)
+    assert b.claim("20261103", 1)
+
+
+def test_limit_counts_claims_of_all_accounts(tmp_path):
+    a, b = ledgers(tmp_path, limit=2)
+    assert a.claim("20261102", 1)
+    assert b.claim("20261109", 2)
+    assert not a.claim("20261116", 3)
+
+
+def test_stale_claims_expire(tmp_path):
+    a, b = ledgers(tmp_path)
+    assert a.claim("20261102", 1)
+    a.settle("20261102", True)
+    assert a.claim("20261109", 2)
+    entries = json.loads(a.path.read_text(encoding="utf-8"))
+    entries["20261102"]["at"] -= accounts.CLAIM_TTL + 1
+    entries["20261109"]["at"] -= accounts.CLAIM_TTL + 1
+    a.path.write_text(json.dumps(entries), encoding="utf-8")
+    # 予約済みは残り、申込中のまま古くなった押さえだけ無効になる
+    assert b.claim("20261110", 2)
+    assert not b.claim("20261103", 1)
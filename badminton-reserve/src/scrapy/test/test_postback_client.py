@@ -0,0 +1,114 @@
+# test_postback_client.py
+# HTTP 経路（postback_client）: Document のフォーム状態と、pf489_sim を相手にした予約の流れ
+from datetime import date, datetime
+
+import pytest
+
+import auto_reserve as ar
+import pf489_sim as sim
+import postback_client as pc
+
+DAY = datetime(2026, 11, 2)      # 月曜・第1週
+EVENING_BUSY = "20261109"        # 夜の1枠だけ埋まり（△だが希望の3枠は取れない）
+
+
+def test_form_fields_follow_browser_submission_rules():
+    doc = pc.Document("http://example.test/a.aspx", """
+        <form action="b.aspx">
+          <input type="hidden" name="__VIEWSTATE" value="vs">
+          <input type="checkbox" name="checkdate" value="20261102" checked>
+          <input type="checkbox" name="checkdate" value="20261103">
+          <input type="text" name="disabledField" value="x" disabled>
+          <input type="submit" name="btn" value="go">
+          <select name="sel"><option value="1">a</option><option value="2" selected>b</option></select>
+          <textarea name="memo">メモ</textarea>
+        </form>
+        <div class="message">既に予約されています: 20261102</div>
+    """)
+    assert doc.form_fields() == [
+        ("__VIEWSTATE", "vs"), ("checkdate", "20261102"), ("sel", "2"), ("memo", "メモ"),
+    ]
+    assert doc.action_url() == "http://example.test/b.aspx"
+    assert ar.mentions_day(doc.messages(), DAY)
+
+
+@pytest.fixture
+def site():
+    config = sim.SimConfig(latency=0, static_latency=0, today=date(2026, 10, 17),
+                           busy=sim.parse_availability(f"{EVENING_BUSY}=e"))
+    server, state, base = sim.start_in_thread(config)
+    yield state, base
+    server.shutdown()
+    server.server_close()
+
+
+def to_calendar(base: str, user: str) -> pc.PostbackClient:
+    """ログイン → 施設 → 部屋 → 1ヶ月表示 までをブラウザの代わりに HTTP で進める"""
+    client = pc.PostbackClient(base, "", {})
+    url, html = client._request("GET", base)
+    client.doc = pc.Document(url, html)
+    client.postback("login")
+    client.postback("btnLogin", overrides={"userID": user, "passWord": "pw"})
+    client.postback("ssCategory", "18")
+    pc._set_checked(client.doc.inputs("checkShisetsu")[0])
+    client.postback("next")
+    for box in client.doc.inputs("checkShitsujyo"):
+        pc._set_checked(box)
+    client.postback("next")
+    client.postback("hyoji", overrides={"textDate": "2026/11/1", "radioPeriod": "1month"})
+    return client
+
+
+def test_reads_calendar_marks(site):
+    _, base = site
+    client = to_calendar(base, "a")
+    assert client.calendar_year_month() == (2026, 11)
+    marks = client.read_all_availability(ar.ROOM_LABEL)
+    assert marks[DAY.strftime("%Y%m%d")] == "○"
+    assert marks[EVENING_BUSY] == "△"
+
+
+def test_check_time_slots_refuses_partly_busy_evening(site):
+    _, base = site
+    client = to_calendar(base, "a")
+    assert client.check_date(datetime(2026, 11, 9), ar.ROOM_LABEL)
+    client.postback("next")
+    assert client.doc.has_input("checktime")
+    assert not client.check_time_slots(ar.ROOM_LABEL, ar.WANTED_SLOTS)
+
+
+def test_books_a_day_and_loser_sees_its_day_in_messages(site, monkeypatch):
+    state, base = site
+    monkeypatch.setattr(ar, "DRY_RUN", False)
+    winner, loser = to_calendar(base, "a"), to_calendar(base, "b")
+
+    # 負ける側を申込確認画面まで進めておく
+    assert loser.check_date(DAY, ar.ROOM_LABEL)
+    loser.postback("next")
+    assert loser.check_time_slots(ar.ROOM_LABEL, ar.WANTED_SLOTS)
+    loser.postback("next")
+    loser.postback("next", overrides=loser.fill_application_form())
+
+    assert pc.book_single_day_http(winner, DAY) is True
+    assert [b["owner"] for b in state.bookings if b["ymd"] == DAY.strftime("%Y%m%d")] == ["a"]
+
+    loser.postback("next")
+    assert ar.mentions_day(loser.doc.messages(), DAY)
+
+
+def test_unclear_result_after_apply_is_not_retried(site, monkeypatch):
+    state, base = site
+    monkeypatch.setattr(ar, "DRY_RUN", False)
+    client = to_calendar(base, "a")
+    send = client.postback
+
+    def postback(*args, **kwargs):
+        doc = send(*args, **kwargs)
+        if client.applied:
+            # 申込は通ったが、結果画面が崩れて届いた
+            return pc.Document(doc.url, "<html><body><form></form>しばらくお待ちください</body></html>")
+        return doc
+
+    monkeypatch.setattr(client, "postback", postback)
+    assert pc.book_single_day_http(client, DAY) == ar.APPLY_UNCLEAR
+    assert [b["owner"] for b in state.bookings if b["ymd"] == DAY.strftime("%Y%m%d")] == ["a"]
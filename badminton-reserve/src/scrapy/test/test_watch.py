@@ -0,0 +1,51 @@
+# test_watch.py
+# キャンセル待ち: 再読込の間隔と、空きに変わった日の検出
+from datetime import datetime
+
+import auto_reserve as ar
+import watch
+from watch import WATCH_BACKOFF, WATCH_MAX_INTERVAL, WATCH_MIN_INTERVAL
+
+
+def test_next_interval_backs_off_and_resets():
+    assert watch.next_interval(60, changed=False, error=False, hot=False) == 60 * WATCH_BACKOFF
+    assert watch.next_interval(60, changed=False, error=True, hot=False) == 120
+    assert watch.next_interval(WATCH_MAX_INTERVAL, changed=False, error=True, hot=False) == WATCH_MAX_INTERVAL
+    assert watch.next_interval(WATCH_MAX_INTERVAL, changed=True, error=False, hot=False) == WATCH_MIN_INTERVAL
+    assert watch.next_interval(1, changed=False, error=False, hot=False) == WATCH_MIN_INTERVAL
+    # キャンセル期限の前後は変化がなくても最短
+    assert watch.next_interval(WATCH_MAX_INTERVAL, changed=False, error=False, hot=True) == WATCH_MIN_INTERVAL
+
+
+def test_diff_marks():
+    prev = {"20261102": "×", "20261109": "○", "20261116": "△"}
+    cur = {"20261102": "○", "20261109": "○", "20261123": "○"}
+    assert watch.diff_marks(prev, prev) == {}
+    assert watch.diff_marks(prev, cur) == {
+        "20261102": ("×", "○"),
+        "20261116": ("△", ""),
+        "20261123": ("", "○"),
+    }
+
+
+def test_opened_days_only_returns_newly_open_wanted_days(monkeypatch):
+    monkeypatch.setattr(ar, "HISTORY_DB", None)
+    diff = {
+        "20261102": ("×", "○"),   # 第1週の月曜: 空いた
+        "20261103": ("×", "○"),   # 文化の日
+        "20261110": ("○", "△"),   # 元から空いていた
+        "20261116": ("×", "△"),   # 第3週の月曜: 空いた
+        "20261124": ("×", "○"),   # 予約済みの第4週
+        "20261105": ("×", "○"),   # 木曜だが今日より前
+    }
+    days = watch.opened_days(datetime(2026, 11, 1), diff, {4}, today=datetime(2026, 11, 5))
+    assert days == [datetime(2026, 11, 16)]
+    days = watch.opened_days(datetime(2026, 11, 1), diff, {4}, today=datetime(2026, 10, 20))
+    assert sorted(days) == [datetime(2026, 11, 2), datetime(2026, 11, 5), datetime(2026, 11, 16)]
+
+
+def test_hot_window_around_cancel_deadline():
+    months = [datetime(2026, 11, 1)]
+    # 11/16（月）の7日前 0:00 の前後
+    assert watch.in_hot_window(datetime(2026, 11, 9, 0, 30, tzinfo=ar.JST), months)
+    assert not watch.in_hot_window(datetime(2026, 11, 9, 12, 0, tzinfo=ar.JST), months)
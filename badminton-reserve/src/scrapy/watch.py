@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+キャンセル待ち（--watch）
+
+ログインしたままカレンダーに居続け、今月・来月の空き状況を定期的に読み直す。
+前回のスナップショットと比べて、希望の曜日・週（WEEKDAY_PRIORITY / WEEK_PRIORITY、
+--targets の weekdays / weeks）の日が ○/△ に変わったら、その場で予約する。
+
+- 間隔は変化がなければ WATCH_BACKOFF 倍ずつ WATCH_MAX_INTERVAL まで延ばし、
+  変化があれば WATCH_MIN_INTERVAL に戻す。エラーが続くときは倍々で延ばす。
+- 候補日のキャンセル期限（利用日の CANCEL_DEADLINE_DAYS 日前 0:00）の前後
+  HOT_WINDOW 秒は、空きが出やすいので最短間隔で見る。
+- 起動時に既に空いている日は基準として記録するだけで予約しない（毎月1日の予約で
+  見送った日を取り直さない）。予約は1週1日・1ヶ月 MAX_DAYS 日まで（この実行中の分）。
+- 何日も動かし続けられるよう、計測区間・履歴バッファは毎回捨て、ページは
+  WATCH_RECYCLE_SEC ごとに開き直す。履歴（history.sqlite3）には変化があったときだけ書く。
+
+Usage:
+    python auto_reserve.py --watch
+    python auto_reserve.py --watch --watch-hours 12 --targets targets.toml
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import auto_reserve as ar
+from auto_reserve import OK_MARKS, WEEKDAY_JA, debug
+
+# 再読込の間隔（秒）。最大はセッション維持の間隔を超えないようにする
+WATCH_MIN_INTERVAL = 30
+WATCH_MAX_INTERVAL = ar.KEEPALIVE_INTERVAL
+WATCH_BACKOFF = 1.5
+# 間隔を ±この割合だけ揺らす（毎回同じ秒に叩かない）
+WATCH_JITTER = 0.1
+# キャンセル期限（利用日の N 日前の 0:00 JST）と、その前後で最短間隔にする幅（秒）
+CANCEL_DEADLINE_DAYS = [7, 1]
+HOT_WINDOW = 3600
+# ブラウザのページを開き直す間隔（秒）。長時間動かしたときのメモリ増加を抑える
+WATCH_RECYCLE_SEC = 6 * 3600
+
+
+def watch_months(now: datetime) -> list[datetime]:
+    """見張る月（今月・来月の1日）"""
+    this_month = datetime(now.year, now.month, 1)
+    return [this_month, ar.first_of_next_month(this_month)]
+
+
+def in_hot_window(now: datetime, months: list[datetime]) -> bool:
+    """いずれかの候補日のキャンセル期限の前後 HOT_WINDOW 秒以内か"""
+    for month in months:
+        for d in ar.build_candidate_days(month.year, month.month, set()):
+            for n in CANCEL_DEADLINE_DAYS:
+                deadline = datetime(d.year, d.month, d.day, tzinfo=ar.JST) - timedelta(days=n)
+                if abs((now - deadline).total_seconds()) <= HOT_WINDOW:
+                    return True
+    return False
+
+
+def next_interval(interval: float, changed: bool, error: bool, hot: bool) -> float:
+    """次の再読込までの秒数（変化あり=最短、変化なし=WATCH_BACKOFF 倍、エラー=2倍）"""
+    if changed:
+        interval = WATCH_MIN_INTERVAL
+    elif error:
+        interval = interval * 2
+    else:
+        interval = interval * WATCH_BACKOFF
+    interval = min(max(interval, WATCH_MIN_INTERVAL), WATCH_MAX_INTERVAL)
+    if hot:
+        interval = WATCH_MIN_INTERVAL
+    return interval
+
+
+def diff_marks(prev: dict[str, str], cur: dict[str, str]) -> dict[str, tuple[str, str]]:
+    """マークが変わった日: {YYYYMMDD: (前, 今)}"""
+    if prev == cur:
+        return {}
+    return {ymd: (prev.get(ymd, ""), cur.get(ymd, ""))
+            for ymd in prev.keys() | cur.keys() if prev.get(ymd, "") != cur.get(ymd, "")}
+
+
+def opened_days(month: datetime, diff: dict[str, tuple[str, str]], booked_weeks: set[int],
+                today: datetime) -> list[datetime]:
+    """空きになった希望日（曜日・週の優先順、履歴があれば競合度の高い順）"""
+    scores = ar.history_scores(month.year, month.month)
+    days = [
+        d for d in ar.build_candidate_days(month.year, month.month, booked_weeks)
+        if d.date() > today.date()
+        and (ymd := d.strftime("%Y%m%d")) in diff
+        and diff[ymd][1] in OK_MARKS and diff[ymd][0] not in OK_MARKS
+    ]
+    return sorted(days, key=lambda d: -scores.get(d.strftime("%Y%m%d"), 0.0))
+
+
+def poll_month(page, month: datetime) -> dict[str, str]:
+    """カレンダーを対象月で再表示して空きマークを読む（セッションが切れていれば入り直す）"""
+    if ar.is_session_timeout(page):
+        debug("[watch] セッション切れ → カレンダーまで入り直し")
+        ar.setup_calendar(page, month)
+    else:
+        ar.refresh_calendar(page, month)
+    return ar.read_all_availability(page, ar.ROOM_LABEL)
+
+
+def run_watch(ctx, page, until: datetime | None = None) -> list[datetime]:
+    """until（None なら止めるまで）空き状況を見張り、空いた希望日を予約する。戻り値: 予約できた日"""
+    booked: list[datetime] = []
+    booked_weeks: dict[tuple[int, int], set[int]] = {}
+    previous: dict[tuple[int, int], dict[str, str]] = {}
+    interval = WATCH_MIN_INTERVAL
+    parked_at = time.monotonic()
+    polls = 0
+
+    ar.setup_calendar(page, watch_months(datetime.now(ar.JST))[0])
+    debug(f"[watch] 開始: {ar.ROOM_LABEL} / 間隔 {WATCH_MIN_INTERVAL}〜{WATCH_MAX_INTERVAL}s"
+          + (f" / {until.strftime('%Y-%m-%d %H:%M')} まで" if until else ""))
+    try:
+        while until is None or datetime.now(ar.JST) < until:
+            now = datetime.now(ar.JST)
+            months = watch_months(now)
+            keys = {(m.year, m.month) for m in months}
+            # 過ぎた月の記録は捨てる
+            previous = {k: v for k, v in previous.items() if k in keys}
+            booked_weeks = {k: v for k, v in booked_weeks.items() if k in keys}
+            changed = error = False
+            try:
+                if time.monotonic() - parked_at >= WATCH_RECYCLE_SEC:
+                    debug("[watch] ページを開き直します")
+                    # DIAG_LEVEL 2 のトレースも区切って書き出す（溜め続けない）
+                    ar.stop_tracing(ctx, "trace_watch")
+                    ar.start_tracing(ctx)
+                    page.close()
+                    page = ctx.new_page()
+                    page.set_default_navigation_timeout(30000)
+                    ar.setup_calendar(page, months[0])
+                    parked_at = time.monotonic()
+
+                for month in months:
+                    key = (month.year, month.month)
+                    availability = poll_month(page, month)
+                    prev = previous.get(key)
+                    previous[key] = availability
+                    if prev is None:
+                        debug(f"[watch] {month.year}年{month.month}月 基準: "
+                              f"空き {sum(m in OK_MARKS for m in availability.values())}日")
+                        ar.flush_history()
+                        continue
+                    diff = diff_marks(prev, availability)
+                    if not diff:
+                        # 変化のないスナップショットは履歴に残さない
+                        ar.HISTORY_BUFFER.clear()
+                        continue
+                    changed = True
+                    ar.flush_history()
+                    changes = ", ".join(f"{ymd[4:6]}/{ymd[6:]} {a or '-'}→{b or '-'}"
+                                        for ymd, (a, b) in sorted(diff.items()))
+                    debug(f"[watch] {month.year}年{month.month}月 変化: {changes}")
+
+                    weeks = booked_weeks.setdefault(key, set())
+                    for d in opened_days(month, diff, weeks, now):
+                        if len(weeks) >= ar.MAX_DAYS:
+                            break
+                        if ar.get_week_number(d) in weeks:
+                            continue
+                        with ar.span("book_day", day=d.strftime("%Y-%m-%d")) as rec:
+                            rec["ok"] = ok = ar.book_single_day(page, d)
+                        if ok:
+                            booked.append(d)
+                            weeks.add(ar.get_week_number(d))
+                            debug(f"[watch] 予約成功: {d.strftime('%Y-%m-%d')}({WEEKDAY_JA[d.weekday()]}) "
+                                  f"第{ar.get_week_number(d)}週")
+                        ar.write_timeline("timeline_watch")
+                        ar.restore_calendar(page, month)
+                    ar.flush_history()
+            except Exception as e:
+                error = True
+                debug(f"[watch] 再読込に失敗: {e}")
+                ar.save_diag(page, "watch_error", level=1)
+            finally:
+                # 何日も動かすので、実行単位の記録は1回ごとに捨てる
+                ar.SPANS.clear()
+                ar.RUN_MARKS.clear()
+                ar.RESTORE_TIMINGS.clear()
+                ar.NAV_TIMINGS.clear()
+                ar.HISTORY_BUFFER.clear()
+
+            polls += 1
+            hot = in_hot_window(now, months)
+            interval = next_interval(interval, changed, error, hot)
+            if polls % 20 == 0 or changed:
+                debug(f"[watch] {polls}回目 / 次は {interval:.0f}s 後{'（キャンセル期限付近）' if hot else ''}"
+                      f" / 予約 {len(booked)}日")
+            time.sleep(interval * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER))
+    except KeyboardInterrupt:
+        debug("[watch] 中断")
+    debug(f"[watch] 終了: {polls}回 / 予約 {len(booked)}日")
+    return booked